@@ -30,20 +30,27 @@ bl_info = {
 	"name": "SEGA Virtua Processor format (.svp)",
 	"author": "Ralakimus",
 	"version": (1, 0, 0),
-	"blender": (2, 80, 0),
+	"blender": (2, 81, 0),
 	"location": "File > Import-Export",
 	"description": "Import-Export SVP, Import SVP mesh",
 	"category": "Import-Export"}
 
 # Imports
-import bpy, bgl, bmesh, struct, os, mathutils;
+import bpy, bgl, bmesh, struct, os, sys, time, mathutils;
+import numpy as np;
+import svplib, svplib.bundle, svplib.cache, svplib.culling, svplib.decimate, svplib.export, svplib.raster, svplib.rom, svplib.sorting, svplib.stats, svplib.validate;
 from bpy.props import (StringProperty)
+from bpy.app.handlers import persistent
 from bpy_extras.io_utils import (ImportHelper, ExportHelper, orientation_helper, axis_conversion)
 
-# Show message box
+# Timing instrumentation, enabled from the SVP Stats panel
+svp_stats = svplib.stats.PhaseStats();
+
+# Show message box, a line per label
 def show_message(message, title, icon):
 	def draw(self, context):
-		self.layout.label(text=message);
+		for line in message.split("\n"):
+			self.layout.label(text=line);
 	bpy.context.window_manager.popup_menu(draw, title=title, icon=icon);
 
 # MD color to RGB
@@ -61,206 +68,622 @@ class ImportSVP(bpy.types.Operator, ImportHelper):
 	bl_options = {"PRESET", "UNDO"};
 
 	filename_ext = ".svp";
-	filter_glob: StringProperty(default="*.svp", options={"HIDDEN"});
+	filter_glob: StringProperty(default="*.svp;*.svpb", options={"HIDDEN"});
+	weld_vertices: bpy.props.BoolProperty(name="Weld Vertices", default=False,
+		description="Share vertices with identical coordinates between faces, exporting gives back the same file");
+	bundle_models: StringProperty(name="Bundle Models", default="",
+		description="Models to import from a bundle, like 0, 2, 5-9, or empty for every model");
 
 	def execute(self, context):
-		return import_svp(context, self.filepath);
-
-# Import the model
-def import_svp(context, path):
-	# Open model
-	data = open(path, mode="rb").read();
+		try:
+			indices = parse_indices(self.bundle_models);
+		except ValueError:
+			show_message("Bundle models must be a list of numbers and ranges, like 0, 2, 5-9.", "Error", "ERROR");
+			return {"CANCELLED"};
+		return import_svp(context, self.filepath, self.weld_vertices, indices);
+
+# Parse a list of model indices like "0, 2, 5-9", returns None if it is empty
+def parse_indices(text):
+	indices = [];
+	for part in text.replace(" ", "").split(","):
+		if part:
+			first, dash, last = part.partition("-");
+			indices.extend(range(int(first), int(last if dash else first) + 1));
+	return indices or None;
+
+# Decode a model from mapped data, or get it from the cache
+#   size - Size of the model if known, checked against the decoded model
+def decode_model(cache, data, offset=0, size=None):
+	if cache is None:
+		with svp_stats.timed("import.decode"):
+			model = svplib.parse_svp(data, offset);
+	else:
+		with svp_stats.timed("import.hash"):
+			key = svplib.rom.hash_range(data, offset, (len(data) - offset) if (size is None) else size);
+		with svp_stats.timed("import.cache"):
+			model = cache.get(key);
+		if model is None:
+			with svp_stats.timed("import.decode"):
+				model = svplib.parse_svp(data, offset);
+			try:
+				cache.put(key, model);
+			except OSError as error:
+				print("Could not cache model:", error);
+	if (size is not None) and (model.byte_size != size):
+		raise svplib.SVPError("Model at 0x%X is %d bytes, but its table entry says %d." % (offset, model.byte_size, size));
+	return model;
+
+# Import the model, or the models of a bundle
+#   indices - Models to import from a bundle, every model if None
+def import_svp(context, path, weld=False, indices=None):
+	# Map and decode the models, a bundle only decodes the ones being imported
+	cache = get_model_cache(context);
+	models = [];
+	try:
+		with svp_stats.timed("import.read"):
+			data = svplib.rom.map_file(path);
+		with data:
+			if svplib.bundle.is_bundle(data):
+				entries, names = svplib.bundle.read_bundle_table(data);
+				for index in (range(len(entries)) if (indices is None) else indices):
+					if not (0 <= index < len(entries)):
+						raise svplib.SVPError("The bundle has no model %d, it has %d models." % (index, len(entries)));
+					models.append((names[index] or "SVP Model %d" % index, decode_model(cache, data, *entries[index])));
+			else:
+				models.append(("SVP Model", decode_model(cache, data)));
+	except (svplib.SVPError, OSError) as error:
+		show_message(str(error), "Error", "ERROR");
+		return {"CANCELLED"};
 
-	# Get face count
-	face_count = struct.unpack(">H", data[:2])[0] + 1;
-	print("Face count:", face_count);
-	
-	# Prepare model data
-	vert_data = [];
-	face_data = [];
-	col_data = [];
-	dither_data = [];
-	cull_data = [];
-	flag_data = [];
-	cur_vert = 0;
-	
-	# Parse and load faces
-	data_offset = 2;
-	for i in range(face_count):
-		# Get colors
-		color = struct.unpack(">B", data[data_offset:data_offset+1:])[0];
-		col_data.append(color);
-		data_offset += 1;
-		
-		# Get flags
-		flags = struct.unpack(">B", data[data_offset:data_offset+1:])[0];
-		data_offset += 1;
-		
-		# Square flag
-		is_square = (flags & 0x10) == 0;
-			
-		# Dither pattern
-		dither_data.append((flags & 0x20) >> 5);
-			
-		# Culling
-		cull_data.append((flags & 0x40) >> 6);
-
-		# Flags (something to do with Z-sorting it seems)
-		flag_data.append(flags & 0xF);
-			
-		# Get face vertices
-		verts = [];
-		for j in range(3*3):
-			verts.append(struct.unpack(">h", data[data_offset:data_offset+2:])[0] / 256.0);
-			data_offset += 2;
-		vert_data.append((verts[0], verts[2], verts[1]));
-		vert_data.append((verts[3], verts[5], verts[4]));
-		vert_data.append((verts[6], verts[8], verts[7]));
-			
-		# Square
-		if (is_square):
-			for j in range(3):
-				verts.append(struct.unpack(">h", data[data_offset:data_offset+2:])[0] / 256.0);
-				data_offset += 2;
-			vert_data.append((verts[9], verts[11], verts[10]));
-			face_data.append((cur_vert, cur_vert+1, cur_vert+2, cur_vert+3));
-			cur_vert += 4;
-				
-		# Triangle
-		else:
-			face_data.append((cur_vert, cur_vert+1, cur_vert+2));
-			cur_vert += 3;
-			
-	# Create the object
-	view_layer = context.view_layer;
-	collection = view_layer.active_layer_collection.collection;
+	# Create the objects
 	if bpy.ops.object.select_all.poll():
 		bpy.ops.object.select_all(action="DESELECT")
-	mesh_data = bpy.data.meshes.new("SVP Model Mesh");
-	mesh_data.from_pydata(vert_data, [], face_data);
-	mesh_data.update();
-	obj = bpy.data.objects.new("SVP Model", mesh_data);
+	for name, model in models:
+		print("Face count:", model.face_count);
+		if weld:
+			with svp_stats.timed("import.weld"):
+				model = svplib.weld_vertices(model);
+		add_svp_object(context, model, name);
+	context.view_layer.update();
+
+	return {"FINISHED"};
+
+# Add-on preferences
+class SVPPreferences(bpy.types.AddonPreferences):
+	bl_idname = __name__;
+
+	use_cache: bpy.props.BoolProperty(name="Cache Decoded Models", default=True,
+		description="Keep decoded models on disk, keyed by a hash of their file, so importing them again skips decoding");
+	cache_folder: StringProperty(name="Cache Folder", subtype="DIR_PATH", default="",
+		description="Folder of the model cache, the user cache folder if empty");
+	cache_size: bpy.props.IntProperty(name="Cache Size (MB)", default=svplib.cache.DEFAULT_MAX_BYTES >> 20, min=1);
+
+	def draw(self, context):
+		layout = self.layout;
+		layout.prop(self, "use_cache");
+		col = layout.column();
+		col.enabled = self.use_cache;
+		col.prop(self, "cache_folder");
+		col.prop(self, "cache_size");
+
+# Get the model cache, or None if it is disabled
+def get_model_cache(context):
+	addon = context.preferences.addons.get(__name__);
+	if (addon is None) or not addon.preferences.use_cache:
+		return None;
+	prefs = addon.preferences;
+	try:
+		return svplib.cache.ModelCache(bpy.path.abspath(prefs.cache_folder) or None, prefs.cache_size << 20);
+	except OSError as error:
+		print("Could not open model cache:", error);
+		return None;
+
+# Add an object for a decoded model to the active collection, and select it
+def add_svp_object(context, model, name):
+	collection = context.view_layer.active_layer_collection.collection;
+	mesh_data = svp_model_to_mesh(model, name + " Mesh");
+	obj = bpy.data.objects.new(name, mesh_data);
 	collection.objects.link(obj);
 	obj.select_set(True);
-	view_layer.update();
+	return obj;
 
-	# Get BMesh
-	bm = bmesh.new();
-	if obj.mode == "EDIT":
-		bm = bmesh.from_edit_mesh(obj.data);
-	else:
-		bm.from_mesh(obj.data);
-
-	# Assign palette and dither IDs
-	pal_tag = bm.faces.layers.int.new("palette_ids");
-	dither_tag = bm.faces.layers.int.new("dither_ids");
-	cull_tag = bm.faces.layers.int.new("cull_ids");
-	flag_tag = bm.faces.layers.int.new("flag_ids");
-	if hasattr(bm.faces, "ensure_lookup_table"): 
-		bm.faces.ensure_lookup_table();
-	for i in range(0, len(face_data)):
-		bm.faces[i][pal_tag] = col_data[i];
-		bm.faces[i][dither_tag] = dither_data[i];
-		bm.faces[i][cull_tag] = cull_data[i];
-		bm.faces[i][flag_tag] = flag_data[i];
+# ROM import helper
+class ImportSVPROM(bpy.types.Operator, ImportHelper):
+	"""Import SEGA Virtua Processor models found in a ROM dump or bank file"""
+	bl_idname = "import_scene.svp_rom";
+	bl_label = "Import SVP ROM";
+	bl_options = {"PRESET", "UNDO"};
 
-	# Save changes
-	if obj.mode == "EDIT":
-		bmesh.update_edit_mesh(obj.data);
-	else:
-		bm.to_mesh(obj.data);
+	filename_ext = ".bin";
+	filter_glob: StringProperty(default="*.bin;*.md;*.gen;*.smd;*.32x", options={"HIDDEN"});
+	model_offset: bpy.props.IntProperty(name="Offset", default=-1, min=-1,
+		description="ROM offset of the model to import, or -1 to import every indexed model");
+	rebuild_index: bpy.props.BoolProperty(name="Rebuild Index", default=False,
+		description="Scan the ROM again, even if it has an up to date index");
+	min_faces: bpy.props.IntProperty(name="Minimum Faces", default=svplib.rom.DEFAULT_SETTINGS["min_faces"], min=1, max=svplib.model.MAX_FACES);
+	max_faces: bpy.props.IntProperty(name="Maximum Faces", default=svplib.rom.DEFAULT_SETTINGS["max_faces"], min=1, max=svplib.model.MAX_FACES);
+	weld_vertices: bpy.props.BoolProperty(name="Weld Vertices", default=False,
+		description="Share vertices with identical coordinates between faces, exporting gives back the same models");
+
+	def execute(self, context):
+		return import_svp_rom(context, self.filepath, self.model_offset, self.rebuild_index, self.weld_vertices,
+			min_faces=self.min_faces, max_faces=self.max_faces);
+
+# Import models from a ROM, through its index
+def import_svp_rom(context, path, offset=-1, rebuild_index=False, weld=False, **settings):
+	try:
+		with svplib.rom.SVPRom(path) as rom:
+			with svp_stats.timed("import.index"):
+				index = rom.load_index(rebuild_index, **settings);
+			entries = [entry for entry in index["models"] if (offset < 0) or (entry["offset"] == offset)];
+			if len(entries) == 0:
+				show_message("No SVP models found.", "Error", "ERROR");
+				return {"CANCELLED"};
+
+			# Only decode the models being imported
+			if bpy.ops.object.select_all.poll():
+				bpy.ops.object.select_all(action="DESELECT")
+			for entry in entries:
+				with svp_stats.timed("import.decode"):
+					model = rom.model(entry["offset"]);
+				if weld:
+					with svp_stats.timed("import.weld"):
+						model = svplib.weld_vertices(model);
+				add_svp_object(context, model, "SVP Model 0x%06X" % entry["offset"]);
+	except (svplib.SVPError, OSError) as error:
+		show_message(str(error), "Error", "ERROR");
+		return {"CANCELLED"};
+	print("Imported %d models" % len(entries));
+	context.view_layer.update();
 
 	return {"FINISHED"};
 
+# Get a face attribute layer of a mesh
+def get_face_layer(mesh, name, create=False):
+	if hasattr(mesh, "attributes"):
+		layer = mesh.attributes.get(name);
+		if (layer is None) and create:
+			layer = mesh.attributes.new(name, "INT", "FACE");
+	else:
+		layer = mesh.polygon_layers_int.get(name);
+		if (layer is None) and create:
+			layer = mesh.polygon_layers_int.new(name=name);
+	return layer;
+
+# Create a mesh from a decoded model
+def svp_model_to_mesh(model, name):
+	mesh_data = bpy.data.meshes.new(name);
+
+	# Geometry
+	with svp_stats.timed("import.mesh"):
+		mesh_data.vertices.add(len(model.coords));
+		mesh_data.loops.add(model.loop_count);
+		mesh_data.polygons.add(model.face_count);
+		mesh_data.vertices.foreach_set("co", model.positions());
+		mesh_data.loops.foreach_set("vertex_index", model.face_vertices.astype(np.int32));
+		mesh_data.polygons.foreach_set("loop_start", model.face_starts().astype(np.int32));
+		if not mesh_data.polygons.bl_rna.properties["loop_total"].is_readonly:
+			mesh_data.polygons.foreach_set("loop_total", model.face_sizes.astype(np.int32));
+
+	# Palette, dither, culling and flag IDs
+	with svp_stats.timed("import.layers"):
+		for layer_name, values in (("palette_ids", model.palette), ("dither_ids", model.dither),
+			("cull_ids", model.cull), ("flag_ids", model.flags)):
+			get_face_layer(mesh_data, layer_name, True).data.foreach_set("value", values.astype(np.int32));
+
+	with svp_stats.timed("import.update"):
+		mesh_data.update(calc_edges=True);
+	return mesh_data;
+
+# Export fix options, shared by the export operators
+class SVPExportFixes:
+	fix_ngons: bpy.props.BoolProperty(name="Split N-gons", default=False,
+		description="Split faces with more than 4 vertices into quads and a triangle");
+	fix_non_planar: bpy.props.BoolProperty(name="Split Non-Planar Quads", default=False,
+		description="Split quads that are not flat into two triangles");
+	fix_range: bpy.props.BoolProperty(name="Clamp Coordinates", default=False,
+		description="Clamp coordinates outside of -128 to 127.996 instead of failing, they would wrap around otherwise");
+	fix_face_count: bpy.props.BoolProperty(name="Split Large Objects", default=False,
+		description="Export objects with more than 65536 faces as more than one model");
+
+	# Get the enabled fixes
+	def get_fixes(self):
+		return tuple(fix for fix, enabled in (
+			(svplib.validate.FIX_NGONS, self.fix_ngons),
+			(svplib.validate.FIX_NON_PLANAR, self.fix_non_planar),
+			(svplib.validate.FIX_RANGE, self.fix_range),
+			(svplib.validate.FIX_FACE_COUNT, self.fix_face_count)) if enabled);
+
+# Report the problems found in the objects being exported, returns False if any errors are left
+#   object_issues - (object name, issues) pairs
+def report_export_issues(object_issues):
+	errors = [];
+	for name, issues in object_issues:
+		for issue in issues:
+			print("%s: %s: %s" % (name, "Error" if (issue.error and not issue.fixed) else "Warning", issue));
+			if issue.error and not issue.fixed:
+				errors.append("%s: %s" % (name, issue));
+	if len(errors) > 0:
+		show_message("\n".join(errors), "Error", "ERROR");
+		return False;
+	return True;
+
 # Export helper
-class ExportSVP(bpy.types.Operator, ExportHelper):
+class ExportSVP(bpy.types.Operator, ExportHelper, SVPExportFixes):
 	"""Export a SEGA Virtua Processor Model File"""
 	bl_idname = "export_scene.svp";
 	bl_label = "Export SVP";
 	bl_options = {"PRESET"};
 
 	filename_ext = ".svp"
-	filter_glob: StringProperty(default="*.svp", options={"HIDDEN"});
+	filter_glob: StringProperty(default="*.svp;*.svpb", options={"HIDDEN"});
+	use_bundle: bpy.props.BoolProperty(name="Bundle", default=False,
+		description="Write the models of every object as a bundle, with a table to find each one by, instead of one after another");
+	use_incremental: bpy.props.BoolProperty(name="Only Export Changes", default=True,
+		description="Reuse the encoded models of objects that did not change since the last export, and only write what changed");
+
+	# Bundles get their own extension, swapped in for the other one
+	def check(self, context):
+		filepath = self.filepath;
+		self.filename_ext = svplib.bundle.BUNDLE_EXTENSION if self.use_bundle else ".svp";
+		root, ext = os.path.splitext(filepath);
+		if ext.lower() in (".svp", svplib.bundle.BUNDLE_EXTENSION):
+			self.filepath = root;
+		super().check(context);
+		return self.filepath != filepath;
 
 	def execute(self, context):
-		return export_svp(context, self.filepath);
+		return export_svp(context, self.filepath, self.use_bundle, self.use_incremental, self.get_fixes());
+
+# Encoded models of every object from the last export, and the objects changed since then
+svp_export_cache = svplib.export.IncrementalFile();
+svp_export_dirty = set();
+
+# Get the names of the objects whose geometry or face layers changed in a depsgraph update
+def get_updated_objects(depsgraph, scene):
+	names = set();
+	meshes = set();
+	for update in depsgraph.updates:
+		if isinstance(update.id, bpy.types.Object):
+			if update.is_updated_geometry:
+				names.add(update.id.name);
+		elif isinstance(update.id, bpy.types.Mesh):
+			meshes.add(update.id.name);
+	if len(meshes) > 0:
+		for obj in scene.objects:
+			if (obj.data is not None) and (obj.data.name in meshes):
+				names.add(obj.name);
+	return names;
+
+# Mark changed objects to be encoded again on export
+@persistent
+def export_cache_depsgraph_update(scene, depsgraph=None):
+	if depsgraph is None:
+		svp_export_cache.clear();
+	else:
+		svp_export_dirty.update(get_updated_objects(depsgraph, scene));
 
-# Export the model
-def export_svp(context, path):
-	# Prepare output data
-	out_data = [];
+# Forget every encoded model when a file is loaded or an undo step is taken
+@persistent
+def export_cache_clear(*args):
+	svp_export_cache.clear();
+	svp_export_dirty.clear();
 
-	# Go through each object
+# Export the model
+#   use_bundle      - Write a bundle with a model per object, named after the objects
+#   use_incremental - Only encode objects that changed since the last export, and only write their models if nothing moved
+#   fixes           - Fixes to apply to the meshes, from svplib.validate
+def export_svp(context, path, use_bundle=False, use_incremental=True, fixes=()):
+	if not use_incremental:
+		svp_export_cache.clear();
+
+	# Validate the objects that changed, and build their models
+	objects = [];
+	pending = [];
+	object_issues = [];
 	for obj in context.scene.objects:
 		if hasattr(obj.data, "polygons"):
-			# Get BMesh
-			bm = bmesh.new();
-			if obj.mode == "EDIT":
-				bm = bmesh.from_edit_mesh(obj.data);
-			else:
-				bm.from_mesh(obj.data);
-
-			# Set face count
-			out_data.append(((len(bm.faces) - 1) >> 8) & 0xFF);
-			out_data.append(((len(bm.faces) - 1)) & 0xFF);
-
-			# Get layers
-			if hasattr(bm.faces, "ensure_lookup_table"): 
-				bm.faces.ensure_lookup_table();
-			layers_created = False;
-			pal_tag = bm.faces.layers.int.get("palette_ids");
-			dither_tag = bm.faces.layers.int.get("dither_ids");
-			cull_tag = bm.faces.layers.int.get("cull_ids");
-			if (pal_tag is None):
-				layers_created = True;
-				pal_tag = bm.faces.layers.int.new("palette_ids");
-			if (dither_tag is None):
-				dither_tag = bm.faces.layers.int.new("dither_ids");
-			if (cull_tag is None):
-				cull_tag = bm.faces.layers.int.new("cull_ids");
-
-			# Go through each face
-			face_id = 0;
-			for face in bm.faces:
-				if (len(face.verts) == 3) or (len(face.verts) == 4):
-					# Color
-					if (layers_created):
-						bm.faces[face_id][pal_tag] = 0x11;
-					out_data.append(bm.faces[face_id][pal_tag]);
-
-					# Flags
-					flags = (bm.faces[face_id][dither_tag] << 5) | (bm.faces[face_id][cull_tag] << 6);
-					if (len(face.verts) == 3):
-						flags |= 0x10;
-					out_data.append(flags);
-
-					# Vertices
-					for vertex in range(0, len(face.verts)):
-						pos = int(face.verts[vertex].co[0] * 256.0);
-						out_data.append((pos >> 8) & 0xFF);
-						out_data.append(pos & 0xFF);
-
-						pos = int(face.verts[vertex].co[2] * 256.0);
-						out_data.append((pos >> 8) & 0xFF);
-						out_data.append(pos & 0xFF);
-
-						pos = int(face.verts[vertex].co[1] * 256.0);
-						out_data.append((pos >> 8) & 0xFF);
-						out_data.append(pos & 0xFF);
-
-				else:
-					show_message("SVP models cannot have more than 4 vertices.", "Error", "ERROR");
-					file.close();
-					return;
-				face_id += 1;
-
-	# Save
-	file = open(path, "wb");
-	file.write(bytearray(out_data));
-	file.close();
+			# Models depend on the fixes too, so changing them validates and encodes again
+			key = (obj.name, obj.data.name, tuple(fixes));
+			chunks = svp_export_cache.get(key);
+			if (chunks is None) or (obj.name in svp_export_dirty) or (obj.mode == "EDIT"):
+				if obj.mode == "EDIT":
+					obj.update_from_editmode();
+				with svp_stats.timed("export.mesh"):
+					models, issues = mesh_to_svp_models(obj.data, fixes);
+				object_issues.append((obj.name, issues));
+				pending.append((len(objects), models));
+			objects.append([obj.name, key, chunks]);
+
+	# Nothing is encoded or written unless every object can be exported
+	if not report_export_issues(object_issues):
+		return {"CANCELLED"};
+
+	# Encode the changed objects
+	changed = set();
+	for index, models in pending:
+		name, key, chunks = objects[index];
+		with svp_stats.timed("export.encode"):
+			new_chunks = svp_export_cache.encode(key, models);
+		if new_chunks != chunks:
+			changed.add(key);
+		objects[index][2] = new_chunks;
+		svp_export_dirty.discard(name);
+	svp_export_cache.keep([key for name, key, chunks in objects]);
+	svp_stats.count("export.encoded", len(changed));
+
+	# Every model of an object is a chunk of the file, objects split into more than one model are numbered
+	file_chunks = [];
+	names = [];
+	for name, key, chunks in objects:
+		for i, chunk in enumerate(chunks):
+			file_chunks.append(((key, i), chunk));
+			names.append(name if (len(chunks) == 1) else "%s.%d" % (name, i));
+	changed = {chunk_key for chunk_key, chunk in file_chunks if chunk_key[0] in changed};
+
+	# Bundles start with their table
+	if use_bundle:
+		file_chunks.insert(0, ("table", bytes(svplib.bundle.encode_bundle_header([len(chunk) for key, chunk in file_chunks], names))));
+		changed.add("table");
+
+	# Save, over the old file if only models that kept their size changed
+	with svp_stats.timed("export.write"):
+		written = svp_export_cache.write(path, file_chunks, changed);
+	svp_stats.count("export.bytes", written);
 
 	return {"FINISHED"};
 
+# Batch export helper
+class ExportSVPBatch(bpy.types.Operator, SVPExportFixes):
+	"""Export a SEGA Virtua Processor Model File for every object or collection, and every animation frame"""
+	bl_idname = "export_scene.svp_batch";
+	bl_label = "Export SVP Batch";
+	bl_options = {"PRESET"};
+
+	directory: StringProperty(subtype="DIR_PATH");
+	filter_folder: bpy.props.BoolProperty(default=True, options={"HIDDEN"});
+	group: bpy.props.EnumProperty(name="File Per", default="OBJECT", items=[
+		("OBJECT", "Object", "Write a file for every object"),
+		("COLLECTION", "Collection", "Write a file for every collection, with the models of its objects one after another"),
+	]);
+	use_selection: bpy.props.BoolProperty(name="Selected Only", default=False);
+	use_frames: bpy.props.BoolProperty(name="Animation Frames", default=False,
+		description="Write files for every frame of the scene frame range, numbered by frame");
+	apply_transform: bpy.props.BoolProperty(name="Apply Transform", default=False,
+		description="Export world space positions, so that animated transforms end up in the models");
+	workers: bpy.props.IntProperty(name="Threads", default=0, min=0,
+		description="Number of threads encoding and writing files, 0 for the CPU count");
+
+	def invoke(self, context, event):
+		context.window_manager.fileselect_add(self);
+		return {"RUNNING_MODAL"};
+
+	def execute(self, context):
+		scene = context.scene;
+		frames = range(scene.frame_start, scene.frame_end + 1, scene.frame_step) if self.use_frames else None;
+		start = time.perf_counter();
+		results = export_svp_batch(context, self.directory, self.group, frames, self.use_selection, self.apply_transform, self.workers, self.get_fixes());
+		seconds = time.perf_counter() - start;
+
+		# Report every file
+		failures = [];
+		for path, faces, size, mesh_seconds, write_seconds, error in results:
+			if error is not None:
+				failures.append("%s: %s" % (os.path.basename(path), error));
+				print("%s: %s" % (path, error));
+			else:
+				print("%s: %d faces, %d bytes, mesh %.1f ms, encode and write %.1f ms" % (path, faces, size, mesh_seconds * 1000.0, write_seconds * 1000.0));
+		print("Exported %d of %d files in %.2f s" % (len(results) - len(failures), len(results), seconds));
+		if len(results) == 0:
+			show_message("No SVP models to export.", "Error", "ERROR");
+			return {"CANCELLED"};
+		if len(failures) > 0:
+			show_message("\n".join(failures), "Error", "ERROR");
+		self.report({"INFO"}, "Exported %d of %d files in %.2f s" % (len(results) - len(failures), len(results), seconds));
+		return {"FINISHED"};
+
+# Get a collection and every collection inside it
+def get_collections(collection):
+	collections = [collection];
+	for child in collection.children:
+		collections.extend(get_collections(child));
+	return collections;
+
+# Get the groups of objects to write a file for, as (name, objects) pairs
+def get_export_groups(context, group="OBJECT", use_selection=False):
+	objects = [obj for obj in context.scene.objects if hasattr(obj.data, "polygons") and ((not use_selection) or obj.select_get())];
+	if group == "OBJECT":
+		return [(obj.name, [obj]) for obj in objects];
+
+	# Objects directly in each collection, the scene collection is named after the scene
+	names = {obj.name for obj in objects};
+	groups = [];
+	for collection in get_collections(context.scene.collection):
+		members = [obj for obj in collection.objects if obj.name in names];
+		if len(members) > 0:
+			groups.append((context.scene.name if (collection == context.scene.collection) else collection.name, members));
+	return groups;
+
+# Get the models of an evaluated object, and the problems found in it
+def get_evaluated_models(obj, depsgraph, apply_transform=False, fixes=()):
+	if obj.mode == "EDIT":
+		obj.update_from_editmode();
+	obj_eval = obj.evaluated_get(depsgraph);
+	mesh = obj_eval.to_mesh();
+	if mesh is None:
+		return [], [svplib.validate.ValidationIssue(svplib.validate.ISSUE_FACE_COUNT, "No mesh")];
+	if apply_transform:
+		mesh.transform(obj_eval.matrix_world);
+	with svp_stats.timed("export.mesh"):
+		result = mesh_to_svp_models(mesh, fixes);
+	obj_eval.to_mesh_clear();
+	return result;
+
+# Get a file name for every group, names that clean up to one already taken get a number
+#   Names are compared without case, for file systems that ignore it
+def get_group_file_names(names):
+	file_names = [];
+	taken = set();
+	for name in names:
+		file_name = bpy.path.clean_name(name);
+		unique = file_name;
+		number = 1;
+		while unique.lower() in taken:
+			number += 1;
+			unique = "%s_%d" % (file_name, number);
+		if unique != file_name:
+			print("%s: %s.svp is taken, writing %s.svp instead" % (name, file_name, unique));
+		taken.add(unique.lower());
+		file_names.append(unique);
+	return file_names;
+
+# Export a file for every object or collection, and every frame if any are given
+#   Meshes are evaluated once per object and frame, while earlier files are encoded and written
+#   on a pool of threads. Returns (path, faces, bytes, mesh seconds, write seconds, error) for every file.
+def export_svp_batch(context, folder, group="OBJECT", frames=None, use_selection=False, apply_transform=False, workers=0, fixes=()):
+	scene = context.scene;
+	groups = get_export_groups(context, group, use_selection);
+	file_names = get_group_file_names([name for name, objects in groups]);
+	old_frame = scene.frame_current;
+	mesh_times = {};
+	failed = [];
+	with svplib.export.ModelWriter(workers) as writer:
+		try:
+			for frame in (frames if (frames is not None) else [None]):
+				if frame is not None:
+					scene.frame_set(frame);
+				depsgraph = context.evaluated_depsgraph_get();
+
+				# Evaluate every object once, even if it is in more than one collection
+				models = {};
+				for (name, objects), file_name in zip(groups, file_names):
+					path = os.path.join(bpy.path.abspath(folder), file_name + ("" if (frame is None) else "_%04d" % frame) + ".svp");
+					start = time.perf_counter();
+					for obj in objects:
+						if obj.name not in models:
+							models[obj.name] = get_evaluated_models(obj, depsgraph, apply_transform, fixes);
+					mesh_times[path] = time.perf_counter() - start;
+
+					# Only write groups that every object of can be exported
+					errors = ["%s: %s" % (obj.name, issue) for obj in objects for issue in models[obj.name][1] if issue.error and not issue.fixed];
+					if len(errors) > 0:
+						failed.append((path, 0, 0, mesh_times[path], 0.0, "; ".join(errors)));
+						continue;
+					writer.submit(path, [model for obj in objects for model in models[obj.name][0]]);
+		finally:
+			if frames is not None:
+				scene.frame_set(old_frame);
+		written = writer.results();
+
+	# Stats are only touched from the main thread
+	results = failed;
+	for path, faces, size, seconds, error in written:
+		if svp_stats.enabled:
+			svp_stats.add_time("export.file", seconds * 1000.0);
+		svp_stats.count("export.bytes", size);
+		results.append((path, faces, size, mesh_times[path], seconds, error));
+	return results;
+
+# Detail level export helper
+class ExportSVPLOD(bpy.types.Operator, ExportHelper, SVPExportFixes):
+	"""Export SEGA Virtua Processor models of every object at lower face counts, into one bundle"""
+	bl_idname = "export_scene.svp_lod";
+	bl_label = "Export SVP LODs";
+	bl_options = {"PRESET", "UNDO"};
+
+	filename_ext = ".svpb"
+	filter_glob: StringProperty(default="*.svpb", options={"HIDDEN"});
+	use_selection: bpy.props.BoolProperty(name="Selected Only", default=True);
+	target_faces: bpy.props.IntProperty(name="Smallest Level Faces", default=500, min=1, max=svplib.model.MAX_FACES,
+		description="Face budget of the smallest level, the levels in between are spaced geometrically down to it, each a fixed fraction of the one before");
+	levels: bpy.props.IntProperty(name="Levels", default=2, min=1, max=8,
+		description="Number of levels after the object itself");
+	add_objects: bpy.props.BoolProperty(name="Add Level Objects", default=False,
+		description="Add every level to the scene as a new object, to look at them");
+
+	def execute(self, context):
+		over_budget = export_svp_lods(context, self.filepath, self.use_selection, self.target_faces, self.levels, self.add_objects, self.get_fixes());
+		if over_budget is None:
+			return {"CANCELLED"};
+		if len(over_budget) > 0:
+			self.report({"WARNING"}, "; ".join(over_budget));
+		return {"FINISHED"};
+
+# Export detail levels of every object into one bundle, named after the object with _lod0 for the object itself and up
+#   Faces with different palette, dither, cull or flag IDs are never merged, and the borders between them keep their vertices.
+#   target_faces - Face budget of the smallest level of each object
+#   levels       - Number of levels after the object itself
+#   add_objects  - Add every level to the scene as a new object
+#   fixes        - Fixes to apply to the meshes, from svplib.validate
+#   Returns a message for every model whose smallest level is still over budget, or None if nothing was exported
+def export_svp_lods(context, path, use_selection=True, target_faces=500, levels=2, add_objects=False, fixes=()):
+	objects = [obj for obj in context.scene.objects if hasattr(obj.data, "polygons") and ((not use_selection) or obj.select_get())];
+	if len(objects) == 0:
+		show_message("No SVP models to export.", "Error", "ERROR");
+		return None;
+
+	# Validate every object, nothing is written unless every one can be exported
+	object_models = [];
+	object_issues = [];
+	for obj in objects:
+		if obj.mode == "EDIT":
+			obj.update_from_editmode();
+		with svp_stats.timed("export.mesh"):
+			models, issues = mesh_to_svp_models(obj.data, fixes);
+		object_issues.append((obj.name, issues));
+		object_models.append((obj, models));
+	if not report_export_issues(object_issues):
+		return None;
+
+	# Decimate every model, objects split into more than one model are numbered
+	models = [];
+	names = [];
+	over_budget = [];
+	for obj, obj_models in object_models:
+		for i, model in enumerate(obj_models):
+			name = obj.name if (len(obj_models) == 1) else "%s.%d" % (obj.name, i);
+			start = time.perf_counter();
+			with svp_stats.timed("export.lod"):
+				lods = svplib.decimate.build_lods(model, svplib.decimate.lod_targets(model.face_count, target_faces, levels));
+			print("%s: %s faces in %.2f s" % (name, ", ".join("%d" % lod.face_count for lod in lods), time.perf_counter() - start));
+			if lods[-1].face_count > target_faces:
+				over_budget.append("%s: %d faces left, borders and separate faces cannot be reduced further" % (name, lods[-1].face_count));
+			for level, lod in enumerate(lods):
+				models.append(lod);
+				names.append("%s_lod%d" % (name, level));
+				if add_objects and (level > 0):
+					add_svp_object(context, lod, names[-1]).matrix_world = obj.matrix_world;
+
+	with svp_stats.timed("export.write"):
+		svplib.bundle.write_bundle(path, models, names);
+	return over_budget;
+
+# Get the values of a face attribute layer, or a default value if it is missing
+def get_face_values(mesh, name, default):
+	values = np.full(len(mesh.polygons), default, np.int32);
+	layer = get_face_layer(mesh, name);
+	if layer is not None:
+		layer.data.foreach_get("value", values);
+	return values;
+
+# Face layers exported into the models, and the value faces get if a layer is missing
+FACE_LAYERS = (("palette_ids", 0x11), ("dither_ids", 0), ("cull_ids", 0), ("flag_ids", 0));
+
+# Get the models of a mesh after validating it and applying fixes, in one pass over the whole mesh
+#   fixes - Fixes to apply, from svplib.validate
+#   Returns the models, empty if errors are left, and every problem found
+def mesh_to_svp_models(mesh, fixes=()):
+	coords, loop_verts, loop_starts, face_sizes = get_mesh_geometry(mesh);
+	positions = coords[loop_verts[svplib.face_loops(loop_starts, face_sizes)]];
+	missing = [name for name, default in FACE_LAYERS if get_face_layer(mesh, name) is None];
+	values = [get_face_values(mesh, name, default) for name, default in FACE_LAYERS];
+	return svplib.validate.prepare_models(positions, face_sizes, values, missing, fixes);
+
+# Get the model data of a mesh, returns None if it cannot be exported as it is
+def mesh_to_svp_model(mesh):
+	models, issues = mesh_to_svp_models(mesh);
+	return models[0] if (len(models) == 1) else None;
+
 # SVP palette
 class SVPPalette(bpy.types.PropertyGroup):
 	color0: bpy.props.FloatVectorProperty(name="", subtype="COLOR", default=[0.0,0.0,0.0]);
@@ -388,375 +811,308 @@ class SVPPanel(bpy.types.Panel):
 			layout.prop(obj.data, "color1", slider=True);
 			layout.prop(obj.data, "color2", slider=True);
 			layout.prop(obj.data, "flags", slider=True);
+			layout.operator(SVPApplyFacePropertiesOperator.bl_idname);
 
-# Get checkerboard dithering flag
-def get_checker_dither(self):
-	ret_value = False;
-	found_status = 0;
+# SVP render settings panel
+class SVPRenderPanel(bpy.types.Panel):
+	bl_idname = "SVP_PT_Render_Panel";
+	bl_label = "SVP";
+	bl_space_type = "PROPERTIES";
+	bl_region_type = "WINDOW";
+	bl_context = "render";
+	COMPAT_ENGINES = {"SVP_RENDER"};
 
-	# Go through each object
-	for obj in bpy.context.scene.objects:
-		if hasattr(obj.data, "polygons"):
-			# Get BMesh
-			bm = bmesh.new();
-			if obj.mode == "EDIT":
-				bm = bmesh.from_edit_mesh(obj.data);
+	@classmethod
+	def poll(cls, context):
+		return context.engine in cls.COMPAT_ENGINES;
+
+	def draw(self, context):
+		layout = self.layout;
+		layout.prop(context.scene, "svp_sort_mode");
+		row = layout.row();
+		row.active = (context.scene.svp_sort_mode == svplib.sorting.SORT_DEPTH);
+		row.prop(context.scene, "svp_batch_draw");
+
+# SVP stats panel
+class SVPStatsPanel(bpy.types.Panel):
+	bl_idname = "SVP_PT_Stats_Panel";
+	bl_label = "Stats";
+	bl_category = "SVP";
+	bl_space_type = "VIEW_3D";
+	bl_region_type = "UI";
+	bl_options = {"DEFAULT_CLOSED"};
+
+	def draw(self, context):
+		layout = self.layout;
+		layout.prop(context.window_manager, "svp_stats_enabled");
+		if not svp_stats.enabled:
+			return;
+
+		# Last frame
+		frame = svp_stats.phases.get("draw.frame");
+		col = layout.column(align=True);
+		col.label(text=("Frame: %.2f ms" % frame.last) if frame else "Frame: -");
+		col.label(text="Triangles drawn: %d" % svp_stats.frame.get("draw.triangles", 0));
+		col.label(text="Bytes uploaded: %d" % svp_stats.frame.get("draw.bytes_uploaded", 0));
+
+		# Phases
+		col = layout.column(align=True);
+		for name, timer in sorted(svp_stats.phases.items()):
+			col.label(text="%s: %d x %.2f ms (max %.2f)" % (name, timer.count, timer.mean, timer.max));
+
+		row = layout.row();
+		row.operator(SVPStatsResetOperator.bl_idname);
+		row.operator(SVPStatsExportOperator.bl_idname);
+
+# Enable or disable the stats
+def update_stats_enabled(self, context):
+	svp_stats.enabled = self.svp_stats_enabled;
+
+# Operator for resetting the stats
+class SVPStatsResetOperator(bpy.types.Operator):
+	"""Clear the collected SVP timings and counters"""
+	bl_idname = "svp.reset_stats";
+	bl_label = "Reset";
+
+	def execute(self, context):
+		svp_stats.reset();
+		return {"FINISHED"};
+
+# Operator for exporting the stats
+class SVPStatsExportOperator(bpy.types.Operator, ExportHelper):
+	"""Export the collected SVP timings and counters as JSON"""
+	bl_idname = "svp.export_stats";
+	bl_label = "Export JSON";
+
+	filename_ext = ".json";
+	filter_glob: StringProperty(default="*.json", options={"HIDDEN"});
+
+	def execute(self, context):
+		svp_stats.write_json(self.filepath);
+		return {"FINISHED"};
+
+# Face property summary of the selected faces, shared by the panel getters
+face_summary = None;
+
+# Invalidate the face property summary
+def invalidate_face_summary():
+	global face_summary;
+	face_summary = None;
+
+# Get the face property summary, rebuilding it if something changed
+def get_face_summary():
+	global face_summary;
+	if face_summary is None:
+		with svp_stats.timed("panel.summary"):
+			face_summary = build_face_summary(bpy.context.scene);
+	return face_summary;
+
+# Summarize the selected faces of every object in edit mode
+#   Each value is the value shared by all selected faces, or None if they differ
+def build_face_summary(scene):
+	layers = (("palette_ids", 0x11), ("dither_ids", 0), ("cull_ids", 0), ("flag_ids", 0));
+	found = [set() for layer in layers];
+
+	# Go through each object with selected faces
+	for obj in get_selected_face_objects(scene):
+		bm = bmesh.from_edit_mesh(obj.data);
+		selected = [face for face in bm.faces if face.select];
+
+		# Check faces
+		for (name, default), values in zip(layers, found):
+			tag = bm.faces.layers.int.get(name);
+			if (tag is None):
+				values.add(default);
 			else:
-				bm.from_mesh(obj.data);
-
-			# Get dither layer
-			if hasattr(bm.faces, "ensure_lookup_table"): 
-				bm.faces.ensure_lookup_table();
-			dither_tag = bm.faces.layers.int.get("dither_ids");
-			if (dither_tag is None):
-				dither_tag = bm.faces.layers.int.new("dither_ids");
-
-			# Check faces
-			face_id = 0;
-			for face in bm.faces:
-				if (face.select):
-					if (found_status == 0):
-						ret_value = bm.faces[face_id][dither_tag] == 1;
-						found_status = 1;
-					elif (found_status == 1):
-						if (bm.faces[face_id][dither_tag] != ret_value):
-							ret_value = False;
-							found_status = 2;
-				face_id += 1;
-
-	return ret_value;
+				values.update(face[tag] for face in selected);
+
+	# Split the palette into its colors
+	uniform = [next(iter(values)) if len(values) == 1 else None for values in found];
+	colors = found[0];
+	color1 = {(color >> 4) & 0xF for color in colors};
+	color2 = {color & 0xF for color in colors};
+	return {
+		"dither": uniform[1],
+		"cull": uniform[2],
+		"color1": next(iter(color1)) if len(color1) == 1 else None,
+		"color2": next(iter(color2)) if len(color2) == 1 else None,
+		"flags": uniform[3],
+	};
+
+# Invalidate the face property summary when meshes, selections or modes change
+@persistent
+def face_summary_depsgraph_update(scene, depsgraph=None):
+	if (depsgraph is None) or depsgraph.id_type_updated("MESH") or depsgraph.id_type_updated("OBJECT"):
+		invalidate_face_summary();
+
+# Invalidate the face property summary when a file is loaded
+@persistent
+def face_summary_load_post(*args):
+	invalidate_face_summary();
+
+# Get a summarized face property, 0 if the selection is empty or mixed
+def get_summary_value(key):
+	value = get_face_summary()[key];
+	return 0 if value is None else value;
+
+# Get checkerboard dithering flag
+def get_checker_dither(self):
+	return get_summary_value("dither") == 1;
 
 # Set checkerboard dithering flag
 def set_checker_dither(self, value):
-	# Go through each object
-	for obj in bpy.context.scene.objects:
-		if hasattr(obj.data, "polygons"):
-			# Get BMesh
-			bm = bmesh.new();
-			if obj.mode == "EDIT":
-				bm = bmesh.from_edit_mesh(obj.data);
-			else:
-				bm.from_mesh(obj.data);
-
-			# Get dither layer
-			if hasattr(bm.faces, "ensure_lookup_table"): 
-				bm.faces.ensure_lookup_table();
-			dither_tag = bm.faces.layers.int.get("dither_ids");
-			if (dither_tag is None):
-				dither_tag = bm.faces.layers.int.new("dither_ids");
-
-			# Check faces
-			face_id = 0;
-			for face in bm.faces:
-				if (face.select):
-					if (value):
-						bm.faces[face_id][dither_tag] = 1;
-					else:
-						bm.faces[face_id][dither_tag] = 0;
-				face_id += 1;
-
-			# Save changes
-			if obj.mode == "EDIT":
-				bmesh.update_edit_mesh(obj.data);
-			else:
-				bm.to_mesh(obj.data);
+	apply_face_properties(get_selected_face_objects(bpy.context.scene), dither=int(value));
 
 # Get culling flag
 def get_culling(self):
-	ret_value = False;
-	found_status = 0;
-
-	# Go through each object
-	for obj in bpy.context.scene.objects:
-		if hasattr(obj.data, "polygons"):
-			# Get BMesh
-			bm = bmesh.new();
-			if obj.mode == "EDIT":
-				bm = bmesh.from_edit_mesh(obj.data);
-			else:
-				bm.from_mesh(obj.data);
-
-			# Get culling layer
-			if hasattr(bm.faces, "ensure_lookup_table"): 
-				bm.faces.ensure_lookup_table();
-			cull_tag = bm.faces.layers.int.get("cull_ids");
-			if (cull_tag is None):
-				cull_tag = bm.faces.layers.int.new("cull_ids");
-
-			# Check faces
-			face_id = 0;
-			for face in bm.faces:
-				if (face.select):
-					if (found_status == 0):
-						ret_value = bm.faces[face_id][cull_tag] == 1;
-						found_status = 1;
-					elif (found_status == 1):
-						if (bm.faces[face_id][cull_tag] != ret_value):
-							ret_value = False;
-							found_status = 2;
-				face_id += 1;
-
-	return ret_value;
+	return get_summary_value("cull") == 1;
 
 # Set culling flag
 def set_culling(self, value):
-	# Go through each object
-	for obj in bpy.context.scene.objects:
-		if hasattr(obj.data, "polygons"):
-			# Get BMesh
-			bm = bmesh.new();
-			if obj.mode == "EDIT":
-				bm = bmesh.from_edit_mesh(obj.data);
-			else:
-				bm.from_mesh(obj.data);
-
-			# Get culling layer
-			if hasattr(bm.faces, "ensure_lookup_table"): 
-				bm.faces.ensure_lookup_table();
-			cull_tag = bm.faces.layers.int.get("cull_ids");
-			if (cull_tag is None):
-				cull_tag = bm.faces.layers.int.new("cull_ids");
-
-			# Check faces
-			face_id = 0;
-			for face in bm.faces:
-				if (face.select):
-					if (value):
-						bm.faces[face_id][cull_tag] = 1;
-					else:
-						bm.faces[face_id][cull_tag] = 0;
-				face_id += 1;
-
-			# Save changes
-			if obj.mode == "EDIT":
-				bmesh.update_edit_mesh(obj.data);
-			else:
-				bm.to_mesh(obj.data);
+	apply_face_properties(get_selected_face_objects(bpy.context.scene), cull=int(value));
 
 # Get color 1
 def get_color1(self):
-	ret_value = False;
-	found_status = 0;
-
-	# Go through each object
-	for obj in bpy.context.scene.objects:
-		if hasattr(obj.data, "polygons"):
-			# Get BMesh
-			bm = bmesh.new();
-			if obj.mode == "EDIT":
-				bm = bmesh.from_edit_mesh(obj.data);
-			else:
-				bm.from_mesh(obj.data);
-
-			# Get palette layer
-			if hasattr(bm.faces, "ensure_lookup_table"): 
-				bm.faces.ensure_lookup_table();
-			layers_created = False;
-			pal_tag = bm.faces.layers.int.get("palette_ids");
-			if (pal_tag is None):
-				layers_created = True;
-				pal_tag = bm.faces.layers.int.new("palette_ids");
-
-			# Check faces
-			face_id = 0;
-			for face in bm.faces:
-				if (layers_created):
-					bm.faces[face_id][pal_tag] = 0x11;
-				if (face.select):
-					if (found_status == 0):
-						ret_value = (bm.faces[face_id][pal_tag] >> 4) & 0xF;
-						found_status = 1;
-					elif (found_status == 1):
-						if (((bm.faces[face_id][pal_tag] >> 4) & 0xF) != ret_value):
-							ret_value = False;
-							found_status = 2;
-				face_id += 1;
-
-	return ret_value;
+	return get_summary_value("color1");
 
 # Set color 1
 def set_color1(self, value):
-	# Go through each object
-	for obj in bpy.context.scene.objects:
-		if hasattr(obj.data, "polygons"):
-			# Get BMesh
-			bm = bmesh.new();
-			if obj.mode == "EDIT":
-				bm = bmesh.from_edit_mesh(obj.data);
-			else:
-				bm.from_mesh(obj.data);
-
-			# Get palette layer
-			if hasattr(bm.faces, "ensure_lookup_table"): 
-				bm.faces.ensure_lookup_table();
-			layers_created = False;
-			pal_tag = bm.faces.layers.int.get("palette_ids");
-			if (pal_tag is None):
-				layers_created = True;
-				pal_tag = bm.faces.layers.int.new("palette_ids");
-
-			# Check faces
-			face_id = 0;
-			for face in bm.faces:
-				if (layers_created):
-					bm.faces[face_id][pal_tag] = 0x11;
-				if (face.select):
-					bm.faces[face_id][pal_tag] &= 0xF;
-					bm.faces[face_id][pal_tag] |= (value << 4);
-				face_id += 1;
-
-			# Save changes
-			if obj.mode == "EDIT":
-				bmesh.update_edit_mesh(obj.data);
-			else:
-				bm.to_mesh(obj.data);
+	apply_face_properties(get_selected_face_objects(bpy.context.scene), color1=value);
 
 # Get color 2
 def get_color2(self):
-	ret_value = False;
-	found_status = 0;
-
-	# Go through each object
-	for obj in bpy.context.scene.objects:
-		if hasattr(obj.data, "polygons"):
-			# Get BMesh
-			bm = bmesh.new();
-			if obj.mode == "EDIT":
-				bm = bmesh.from_edit_mesh(obj.data);
-			else:
-				bm.from_mesh(obj.data);
-
-			# Get palette layer
-			if hasattr(bm.faces, "ensure_lookup_table"): 
-				bm.faces.ensure_lookup_table();
-			layers_created = False;
-			pal_tag = bm.faces.layers.int.get("palette_ids");
-			if (pal_tag is None):
-				layers_created = True;
-				pal_tag = bm.faces.layers.int.new("palette_ids");
-
-			# Check faces
-			face_id = 0;
-			for face in bm.faces:
-				if (layers_created):
-					bm.faces[face_id][pal_tag] = 0x11;
-				if (face.select):
-					if (found_status == 0):
-						ret_value = bm.faces[face_id][pal_tag] & 0xF;
-						found_status = 1;
-					elif (found_status == 1):
-						if ((bm.faces[face_id][pal_tag] & 0xF) != ret_value):
-							ret_value = False;
-							found_status = 2;
-				face_id += 1;
-
-	return ret_value;
+	return get_summary_value("color2");
 
 # Set color 2
 def set_color2(self, value):
-	# Go through each object
-	for obj in bpy.context.scene.objects:
-		if hasattr(obj.data, "polygons"):
-			# Get BMesh
-			bm = bmesh.new();
-			if obj.mode == "EDIT":
-				bm = bmesh.from_edit_mesh(obj.data);
-			else:
-				bm.from_mesh(obj.data);
-
-			# Get palette layer
-			if hasattr(bm.faces, "ensure_lookup_table"): 
-				bm.faces.ensure_lookup_table();
-			layers_created = False;
-			pal_tag = bm.faces.layers.int.get("palette_ids");
-			if (pal_tag is None):
-				layers_created = True;
-				pal_tag = bm.faces.layers.int.new("palette_ids");
-
-			# Check faces
-			face_id = 0;
-			for face in bm.faces:
-				if (layers_created):
-					bm.faces[face_id][pal_tag] = 0x11;
-				if (face.select):
-					bm.faces[face_id][pal_tag] &= 0xF0;
-					bm.faces[face_id][pal_tag] |= value;
-				face_id += 1;
-
-			# Save changes
-			if obj.mode == "EDIT":
-				bmesh.update_edit_mesh(obj.data);
-			else:
-				bm.to_mesh(obj.data);
+	apply_face_properties(get_selected_face_objects(bpy.context.scene), color2=value);
 
 # Get flags
 def get_flags(self):
-	ret_value = False;
-	found_status = 0;
-
-	# Go through each object
-	for obj in bpy.context.scene.objects:
-		if hasattr(obj.data, "polygons"):
-			# Get BMesh
-			bm = bmesh.new();
-			if obj.mode == "EDIT":
-				bm = bmesh.from_edit_mesh(obj.data);
-			else:
-				bm.from_mesh(obj.data);
-
-			# Get flag layer
-			if hasattr(bm.faces, "ensure_lookup_table"): 
-				bm.faces.ensure_lookup_table();
-			flag_tag = bm.faces.layers.int.get("flag_ids");
-			if (flag_tag is None):
-				flag_tag = bm.faces.layers.int.new("flag_ids");
-
-			# Check faces
-			face_id = 0;
-			for face in bm.faces:
-				if (face.select):
-					if (found_status == 0):
-						ret_value = bm.faces[face_id][flag_tag];
-						found_status = 1;
-					elif (found_status == 1):
-						if (bm.faces[face_id][flag_tag] != ret_value):
-							ret_value = False;
-							found_status = 2;
-				face_id += 1;
-
-	return ret_value;
+	return get_summary_value("flags");
 
 # Set flags
 def set_flags(self, value):
+	apply_face_properties(get_selected_face_objects(bpy.context.scene), flags=value);
+
+# Get the mesh objects in edit mode that have selected faces
+def get_selected_face_objects(scene):
+	objects = {};
+	for obj in scene.objects:
+		if (obj.mode == "EDIT") and hasattr(obj.data, "polygons") and (obj.data.total_face_sel > 0):
+			objects.setdefault(obj.data, obj);
+	return list(objects.values());
+
+# Apply face properties to the selected faces of objects in one pass
+#   Properties left as None are not changed. Objects in edit mode are written through their BMesh,
+#   other objects through vectorized attribute access.
+def apply_face_properties(objects, color1=None, color2=None, dither=None, cull=None, flags=None):
+	# Palette bits to keep and set
+	pal_keep = 0xFF;
+	pal_set = 0;
+	if color1 is not None:
+		pal_keep &= 0x0F;
+		pal_set |= (color1 & 0xF) << 4;
+	if color2 is not None:
+		pal_keep &= 0xF0;
+		pal_set |= color2 & 0xF;
+
+	# Layers to write, with the default value of faces that do not have the layer yet
+	writes = [];
+	if pal_keep != 0xFF:
+		writes.append(("palette_ids", 0x11, pal_keep, pal_set));
+	if dither is not None:
+		writes.append(("dither_ids", 0, 0, dither));
+	if cull is not None:
+		writes.append(("cull_ids", 0, 0, cull));
+	if flags is not None:
+		writes.append(("flag_ids", 0, 0, flags & 0xF));
+	if len(writes) == 0:
+		return;
+
 	# Go through each object
-	for obj in bpy.context.scene.objects:
-		if hasattr(obj.data, "polygons"):
-			# Get BMesh
-			bm = bmesh.new();
+	with svp_stats.timed("panel.apply"):
+		for obj in objects:
 			if obj.mode == "EDIT":
-				bm = bmesh.from_edit_mesh(obj.data);
+				apply_face_properties_bmesh(obj, writes);
 			else:
-				bm.from_mesh(obj.data);
-
-			# Get flag layer
-			if hasattr(bm.faces, "ensure_lookup_table"): 
-				bm.faces.ensure_lookup_table();
-			flag_tag = bm.faces.layers.int.get("flag_ids");
-			if (flag_tag is None):
-				flag_tag = bm.faces.layers.int.new("flag_ids");
-
-			# Check faces
-			face_id = 0;
-			for face in bm.faces:
-				if (face.select):
-					bm.faces[face_id][flag_tag] = value;
-				face_id += 1;
-
-			# Save changes
-			if obj.mode == "EDIT":
-				bmesh.update_edit_mesh(obj.data);
-			else:
-				bm.to_mesh(obj.data);
+				apply_face_properties_mesh(obj, writes);
+
+	invalidate_face_summary();
+
+# Apply face properties to an object in edit mode
+def apply_face_properties_bmesh(obj, writes):
+	if obj.data.total_face_sel == 0:
+		return;
+	bm = bmesh.from_edit_mesh(obj.data);
+
+	# Get layers
+	tags = [];
+	for name, default, keep, value in writes:
+		tag = bm.faces.layers.int.get(name);
+		if (tag is None):
+			tag = bm.faces.layers.int.new(name);
+			if default != 0:
+				for face in bm.faces:
+					face[tag] = default;
+		tags.append((tag, keep, value));
+
+	# Write selected faces
+	for face in bm.faces:
+		if (face.select):
+			for tag, keep, value in tags:
+				face[tag] = (face[tag] & keep) | value;
+
+	# Save changes
+	bmesh.update_edit_mesh(obj.data, loop_triangles=False, destructive=False);
+
+# Apply face properties to an object in object mode
+def apply_face_properties_mesh(obj, writes):
+	mesh = obj.data;
+	select = np.empty(len(mesh.polygons), bool);
+	mesh.polygons.foreach_get("select", select);
+	if not np.any(select):
+		return;
+
+	# Write selected faces
+	for name, default, keep, value in writes:
+		values = get_face_values(mesh, name, default);
+		values[select] = (values[select] & keep) | value;
+		get_face_layer(mesh, name, True).data.foreach_set("value", values);
+
+	# Save changes
+	mesh.update();
+
+# Operator for applying face properties to the selected faces
+class SVPApplyFacePropertiesOperator(bpy.types.Operator):
+	"""Apply SVP face properties to the selected faces of every object in edit mode"""
+	bl_idname = "svp.apply_face_properties";
+	bl_label = "Apply Face Properties";
+	bl_options = {"REGISTER", "UNDO"};
+
+	use_color1: bpy.props.BoolProperty(name="Set Color 1", default=False);
+	color1: bpy.props.IntProperty(name="Color 1", min=0, max=15);
+	use_color2: bpy.props.BoolProperty(name="Set Color 2", default=False);
+	color2: bpy.props.IntProperty(name="Color 2", min=0, max=15);
+	use_checker_dither: bpy.props.BoolProperty(name="Set Dithering", default=False);
+	checker_dither: bpy.props.BoolProperty(name="Checkerboard Dithering");
+	use_cull_enabled: bpy.props.BoolProperty(name="Set Culling", default=False);
+	cull_enabled: bpy.props.BoolProperty(name="Enable Culling");
+	use_flags: bpy.props.BoolProperty(name="Set Flags", default=False);
+	flags: bpy.props.IntProperty(name="Flags", min=0, max=15);
+
+	@classmethod
+	def poll(cls, context):
+		return context.mode == "EDIT_MESH";
+
+	def execute(self, context):
+		apply_face_properties(get_selected_face_objects(context.scene),
+			color1=self.color1 if self.use_color1 else None,
+			color2=self.color2 if self.use_color2 else None,
+			dither=int(self.checker_dither) if self.use_checker_dither else None,
+			cull=int(self.cull_enabled) if self.use_cull_enabled else None,
+			flags=self.flags if self.use_flags else None);
+		return {"FINISHED"};
 
 # Create a shader
 def create_shader(type, code):
@@ -819,6 +1175,88 @@ vertex_shader = -1;
 fragment_shader = -1;
 svp_shader = -1;
 
+# Most objects drawn by one batched call, limited further by the uniform space of the GPU
+MAX_BATCH_OBJECTS = 128;
+svp_batch_size = MAX_BATCH_OBJECTS;
+
+# Get how many object matrices fit in the vertex shader uniforms, next to the palette
+def get_batch_size():
+	components = bgl.Buffer(bgl.GL_INT, 1);
+	bgl.glGetIntegerv(getattr(bgl, "GL_MAX_VERTEX_UNIFORM_COMPONENTS", 0x8B4A), components);
+	return max(1, min(MAX_BATCH_OBJECTS, (components[0] - 128) // 16));
+
+# Create the SVP shader, this is done on first draw so that no GPU context is needed to register
+#   Batched objects pick their matrix with the object attribute, which is 0 when it is not enabled
+def create_svp_shader():
+	global vertex_shader, fragment_shader, svp_shader, svp_batch_size;
+
+	# Vertex shader
+	svp_batch_size = get_batch_size();
+	vertex_shader = create_shader(bgl.GL_VERTEX_SHADER, 
+	"""
+	#version 330 core
+	layout(location = 0) in vec3 in_pos;
+	layout(location = 1) in vec2 in_face;
+	layout(location = 2) in float in_object;
+	flat out vec4 color1;
+	flat out vec4 color2;
+	flat out float dither;
+	uniform mat4 mats[%d];
+	uniform vec4 palette[16];
+	void main()
+	{
+		int colors = int(in_face.x);
+		int flags = int(in_face.y);
+		gl_Position = mats[int(in_object)] * vec4(in_pos,1);
+		color1 = palette[(colors >> 4) & 15];
+		color2 = palette[colors & 15];
+		dither = float((flags >> 5) & 1);
+	}""" % svp_batch_size)
+
+	# Fragment shader
+	fragment_shader = create_shader(bgl.GL_FRAGMENT_SHADER,
+	"""
+	#version 330 core
+	flat in vec4 color1;
+	flat in vec4 color2;
+	flat in float dither;
+	out vec4 color;
+
+	void main()
+	{
+		color = (mix(1.0, 0.0, sign(mod(floor(gl_FragCoord.x / 3.0) + (floor(gl_FragCoord.y / 3.0) * sign(dither)), 2.0))) == 1.0) ? color1 : color2;
+	}
+	""")
+
+	# Shader program
+	svp_shader = create_program(vertex_shader, fragment_shader);
+
+# Delete the SVP shader
+def delete_svp_shader():
+	global vertex_shader, fragment_shader, svp_shader;
+	if (svp_shader == -1):
+		return;
+	bgl.glDeleteShader(vertex_shader);
+	bgl.glDeleteShader(fragment_shader);
+	bgl.glDeleteProgram(svp_shader);
+	vertex_shader = -1;
+	fragment_shader = -1;
+	svp_shader = -1;
+
+# Cached GPU buffers of each object, and the objects that need to be rebuilt
+svp_draw_cache = {};
+svp_dirty_objects = set();
+
+# Batched GPU buffers, the draw arrays of every batched object, and the objects that need to be rebuilt
+svp_batches = [];
+svp_batch_arrays = {};
+svp_batch_dirty = set();
+
+# Mark an object as changed for both ways of drawing
+def mark_dirty_object(name):
+	svp_dirty_objects.add(name);
+	svp_batch_dirty.add(name);
+
 # Render engine
 class SVPRenderEngine(bpy.types.RenderEngine):
 	bl_idname = "SVP_RENDER";
@@ -840,55 +1278,507 @@ class SVPRenderEngine(bpy.types.RenderEngine):
 		self.size_x = int(scene.render.resolution_x * scale);
 		self.size_y = int(scene.render.resolution_y * scale);
 
-		if (self.is_preview):
-			color = [0.1, 0.2, 0.1, 1.0];
-		else:
-			color = [0.2, 0.1, 0.1, 1.0];
-		pixel_count = self.size_x * self.size_y;
-		rect = [color] * pixel_count;
-
-		# Set render result
-		result = self.begin_result(0, 0, self.size_x, self.size_y);
-		layer = result.layers[0].passes["Combined"];
-		layer.rect = rect;
-		self.end_result(result);
+		# Rasterize the scene on the CPU, tile by tile across worker processes
+		tris = svp_render_triangles(depsgraph, self.size_x, self.size_y);
+		tile_count = len(svplib.raster.frame_tiles(self.size_x, self.size_y));
+		tiles = svplib.raster.render_tiles(tris, get_palette(scene), self.size_x, self.size_y, get_background(scene),
+			depth_test=(scene.svp_sort_mode == svplib.sorting.SORT_DEPTH),
+			workers=scene.render.threads, executable=get_python_executable());
+
+		# Set render result as tiles finish
+		tiles_done = 0;
+		for (x, y, width, height), pixels in tiles:
+			result = self.begin_result(x, y, width, height);
+			layer = result.layers[0].passes["Combined"];
+			layer.rect = pixels.reshape(-1, 4);
+			self.update_result(result);
+			self.end_result(result);
+
+			tiles_done += 1;
+			self.update_progress(tiles_done / tile_count);
+			if self.test_break():
+				tiles.close();
+				break;
 
 	# Viewport initialization/change
 	def view_update(self, context, depsgraph):
-		# Check for updates
+		# Rebuild everything the first time
 		if not self.scene_data:
-			self.scene_data = [];
-			first_time = True;
-			for datablock in depsgraph.ids:
-				pass;
-		else:
-			first_time = False;
-			for update in depsgraph.updates:
-				print("Datablock updated: ", update.id.name);
-			if depsgraph.id_type_updated("MATERIAL"):
-				print("Materials updated");
-		if first_time or depsgraph.id_type_updated("OBJECT"):
-			for instance in depsgraph.object_instances:
-				pass;
-
-		# Draw the scene
-		self.bind_display_space_shader(depsgraph.scene);
-		svp_draw(context);
-		self.unbind_display_space_shader();
+			self.scene_data = True;
+			free_draw_cache();
+			return;
+
+		# Mark objects with changed geometry or face layers
+		for name in get_updated_objects(depsgraph, depsgraph.scene):
+			mark_dirty_object(name);
 
 	# Viewport redraw
 	def view_draw(self, context, depsgraph):
 		self.bind_display_space_shader(depsgraph.scene);
-		svp_draw(context);
+		svp_stats.new_frame();
+		with svp_stats.timed("draw.frame"):
+			svp_draw(context, depsgraph);
 		self.unbind_display_space_shader();
 
+# Get the palette of a scene as RGBA colors, color 0 is transparent
+def get_palette(scene):
+	palette = np.ones((16, 4), np.float32);
+	for i in range(0, 16):
+		palette[i, :3] = getattr(scene.svp_palette, "color" + str(i));
+	palette[0, 3] = 0.0;
+	return palette;
+
+# Get the vertex positions, loop vertices, loop starts and face sizes of a mesh
+def get_mesh_geometry(mesh):
+	coords = np.empty(len(mesh.vertices) * 3, np.float32);
+	mesh.vertices.foreach_get("co", coords);
+	loop_verts = np.empty(len(mesh.loops), np.int32);
+	mesh.loops.foreach_get("vertex_index", loop_verts);
+	loop_starts = np.empty(len(mesh.polygons), np.int32);
+	mesh.polygons.foreach_get("loop_start", loop_starts);
+	face_sizes = np.empty(len(mesh.polygons), np.int32);
+	mesh.polygons.foreach_get("loop_total", face_sizes);
+	return coords.reshape(-1, 3), loop_verts, loop_starts, face_sizes;
+
+# Get the triangles of a mesh
+#   positions - (T, 3, 3) corner positions
+#   centers   - (T, 3) center of the face of every triangle
+#   palette, dither, cull, flags - Face IDs of every triangle
+def mesh_triangles(mesh):
+	# Split faces into triangles
+	coords, loop_verts, loop_starts, face_sizes = get_mesh_geometry(mesh);
+	positions, centers, tri_faces = svplib.triangulate(coords, loop_verts, loop_starts, face_sizes);
+
+	# Get layers
+	return {
+		"positions": positions,
+		"centers": centers,
+		"palette": get_face_values(mesh, "palette_ids", 0x11)[tri_faces],
+		"dither": get_face_values(mesh, "dither_ids", 0)[tri_faces],
+		"cull": get_face_values(mesh, "cull_ids", 0)[tri_faces],
+		"flags": get_face_values(mesh, "flag_ids", 0)[tri_faces],
+	};
+
+# Get the indexed triangles of a mesh for drawing, every face corner is a vertex shared by its triangles
+#   positions - (L, 3) position of every face corner
+#   corners   - (T, 3) face corners of every triangle
+#   centers   - (T, 3) center of the face of every triangle
+#   face_data - (L, 2) palette byte and flag byte of the face of every face corner
+#   flags     - Flag ID of every triangle
+#   cull      - Culling bit of every triangle
+def mesh_draw_arrays(mesh):
+	coords, loop_verts, loop_starts, face_sizes = get_mesh_geometry(mesh);
+	corners, tri_faces = svplib.fan_triangles(loop_starts, face_sizes);
+	centers = svplib.face_centers(coords, loop_verts, loop_starts, face_sizes);
+	faces = svplib.loop_faces(loop_starts, face_sizes, len(loop_verts));
+	flags = get_face_values(mesh, "flag_ids", 0);
+	cull = get_face_values(mesh, "cull_ids", 0) & 1;
+	flag_bytes = (flags & svplib.model.FLAG_SORT) | ((get_face_values(mesh, "dither_ids", 0) & 1) << 5) | (cull << 6);
+	return {
+		"positions": coords[loop_verts],
+		"corners": corners,
+		"centers": centers[tri_faces],
+		"face_data": np.stack([get_face_values(mesh, "palette_ids", 0x11), flag_bytes], 1).astype(np.uint8)[faces],
+		"flags": flags[tri_faces],
+		"cull": cull[tri_faces],
+	};
+
+# Get the backface culling of the triangles of draw arrays, None if no triangle can be culled
+def get_draw_culler(arrays):
+	culler = svplib.culling.FaceCuller(arrays["positions"][arrays["corners"]], arrays["cull"]);
+	return culler if culler.active else None;
+
+# Get the Python executable for worker processes, older versions of Blender report their own binary
+def get_python_executable():
+	return getattr(bpy.app, "binary_path_python", None) or sys.executable;
+
+# Get the background color of a render
+def get_background(scene):
+	if scene.render.film_transparent or (scene.world is None):
+		return (0.0, 0.0, 0.0, 0.0);
+	return tuple(scene.world.color) + (1.0,);
+
+# Get the screen space triangles of everything the camera sees
+def svp_render_triangles(depsgraph, width, height):
+	scene = depsgraph.scene;
+	if scene.camera is None:
+		return svplib.raster.setup_triangles(np.empty((0, 3, 4)), [], [], [], width, height);
+
+	# Camera matrix
+	camera = scene.camera.evaluated_get(depsgraph);
+	projection = camera.calc_matrix_camera(depsgraph, x=width, y=height,
+		scale_x=scene.render.pixel_aspect_x, scale_y=scene.render.pixel_aspect_y);
+	view_matrix = np.array(camera.matrix_world.inverted(), np.float64);
+	view_projection = np.array(projection, np.float64) @ view_matrix;
+	perspective = (camera.data.type != "ORTHO");
+
+	# Go through each visible mesh
+	tris = {"clip": [], "centers": [], "palette": [], "dither": [], "cull": [], "flags": []};
+	for instance in depsgraph.object_instances:
+		obj = instance.object;
+		if (obj.type != "MESH"):
+			continue;
+		mesh = obj.to_mesh();
+		if mesh is None:
+			continue;
+		mesh_tris = mesh_triangles(mesh);
+		obj.to_mesh_clear();
+
+		# Drop culled back faces before anything else is done with them
+		world = np.array(instance.matrix_world, np.float64);
+		culler = svplib.culling.FaceCuller(mesh_tris["positions"], mesh_tris["cull"]);
+		if culler.active:
+			keep = culler.keep(svplib.culling.view_eye(view_matrix, world, perspective));
+			mesh_tris = {key: values[keep] for key, values in mesh_tris.items()};
+
+		# Transform to clip space, and face centers to world space
+		matrix = view_projection @ world;
+		tris["clip"].append((mesh_tris["positions"].reshape(-1, 3) @ matrix[:, :3].T) + matrix[:, 3]);
+		tris["centers"].append((mesh_tris["centers"] @ world[:3, :3].T) + world[:3, 3]);
+		for key in ("palette", "dither", "cull", "flags"):
+			tris[key].append(mesh_tris[key]);
+
+	if len(tris["clip"]) == 0:
+		return svplib.raster.setup_triangles(np.empty((0, 3, 4)), [], [], [], width, height);
+	tris = {key: np.concatenate(values) for key, values in tris.items()};
+	clip = tris["clip"].reshape(-1, 3, 4);
+
+	# Sort faces across the whole scene
+	if scene.svp_sort_mode != svplib.sorting.SORT_DEPTH:
+		sorter = svplib.sorting.FaceSorter(tris["centers"], tris["flags"], scene.svp_sort_mode);
+		order = sorter.order(-np.array(camera.matrix_world.inverted(), np.float64)[2]);
+		clip = clip[order];
+		for key in ("palette", "dither", "cull"):
+			tris[key] = tris[key][order];
+
+	return svplib.raster.setup_triangles(clip, tris["palette"], tris["dither"], tris["cull"], width, height);
+
+# Size of each GL data type in bytes
+GL_TYPE_SIZES = {bgl.GL_BYTE: 1, bgl.GL_SHORT: 2, bgl.GL_INT: 4, bgl.GL_FLOAT: 4};
+
+# Draw vertex layout, 8.8 fixed point x, y, z and the palette and flag bytes of the face
+VERTEX_STRIDE = 8;
+VERTEX_FACE_OFFSET = 6;
+
+# Scale from 8.8 fixed point to Blender units, applied in the shader matrix
+FIXED_POINT_SCALE = mathutils.Matrix.Scale(1.0 / 256.0, 4);
+
+# Upload data to a GL buffer, bytes are uploaded as GL_BYTE and indices as GL_INT
+#   The whole buffer is replaced, unless a byte offset to update from is given
+def upload_buffer(buffer, data, gl_type, target=bgl.GL_ARRAY_BUFFER, offset=None):
+	size = len(data) * GL_TYPE_SIZES[gl_type];
+	with svp_stats.timed("draw.upload"):
+		data = bgl.Buffer(gl_type, len(data), data);
+		bgl.glBindBuffer(target, buffer);
+		if offset is None:
+			bgl.glBufferData(target, size, data, bgl.GL_STATIC_DRAW);
+		else:
+			bgl.glBufferSubData(target, offset, size, data);
+	svp_stats.count("draw.bytes_uploaded", size);
+
+# Cached GPU buffers of an object
+#   Every face corner is uploaded once as an 8 byte vertex, and triangles are drawn from an
+#   index buffer. Colors are looked up from the palette uniform.
+#   view - What the index buffer was last uploaded for, None for every triangle in order
+class SVPDrawBuffers:
+	def __init__(self):
+		self.buffers = bgl.Buffer(bgl.GL_INT, 2);
+		bgl.glGenBuffers(2, self.buffers);
+		self.vertex_count = 0;
+		self.element_count = 0;
+		self.draw_count = 0;
+		self.corners = None;
+		self.centers = None;
+		self.flags = None;
+		self.sorter = None;
+		self.culler = None;
+		self.view = None;
+
+	# Upload vertex data
+	def upload(self, buffer, data, gl_type, target=bgl.GL_ARRAY_BUFFER):
+		upload_buffer(self.buffers[buffer], data, gl_type, target);
+
+	# Upload the geometry of a mesh
+	def upload_mesh(self, mesh):
+		with svp_stats.timed("draw.buffers"):
+			arrays = mesh_draw_arrays(mesh);
+		self.vertex_count = len(arrays["positions"]);
+		self.element_count = arrays["corners"].size;
+		self.corners = arrays["corners"];
+		self.centers = arrays["centers"];
+		self.flags = arrays["flags"];
+		self.sorter = None;
+		self.culler = get_draw_culler(arrays);
+		self.draw_count = 0;
+		if (self.element_count > 0):
+			vertices = svplib.pack_draw_vertices(arrays["positions"], arrays["face_data"]);
+			self.upload(0, vertices.reshape(-1), bgl.GL_SHORT);
+			self.upload_indices(self.corners);
+
+	# Upload the face corners of every triangle to draw, in order
+	def upload_indices(self, corners):
+		self.upload(1, corners.reshape(-1).astype(np.int32), bgl.GL_INT, bgl.GL_ELEMENT_ARRAY_BUFFER);
+		self.draw_count = corners.size;
+		self.view = None;
+
+	# Upload the triangles to draw for a view, sorted unless the mode is SORT_DEPTH and without culled back faces
+	#   depth_row - Depth row for FaceSorter.order()
+	#   eye       - Eye from svplib.culling.view_eye()
+	def upload_view(self, mode, depth_row, eye):
+		use_sorting = (mode != svplib.sorting.SORT_DEPTH);
+		view = None;
+		if use_sorting or (self.culler is not None):
+			view = (mode, depth_row.tobytes() if use_sorting else None, eye.tobytes() if (self.culler is not None) else None);
+		if (view == self.view):
+			return;
+
+		# Sort
+		order = None;
+		if use_sorting:
+			if (self.sorter is None) or (self.sorter.mode != mode):
+				self.sorter = svplib.sorting.FaceSorter(self.centers, self.flags, mode);
+			with svp_stats.timed("draw.sort"):
+				order = self.sorter.order(depth_row);
+
+		# Drop back faces
+		if (self.culler is not None):
+			with svp_stats.timed("draw.cull"):
+				keep = self.culler.keep(eye);
+				order = np.nonzero(keep)[0] if (order is None) else order[keep[order]];
+
+		self.upload_indices(self.corners if (order is None) else self.corners[order]);
+		self.view = view;
+
+	# Bind the buffers to the vertex attributes
+	def bind(self):
+		bgl.glBindBuffer(bgl.GL_ARRAY_BUFFER, self.buffers[0]);
+		bgl.glVertexAttribPointer(0, 3, bgl.GL_SHORT, bgl.GL_FALSE, VERTEX_STRIDE, 0);
+		bgl.glVertexAttribPointer(1, 2, bgl.GL_UNSIGNED_BYTE, bgl.GL_FALSE, VERTEX_STRIDE, VERTEX_FACE_OFFSET);
+
+	# Draw the triangles uploaded for the view
+	def draw(self):
+		bgl.glBindBuffer(bgl.GL_ELEMENT_ARRAY_BUFFER, self.buffers[1]);
+		bgl.glDrawElements(bgl.GL_TRIANGLES, self.draw_count, bgl.GL_UNSIGNED_INT, None);
+		bgl.glBindBuffer(bgl.GL_ELEMENT_ARRAY_BUFFER, 0);
+
+	# Free the buffers
+	def free(self):
+		bgl.glDeleteBuffers(2, self.buffers);
+
+# Batched draw vertex layout, the draw vertex followed by the object index and padding
+BATCH_VERTEX_STRIDE = 12;
+BATCH_OBJECT_OFFSET = 8;
+
+# GPU buffers of a batch of objects, drawn with one call
+#   The vertices and triangles of every object are stored one after another, and a changed
+#   object is re-uploaded in place as long as its size stays the same.
+#   Culled back faces are made degenerate instead of removed, so that the ranges stay the same.
+#   names  - Objects in the batch, in the order of their matrices
+#   ranges - First vertex, vertex count, first index and index count of every object
+#   views  - Eye the triangles of each culled object were last uploaded for
+class SVPDrawBatch:
+	def __init__(self):
+		self.buffers = bgl.Buffer(bgl.GL_INT, 2);
+		bgl.glGenBuffers(2, self.buffers);
+		self.names = ();
+		self.ranges = {};
+		self.views = {};
+		self.element_count = 0;
+
+	# Pack the vertices of an object with its index in the batch
+	def pack_vertices(self, index, vertices):
+		packed = np.zeros((len(vertices), BATCH_VERTEX_STRIDE // 2), np.int16);
+		packed[:, :4] = vertices;
+		packed[:, 4] = index;
+		return packed;
+
+	# Upload every object of the batch
+	def build(self, names, arrays):
+		with svp_stats.timed("draw.batch_build"):
+			self.names = names;
+			self.ranges = {};
+			self.views = {};
+			vertices = [];
+			elements = [];
+			vertex_start = 0;
+			element_start = 0;
+			for index, name in enumerate(names):
+				object_vertices, corners = arrays[name][:2];
+				vertices.append(self.pack_vertices(index, object_vertices));
+				elements.append(corners.reshape(-1) + vertex_start);
+				self.ranges[name] = (vertex_start, len(object_vertices), element_start, corners.size);
+				vertex_start += len(object_vertices);
+				element_start += corners.size;
+			self.element_count = element_start;
+			upload_buffer(self.buffers[0], np.concatenate(vertices).reshape(-1), bgl.GL_SHORT);
+			upload_buffer(self.buffers[1], np.concatenate(elements).astype(np.int32), bgl.GL_INT, bgl.GL_ELEMENT_ARRAY_BUFFER);
+
+	# Re-upload the range of a changed object, returns False if its size changed and the batch has to be built again
+	def update(self, name, vertices, corners):
+		vertex_start, vertex_count, element_start, element_count = self.ranges[name];
+		if (len(vertices) != vertex_count) or (corners.size != element_count):
+			return False;
+		with svp_stats.timed("draw.batch_update"):
+			packed = self.pack_vertices(self.names.index(name), vertices);
+			upload_buffer(self.buffers[0], packed.reshape(-1), bgl.GL_SHORT, offset=vertex_start * BATCH_VERTEX_STRIDE);
+			self.upload_elements(name, corners);
+		return True;
+
+	# Upload the triangles of an object into its range
+	def upload_elements(self, name, corners):
+		vertex_start, vertex_count, element_start, element_count = self.ranges[name];
+		upload_buffer(self.buffers[1], (corners.reshape(-1) + vertex_start).astype(np.int32), bgl.GL_INT,
+			bgl.GL_ELEMENT_ARRAY_BUFFER, offset=element_start * GL_TYPE_SIZES[bgl.GL_INT]);
+		self.views.pop(name, None);
+
+	# Upload the triangles of an object for a view, with its culled back faces collapsed onto their first corner
+	def upload_view(self, name, corners, culler, eye):
+		view = eye.tobytes();
+		if (self.views.get(name) == view):
+			return;
+		with svp_stats.timed("draw.cull"):
+			keep = culler.keep(eye);
+		self.upload_elements(name, np.where(keep[:, None], corners, corners[:, :1]));
+		self.views[name] = view;
+
+	# Bind the buffers to the vertex attributes
+	def bind(self):
+		bgl.glBindBuffer(bgl.GL_ARRAY_BUFFER, self.buffers[0]);
+		bgl.glVertexAttribPointer(0, 3, bgl.GL_SHORT, bgl.GL_FALSE, BATCH_VERTEX_STRIDE, 0);
+		bgl.glVertexAttribPointer(1, 2, bgl.GL_UNSIGNED_BYTE, bgl.GL_FALSE, BATCH_VERTEX_STRIDE, VERTEX_FACE_OFFSET);
+		bgl.glVertexAttribPointer(2, 1, bgl.GL_UNSIGNED_SHORT, bgl.GL_FALSE, BATCH_VERTEX_STRIDE, BATCH_OBJECT_OFFSET);
+
+	# Set the matrices of the objects and draw them all
+	def draw(self, matrix_location, matrices):
+		matrices = bgl.Buffer(bgl.GL_FLOAT, matrices.size, matrices.reshape(-1));
+		bgl.glUniformMatrix4fv(matrix_location, len(self.names), bgl.GL_FALSE, matrices);
+		bgl.glBindBuffer(bgl.GL_ELEMENT_ARRAY_BUFFER, self.buffers[1]);
+		bgl.glDrawElements(bgl.GL_TRIANGLES, self.element_count, bgl.GL_UNSIGNED_INT, None);
+		bgl.glBindBuffer(bgl.GL_ELEMENT_ARRAY_BUFFER, 0);
+
+	# Free the buffers
+	def free(self):
+		bgl.glDeleteBuffers(2, self.buffers);
+
+# Free all batched GPU buffers
+def free_draw_batches():
+	for batch in svp_batches:
+		batch.free();
+	svp_batches.clear();
+	svp_batch_arrays.clear();
+	svp_batch_dirty.clear();
+
+# Get the packed draw vertices, triangle corners and backface culling of an object, rebuilding them if it changed
+#   Returns the arrays and whether they were rebuilt
+def get_batch_arrays(obj, depsgraph):
+	arrays = svp_batch_arrays.get(obj.name);
+	if (arrays is not None) and (obj.name not in svp_batch_dirty):
+		return arrays, False;
+
+	# Rebuild from the evaluated mesh
+	svp_batch_dirty.discard(obj.name);
+	obj_eval = obj.evaluated_get(depsgraph);
+	with svp_stats.timed("draw.mesh"):
+		mesh = obj_eval.to_mesh();
+	if mesh is None:
+		arrays = (np.zeros((0, 4), np.int16), np.zeros((0, 3), np.int32), None);
+	else:
+		with svp_stats.timed("draw.buffers"):
+			mesh_arrays = mesh_draw_arrays(mesh);
+			arrays = (svplib.pack_draw_vertices(mesh_arrays["positions"], mesh_arrays["face_data"]), mesh_arrays["corners"],
+				get_draw_culler(mesh_arrays));
+		obj_eval.to_mesh_clear();
+	svp_batch_arrays[obj.name] = arrays;
+	return arrays, True;
+
+# Draw objects in batches, uploading only the objects that changed and the culled objects the view changed for
+def draw_batches(objects, depsgraph, region_data, matrix_location):
+	# Get the arrays of every object, and forget objects that are gone
+	changed = set();
+	for obj in objects:
+		if get_batch_arrays(obj, depsgraph)[1]:
+			changed.add(obj.name);
+	by_name = {obj.name: obj for obj in objects};
+	for name in list(svp_batch_arrays.keys()):
+		if name not in by_name:
+			del svp_batch_arrays[name];
+	names = [obj.name for obj in objects if svp_batch_arrays[obj.name][1].size > 0];
+
+	# Split the objects into batches, building the batches whose objects changed
+	chunks = [tuple(names[i:i + svp_batch_size]) for i in range(0, len(names), svp_batch_size)];
+	while len(svp_batches) > len(chunks):
+		svp_batches.pop().free();
+	for i, chunk in enumerate(chunks):
+		if (i == len(svp_batches)):
+			svp_batches.append(SVPDrawBatch());
+		batch = svp_batches[i];
+		if (batch.names != chunk) or not all(batch.update(name, *svp_batch_arrays[name][:2]) for name in changed.intersection(chunk)):
+			batch.build(chunk, svp_batch_arrays);
+
+	# Draw every batch, with the matrices in column-major order
+	perspective_matrix = np.array(region_data.perspective_matrix, np.float64);
+	view_matrix = np.array(region_data.view_matrix, np.float64);
+	scale = np.array(FIXED_POINT_SCALE, np.float64);
+	bgl.glEnableVertexAttribArray(2);
+	with svp_stats.timed("draw.draw"):
+		for batch in svp_batches:
+			world = np.array([by_name[name].matrix_world for name in batch.names], np.float64);
+			eyes = svplib.culling.view_eye(view_matrix, world, region_data.is_perspective);
+			for index, name in enumerate(batch.names):
+				object_vertices, corners, culler = svp_batch_arrays[name];
+				if (culler is not None):
+					batch.upload_view(name, corners, culler, eyes[index]);
+			matrices = (perspective_matrix @ world @ scale).transpose(0, 2, 1).astype(np.float32);
+			batch.bind();
+			batch.draw(matrix_location, matrices);
+			svp_stats.count("draw.triangles", batch.element_count // 3);
+			svp_stats.count("draw.batches");
+	bgl.glDisableVertexAttribArray(2);
+
+# Free the cached GPU buffers of every object
+def free_draw_cache_objects():
+	for buffers in svp_draw_cache.values():
+		buffers.free();
+	svp_draw_cache.clear();
+	svp_dirty_objects.clear();
+
+# Free all cached GPU buffers
+def free_draw_cache():
+	free_draw_cache_objects();
+	free_draw_batches();
+
+# Get the cached GPU buffers of an object, rebuilding them if it changed
+def get_draw_buffers(obj, depsgraph):
+	buffers = svp_draw_cache.get(obj.name);
+	if (buffers is not None) and (obj.name not in svp_dirty_objects):
+		return buffers;
+
+	# Rebuild from the evaluated mesh
+	if (buffers is None):
+		buffers = SVPDrawBuffers();
+		svp_draw_cache[obj.name] = buffers;
+	svp_dirty_objects.discard(obj.name);
+	obj_eval = obj.evaluated_get(depsgraph);
+	with svp_stats.timed("draw.mesh"):
+		mesh = obj_eval.to_mesh();
+	if mesh is None:
+		buffers.vertex_count = 0;
+		buffers.element_count = 0;
+	else:
+		buffers.upload_mesh(mesh);
+		obj_eval.to_mesh_clear();
+	return buffers;
+
 # Draw SVP render
-def svp_draw(context):
+def svp_draw(context, depsgraph):
 	global svp_shader;
 
-	# Set up settings
+	# Set up settings, sorted faces are painted in order without depth testing
+	sort_mode = context.scene.svp_sort_mode;
+	use_sorting = (sort_mode != svplib.sorting.SORT_DEPTH);
 	bgl.glEnable(bgl.GL_BLEND);
-	bgl.glEnable(bgl.GL_DEPTH_TEST);
+	if not use_sorting:
+		bgl.glEnable(bgl.GL_DEPTH_TEST);
 	bgl.glBlendFunc(bgl.GL_ONE, bgl.GL_ONE_MINUS_SRC_ALPHA);
 
 	# Get old shader
@@ -901,153 +1791,68 @@ def svp_draw(context):
 	bgl.glBindVertexArray(vertex_array[0]);
 	bgl.glEnableVertexAttribArray(0);
 	bgl.glEnableVertexAttribArray(1);
-	bgl.glEnableVertexAttribArray(2);
-	bgl.glEnableVertexAttribArray(3);
 
 	# Use the SVP shader
+	if (svp_shader == -1):
+		create_svp_shader();
 	bgl.glUseProgram(svp_shader);
-	position_location = 0;
-	shader_matrix = bgl.glGetUniformLocation(svp_shader, "mat");
-
-	# Get palette
-	scene = bpy.context.scene;
-	colors = {
-		0: scene.svp_palette.color0,
-		1: scene.svp_palette.color1,
-		2: scene.svp_palette.color2,
-		3: scene.svp_palette.color3,
-		4: scene.svp_palette.color4,
-		5: scene.svp_palette.color5,
-		6: scene.svp_palette.color6,
-		7: scene.svp_palette.color7,
-		8: scene.svp_palette.color8,
-		9: scene.svp_palette.color9,
-		10: scene.svp_palette.color10,
-		11: scene.svp_palette.color11,
-		12: scene.svp_palette.color12,
-		13: scene.svp_palette.color13,
-		14: scene.svp_palette.color14,
-		15: scene.svp_palette.color15
-	};
-	palette = [];
-	for i in range(0, 16):
-		color = colors.get(i, [0.0,0.0,0.0]);
-		color = [color.r, color.g, color.b];
-		if (i == 0):
-			color.append(0);
-		else:
-			color.append(1);
-		palette.append(color);
+	shader_matrix = bgl.glGetUniformLocation(svp_shader, "mats");
+
+	# Set palette
+	palette = bgl.Buffer(bgl.GL_FLOAT, 64, get_palette(context.scene).reshape(-1));
+	bgl.glUniform4fv(bgl.glGetUniformLocation(svp_shader, "palette"), 16, palette);
+
+	# Draw all objects in a few batches, when faces are not sorted
+	use_batching = context.scene.svp_batch_draw and not use_sorting;
+	if use_batching:
+		free_draw_cache_objects();
+		objects = [obj for obj in context.scene.objects if hasattr(obj.data, "polygons")];
+		draw_batches(objects, depsgraph, context.region_data, shader_matrix);
+	else:
+		free_draw_batches();
 
-	# Go through each object
+	# Get the objects to draw one by one
+	drawn = set();
+	draw_list = [];
 	for obj in context.scene.objects:
-		if hasattr(obj.data, "polygons"):
-			# Get BMesh
-			bm = bmesh.new();
-			if obj.mode == "EDIT":
-				bm = bmesh.from_edit_mesh(obj.data);
-			else:
-				bm.from_mesh(obj.data);
+		if (not use_batching) and hasattr(obj.data, "polygons"):
+			drawn.add(obj.name);
+			buffers = get_draw_buffers(obj, depsgraph);
+			if (buffers.element_count > 0):
+				draw_list.append((obj, buffers));
+
+	# Sort faces within each object and drop culled back faces, then sort objects back to front
+	view_matrix = context.region_data.view_matrix;
+	depths = [];
+	for obj, buffers in draw_list:
+		depth_row = -np.array(view_matrix @ obj.matrix_world, np.float64)[2];
+		eye = svplib.culling.view_eye(view_matrix, obj.matrix_world, context.region_data.is_perspective);
+		buffers.upload_view(sort_mode, depth_row, eye);
+		depths.append(depth_row[3]);
+	if use_sorting:
+		draw_list = [draw_list[i] for i in np.argsort(depths, kind="stable")[::-1]];
 
+	# Go through each object
+	with svp_stats.timed("draw.draw"):
+		for obj, buffers in draw_list:
 			# Set up matrix
-			matrix_buffer = bgl.Buffer(bgl.GL_FLOAT, [4,4], obj.matrix_world.transposed() @ context.region_data.perspective_matrix.transposed())
+			matrix_buffer = bgl.Buffer(bgl.GL_FLOAT, [4,4], (context.region_data.perspective_matrix @ obj.matrix_world @ FIXED_POINT_SCALE).transposed())
 			bgl.glUniformMatrix4fv(shader_matrix, 1, bgl.GL_FALSE, matrix_buffer[0]);
 
-			# Get layers
-			if hasattr(bm.faces, "ensure_lookup_table"): 
-				bm.faces.ensure_lookup_table();
-			layers_created = False;
-			pal_tag = bm.faces.layers.int.get("palette_ids");
-			dither_tag = bm.faces.layers.int.get("dither_ids");
-			if (pal_tag is None):
-				layers_created = True;
-				pal_tag = bm.faces.layers.int.new("palette_ids");
-			if (dither_tag is None):
-				dither_tag = bm.faces.layers.int.new("dither_ids");
-
-			# Create vertex and data buffers
-			vertex_buffers = bgl.Buffer(bgl.GL_INT, 4);
-			bgl.glGenBuffers(4, vertex_buffers);
-			vertex_pos = [];
-			vertex_colors1 = [];
-			vertex_colors2 = [];
-			vertex_dithers = [];
-
-			# Go through each polygon
-			face_id = 0;
-			for face in bm.faces:
-				# Get layer data
-				if (layers_created):
-					bm.faces[face_id][pal_tag] = 0x11;
-				color = bm.faces[face_id][pal_tag];
-				color1 = palette[(color >> 4) & 0xF];
-				color2 = palette[color & 0xF];
-				dither = bm.faces[face_id][dither_tag];
-
-				# Get vertices
-				if (len(face.verts) < 5):
-					vertex_id = 0;
-					for vertex in range(0,len(face.verts)):
-						if (vertex_id >= 3):
-							vertex_pos.extend(face.verts[vertex-1].co);
-							vertex_colors1.extend(color1);
-							vertex_colors2.extend(color2);
-							vertex_dithers.append(dither);
-							vertex_pos.extend(face.verts[vertex].co);
-							vertex_colors1.extend(color1);
-							vertex_colors2.extend(color2);
-							vertex_dithers.append(dither);
-							vertex_pos.extend(face.verts[vertex-3].co);
-							vertex_colors1.extend(color1);
-							vertex_colors2.extend(color2);
-							vertex_dithers.append(dither);
-						else:
-							vertex_pos.extend(face.verts[vertex].co);
-							vertex_colors1.extend(color1);
-							vertex_colors2.extend(color2);
-							vertex_dithers.append(dither);
-						vertex_id += 1;
-
-				# Next face
-				face_id += 1;
-
-			if (len(vertex_pos) > 0):
-				positions = bgl.Buffer(bgl.GL_FLOAT, len(vertex_pos), vertex_pos);
-				colors1 = bgl.Buffer(bgl.GL_FLOAT, len(vertex_colors1), vertex_colors1);
-				colors2 = bgl.Buffer(bgl.GL_FLOAT, len(vertex_colors2), vertex_colors2);
-				dithers = bgl.Buffer(bgl.GL_FLOAT, len(vertex_dithers), vertex_dithers);
-
-				bgl.glBindBuffer(bgl.GL_ARRAY_BUFFER, vertex_buffers[0]);
-				bgl.glBufferData(bgl.GL_ARRAY_BUFFER, int(len(vertex_pos)*4), positions, bgl.GL_STATIC_DRAW);
-				bgl.glVertexAttribPointer(0, 3, bgl.GL_FLOAT, bgl.GL_FALSE, 0, None);
-
-				bgl.glBindBuffer(bgl.GL_ARRAY_BUFFER, vertex_buffers[1]);
-				bgl.glBufferData(bgl.GL_ARRAY_BUFFER, int(len(vertex_colors1)*4), colors1, bgl.GL_STATIC_DRAW);
-				bgl.glVertexAttribPointer(1, 4, bgl.GL_FLOAT, bgl.GL_FALSE, 0, None);
-
-				bgl.glBindBuffer(bgl.GL_ARRAY_BUFFER, vertex_buffers[2]);
-				bgl.glBufferData(bgl.GL_ARRAY_BUFFER, int(len(vertex_colors2)*4), colors2, bgl.GL_STATIC_DRAW);
-				bgl.glVertexAttribPointer(2, 4, bgl.GL_FLOAT, bgl.GL_FALSE, 0, None);
-
-				bgl.glBindBuffer(bgl.GL_ARRAY_BUFFER, vertex_buffers[3]);
-				bgl.glBufferData(bgl.GL_ARRAY_BUFFER, int(len(vertex_dithers)*4), dithers, bgl.GL_STATIC_DRAW);
-				bgl.glVertexAttribPointer(3, 1, bgl.GL_FLOAT, bgl.GL_FALSE, 0, None);
-
-				bgl.glDrawArrays(bgl.GL_TRIANGLES, 0, len(dithers));
-
-				bgl.glDeleteBuffers(1, positions);
-				bgl.glDeleteBuffers(1, colors1);
-				bgl.glDeleteBuffers(1, colors2);
-				bgl.glDeleteBuffers(1, dithers);
-
-			bgl.glDeleteBuffers(4, vertex_buffers);
-			bgl.glDeleteBuffers(1, matrix_buffer);
+			# Draw
+			buffers.bind();
+			buffers.draw();
+			svp_stats.count("draw.triangles", buffers.draw_count // 3);
+
+	# Free the buffers of objects that are gone
+	for name in list(svp_draw_cache.keys()):
+		if name not in drawn:
+			svp_draw_cache.pop(name).free();
 
 	# Clean up
+	bgl.glBindBuffer(bgl.GL_ARRAY_BUFFER, 0);
 	bgl.glDisableVertexAttribArray(0);
 	bgl.glDisableVertexAttribArray(1);
-	bgl.glDisableVertexAttribArray(2);
-	bgl.glDisableVertexAttribArray(3);
 	bgl.glBindVertexArray(0);
 	bgl.glDeleteVertexArrays(1, vertex_array);
 
@@ -1073,83 +1878,86 @@ def get_panels():
 def menu_func_import(self, context):
 	self.layout.operator(ImportSVP.bl_idname, text="SEGA Virtua Processor Model (.svp)");
 
+# ROM import menu function
+def menu_func_import_rom(self, context):
+	self.layout.operator(ImportSVPROM.bl_idname, text="SEGA Virtua Processor ROM Models (.bin)");
+
 # Export menu function
 def menu_func_export(self, context):
 	self.layout.operator(ExportSVP.bl_idname, text="SEGA Virtua Processor Model (.svp)");
 
+# Batch export menu function
+def menu_func_export_batch(self, context):
+	self.layout.operator(ExportSVPBatch.bl_idname, text="SEGA Virtua Processor Models, Batch (.svp)");
+
+# Detail level export menu function
+def menu_func_export_lod(self, context):
+	self.layout.operator(ExportSVPLOD.bl_idname, text="SEGA Virtua Processor Model LODs (.svpb)");
+
 # Classes
 classes = (
+	SVPPreferences,
 	ImportSVP,
+	ImportSVPROM,
 	ExportSVP,
+	ExportSVPBatch,
+	ExportSVPLOD,
 	SVPPalette,
 	SVPPalLoadOperator,
 	SVPPalettePanel,
 	SVPPanel,
+	SVPApplyFacePropertiesOperator,
+	SVPRenderPanel,
+	SVPStatsPanel,
+	SVPStatsResetOperator,
+	SVPStatsExportOperator,
 	SVPRenderEngine,
 )
 
 # Register
 def register():
-	global svp_shader;
-
 	for cls in classes:
 		bpy.utils.register_class(cls);
 
 	bpy.types.TOPBAR_MT_file_import.append(menu_func_import);
+	bpy.types.TOPBAR_MT_file_import.append(menu_func_import_rom);
 	bpy.types.TOPBAR_MT_file_export.append(menu_func_export);
+	bpy.types.TOPBAR_MT_file_export.append(menu_func_export_batch);
+	bpy.types.TOPBAR_MT_file_export.append(menu_func_export_lod);
 
 	for panel in get_panels():
 		panel.COMPAT_ENGINES.add("SVP_RENDER");
 
 	bpy.types.Scene.svp_palette = bpy.props.PointerProperty(name="SVP Color", type=SVPPalette);
+	bpy.types.Scene.svp_sort_mode = bpy.props.EnumProperty(name="Face Order", default="DEPTH", items=[
+		("DEPTH", "Depth Buffer", "Draw faces with a depth buffer"),
+		("PAINTER", "Painter's Order", "Sort faces back to front by depth"),
+		("FLAGS", "SVP Flags", "Sort faces by their flags first, then back to front by depth, like the hardware"),
+	]);
+	bpy.types.Scene.svp_batch_draw = bpy.props.BoolProperty(name="Batch Objects", default=False,
+		description="Draw all objects from shared buffers in a few calls, only used with the depth buffer");
 	bpy.types.Mesh.checker_dither = bpy.props.BoolProperty(name="Checkerboard Dithering", get=get_checker_dither, set=set_checker_dither);
 	bpy.types.Mesh.cull_enabled = bpy.props.BoolProperty(name="Enable Culling", get=get_culling, set=set_culling);
 	bpy.types.Mesh.color1 = bpy.props.IntProperty(name="Color 1", get=get_color1, set=set_color1, min=0, max=15);
 	bpy.types.Mesh.color2 = bpy.props.IntProperty(name="Color 2", get=get_color2, set=set_color2, min=0, max=15);
 	bpy.types.Mesh.flags = bpy.props.IntProperty(name="Flags", get=get_flags, set=set_flags, min=0, max=15);
+	bpy.types.WindowManager.svp_stats_enabled = bpy.props.BoolProperty(name="Collect Timings", default=False, update=update_stats_enabled,
+		description="Time the import, export, drawing and face property phases of the add-on");
 
-	# Vertex shader
-	vertex_shader = create_shader(bgl.GL_VERTEX_SHADER, 
-	"""
-	#version 330 core
-	layout(location = 0) in vec3 in_pos;
-	layout(location = 1) in vec4 in_color1;
-	layout(location = 2) in vec4 in_color2;
-	layout(location = 3) in float in_dither;
-	out vec4 color1;
-	out vec4 color2;
-	out float dither;
-	uniform mat4 mat;
-	void main()
-	{
-		gl_Position = mat * vec4(in_pos,1);
-		color1 = in_color1;
-		color2 = in_color2;
-		dither = in_dither;
-	}""")
-
-	# Fragment shader
-	fragment_shader = create_shader(bgl.GL_FRAGMENT_SHADER,
-	"""
-	#version 330 core
-	in vec4 color1;
-	in vec4 color2;
-	in float dither;
-	out vec4 color;
-
-	void main()
-	{
-		color = (mix(1.0, 0.0, sign(mod(floor(gl_FragCoord.x / 3.0) + (floor(gl_FragCoord.y / 3.0) * sign(dither)), 2.0))) == 1.0) ? color1 : color2;
-	}
-	""")
-
-	# Shader program
-	svp_shader = create_program(vertex_shader, fragment_shader);
+	bpy.app.handlers.depsgraph_update_post.append(face_summary_depsgraph_update);
+	bpy.app.handlers.load_post.append(face_summary_load_post);
+	bpy.app.handlers.depsgraph_update_post.append(export_cache_depsgraph_update);
+	bpy.app.handlers.load_post.append(export_cache_clear);
+	bpy.app.handlers.undo_post.append(export_cache_clear);
+	bpy.app.handlers.redo_post.append(export_cache_clear);
 
 # Unregister
 def unregister():
 	bpy.types.TOPBAR_MT_file_import.remove(menu_func_import);
+	bpy.types.TOPBAR_MT_file_import.remove(menu_func_import_rom);
 	bpy.types.TOPBAR_MT_file_export.remove(menu_func_export);
+	bpy.types.TOPBAR_MT_file_export.remove(menu_func_export_batch);
+	bpy.types.TOPBAR_MT_file_export.remove(menu_func_export_lod);
 
 	for cls in classes:
 		bpy.utils.unregister_class(cls);
@@ -1159,10 +1967,22 @@ def unregister():
 			panel.COMPAT_ENGINES.remove("SVP_RENDER");
 
 	del bpy.types.Scene.svp_palette;
-
-	bgl.glDeleteShader(vertex_shader);
-	bgl.glDeleteShader(fragment_shader);
-	bgl.glDeleteProgram(svp_shader);
+	del bpy.types.Scene.svp_sort_mode;
+	del bpy.types.Scene.svp_batch_draw;
+	del bpy.types.WindowManager.svp_stats_enabled;
+	svp_stats.enabled = False;
+
+	bpy.app.handlers.depsgraph_update_post.remove(face_summary_depsgraph_update);
+	bpy.app.handlers.load_post.remove(face_summary_load_post);
+	bpy.app.handlers.depsgraph_update_post.remove(export_cache_depsgraph_update);
+	bpy.app.handlers.load_post.remove(export_cache_clear);
+	bpy.app.handlers.undo_post.remove(export_cache_clear);
+	bpy.app.handlers.redo_post.remove(export_cache_clear);
+	export_cache_clear();
+	invalidate_face_summary();
+
+	free_draw_cache();
+	delete_svp_shader();
 
 # Main
 if __name__ == "__main__":
@@ -0,0 +1,12 @@
+'''
+	Sega Virtua Processor support library
+	See LICENSE for copyright and license details.
+
+	Everything in here works without Blender, so it can be used by headless tools.
+'''
+
+# Model format
+from .model import (SVPError, SVPModel, scan_svp, parse_svp, read_svp, to_fixed_point, build_svp_model, weld_vertices, encode_svp, write_svp);
+
+# Geometry helpers
+from .geometry import (fan_triangles, face_loops, face_centers, loop_faces, triangulate, pack_draw_vertices);
@@ -0,0 +1,247 @@
+'''
+	Benchmarks for SVP model handling
+	See LICENSE for copyright and license details.
+
+	Usage: python -m svplib.bench [--sizes N ...] [--json PATH] [--baseline PATH]
+
+	Parsing, encoding and draw array building run anywhere. The Blender benchmarks (mesh
+	creation, export, face attribute access and panel summaries) run when the add-on can
+	be imported, for example with:
+	  blender -b --python-expr "import sys, svplib.bench; sys.exit(svplib.bench.main(['--json', 'blender.json']))"
+'''
+
+# Imports
+import argparse, json, os, platform, sys, tempfile, time;
+import numpy as np;
+from .model import (parse_svp, scan_svp, encode_svp, write_svp);
+from .geometry import (fan_triangles, face_centers, loop_faces, triangulate, pack_draw_vertices);
+from .sorting import (FaceSorter, SORT_FLAGS);
+from .culling import FaceCuller;
+from .synth import generate_model;
+try:
+	import bpy, svp_support;
+except ImportError:
+	bpy = None;
+	svp_support = None;
+
+# Default model sizes, up to the header limit
+DEFAULT_SIZES = (256, 4096, 65536);
+
+# Default slowdown over the baseline that counts as a regression
+DEFAULT_THRESHOLD = 1.25;
+
+# Headless benchmarks, each one sets up a function to time from a model, its encoded data and a scratch folder
+
+# Find the face records
+def bench_scan(model, data, folder):
+	return lambda: scan_svp(data);
+
+# Decode a model
+def bench_parse(model, data, folder):
+	return lambda: parse_svp(data);
+
+# Encode a model into a preallocated buffer
+def bench_encode(model, data, folder):
+	out = bytearray(model.byte_size);
+	return lambda: encode_svp(model, out);
+
+# Write a model file
+def bench_write(model, data, folder):
+	path = os.path.join(folder, "bench.svp");
+	return lambda: write_svp(path, model);
+
+# Build the vertex and index arrays of the viewport
+def bench_draw_arrays(model, data, folder):
+	positions = model.positions().reshape(-1, 3);
+	face_starts = model.face_starts();
+	flag_bytes = model.flag_bytes();
+	def run():
+		corners, tri_faces = fan_triangles(face_starts, model.face_sizes);
+		centers = face_centers(positions, model.face_vertices, face_starts, model.face_sizes)[tri_faces];
+		face_data = np.stack([model.palette, flag_bytes], 1)[loop_faces(face_starts, model.face_sizes, model.loop_count)];
+		return pack_draw_vertices(positions[model.face_vertices], face_data), corners.reshape(-1).astype(np.int32), centers;
+	return run;
+
+# Sort faces by their flags and depth
+def bench_sort(model, data, folder):
+	tris, centers, tri_faces = triangulate(model.positions(), model.face_vertices, model.face_starts(), model.face_sizes);
+	sorter = FaceSorter(centers, model.flags[tri_faces], SORT_FLAGS);
+	depth_row = np.array([0.0, 0.0, 1.0, 0.0]);
+	return lambda: sorter.order(depth_row);
+
+# Reject back faces for a view, with every face culled
+def bench_cull(model, data, folder):
+	tris, centers, tri_faces = triangulate(model.positions(), model.face_vertices, model.face_starts(), model.face_sizes);
+	culler = FaceCuller(tris, np.ones(len(tris), np.uint8));
+	eye = np.array([0.0, 0.0, 10.0, 1.0]);
+	return lambda: culler.keep(eye);
+
+# Blender benchmarks
+
+# Create a mesh from a model
+def bench_mesh_import(model, data, folder):
+	def run():
+		bpy.data.meshes.remove(svp_support.svp_model_to_mesh(model, "SVP Benchmark"));
+	return run;
+
+# Get the model of a mesh
+def bench_mesh_export(model, data, folder):
+	mesh = svp_support.svp_model_to_mesh(model, "SVP Benchmark");
+	return lambda: svp_support.mesh_to_svp_model(mesh);
+
+# Read every face attribute layer
+def bench_face_values(model, data, folder):
+	mesh = svp_support.svp_model_to_mesh(model, "SVP Benchmark");
+	def run():
+		for name, default in (("palette_ids", 0x11), ("dither_ids", 0), ("cull_ids", 0), ("flag_ids", 0)):
+			svp_support.get_face_values(mesh, name, default);
+	return run;
+
+# Get the indexed triangles of a mesh for drawing
+def bench_mesh_draw_arrays(model, data, folder):
+	mesh = svp_support.svp_model_to_mesh(model, "SVP Benchmark");
+	return lambda: svp_support.mesh_draw_arrays(mesh);
+
+# Summarize the selected faces for the panel getters
+def bench_face_summary(model, data, folder):
+	# Select every face of a new object and enter edit mode
+	mesh = svp_support.svp_model_to_mesh(model, "SVP Benchmark");
+	mesh.polygons.foreach_set("select", np.ones(len(mesh.polygons), bool));
+	obj = bpy.data.objects.new("SVP Benchmark", mesh);
+	scene = bpy.context.scene;
+	scene.collection.objects.link(obj);
+	bpy.context.view_layer.objects.active = obj;
+	bpy.ops.object.mode_set(mode="EDIT");
+	return lambda: svp_support.build_face_summary(scene);
+
+# Clean up after the Blender benchmarks
+def cleanup_blender():
+	if bpy.context.object and (bpy.context.object.mode != "OBJECT"):
+		bpy.ops.object.mode_set(mode="OBJECT");
+	for obj in [obj for obj in bpy.data.objects if obj.name.startswith("SVP Benchmark")]:
+		bpy.data.objects.remove(obj);
+	for mesh in [mesh for mesh in bpy.data.meshes if mesh.name.startswith("SVP Benchmark")]:
+		bpy.data.meshes.remove(mesh);
+
+# Benchmarks, by name, and whether they need Blender
+BENCHMARKS = {
+	"scan": (bench_scan, False),
+	"parse": (bench_parse, False),
+	"encode": (bench_encode, False),
+	"write": (bench_write, False),
+	"draw_arrays": (bench_draw_arrays, False),
+	"sort": (bench_sort, False),
+	"cull": (bench_cull, False),
+	"mesh_import": (bench_mesh_import, True),
+	"mesh_export": (bench_mesh_export, True),
+	"face_values": (bench_face_values, True),
+	"mesh_draw_arrays": (bench_mesh_draw_arrays, True),
+	"face_summary": (bench_face_summary, True),
+};
+
+# Time a function, returns the time of every run in seconds
+def time_runs(func, repeat):
+	func();
+	times = [];
+	for i in range(repeat):
+		start = time.perf_counter();
+		func();
+		times.append(time.perf_counter() - start);
+	return times;
+
+# Run benchmarks, returns a result for each benchmark and model size
+def run_benchmarks(names=None, sizes=DEFAULT_SIZES, quad_ratio=0.5, seed=0, repeat=5):
+	names = names or [name for name, (setup, blender) in BENCHMARKS.items() if (not blender) or (svp_support is not None)];
+	results = [];
+	with tempfile.TemporaryDirectory() as folder:
+		for size in sizes:
+			model = generate_model(size, quad_ratio, seed);
+			data = bytes(encode_svp(model));
+			for name in names:
+				setup, blender = BENCHMARKS[name];
+				if blender and (svp_support is None):
+					continue;
+				try:
+					times = time_runs(setup(model, data, folder), repeat);
+				finally:
+					if blender:
+						cleanup_blender();
+				best = min(times);
+				results.append({
+					"name": name,
+					"faces": size,
+					"best_ms": best * 1000.0,
+					"mean_ms": (sum(times) / len(times)) * 1000.0,
+					"faces_per_s": size / max(best, 1e-9),
+				});
+	return results;
+
+# Compare results against a baseline, returns the results that got slower than the threshold allows
+def find_regressions(results, baseline, threshold=DEFAULT_THRESHOLD):
+	base = {(result["name"], result["faces"]): result for result in baseline["results"]};
+	regressions = [];
+	for result in results:
+		old = base.get((result["name"], result["faces"]));
+		if (old is not None) and (result["best_ms"] > old["best_ms"] * threshold):
+			regressions.append((result, old));
+	return regressions;
+
+# Command line entry point
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog="python -m svplib.bench", description="Benchmark SVP model handling.");
+	parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES), help="Face counts of the synthetic models");
+	parser.add_argument("--quad-ratio", type=float, default=0.5, help="Share of quads in the synthetic models (default: 0.5)");
+	parser.add_argument("--seed", type=int, default=0, help="Random seed of the synthetic models");
+	parser.add_argument("--repeat", type=int, default=5, help="Timed runs of each benchmark (default: 5)");
+	parser.add_argument("--only", nargs="+", choices=sorted(BENCHMARKS), help="Benchmarks to run (default: all that can run)");
+	parser.add_argument("--json", metavar="PATH", help="Write the results as JSON, - for stdout");
+	parser.add_argument("--baseline", metavar="PATH", help="JSON results to check for regressions against");
+	parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+		help="Slowdown over the baseline that counts as a regression (default: %.2f)" % DEFAULT_THRESHOLD);
+	parser.add_argument("--write", metavar="FOLDER", help="Only write the synthetic models into a folder");
+	args = parser.parse_args(argv);
+
+	# Write synthetic models
+	if args.write:
+		os.makedirs(args.write, exist_ok=True);
+		for size in args.sizes:
+			write_svp(os.path.join(args.write, "synth_%d.svp" % size), generate_model(size, args.quad_ratio, args.seed));
+		return 0;
+
+	results = run_benchmarks(args.only, args.sizes, args.quad_ratio, args.seed, args.repeat);
+
+	# Report
+	if args.json != "-":
+		print("%-16s %8s %12s %12s %14s" % ("benchmark", "faces", "best ms", "mean ms", "faces/s"));
+		for result in results:
+			print("%-16s %8d %12.3f %12.3f %14.0f" % (result["name"], result["faces"], result["best_ms"], result["mean_ms"], result["faces_per_s"]));
+	if args.json:
+		document = {
+			"python": platform.python_version(),
+			"numpy": np.__version__,
+			"blender": bpy.app.version_string if bpy is not None else None,
+			"machine": platform.machine(),
+			"quad_ratio": args.quad_ratio,
+			"seed": args.seed,
+			"results": results,
+		};
+		if args.json == "-":
+			json.dump(document, sys.stdout, indent=1);
+			print();
+		else:
+			with open(args.json, "w") as file:
+				json.dump(document, file, indent=1);
+
+	# Check for regressions
+	if args.baseline:
+		with open(args.baseline, "r") as file:
+			baseline = json.load(file);
+		regressions = find_regressions(results, baseline, args.threshold);
+		for result, old in regressions:
+			print("Regression: %s with %d faces took %.3f ms, baseline %.3f ms" % (result["name"], result["faces"], result["best_ms"], old["best_ms"]), file=sys.stderr);
+		if regressions:
+			return 1;
+	return 0;
+
+if __name__ == "__main__":
+	sys.exit(main());
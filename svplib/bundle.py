@@ -0,0 +1,171 @@
+'''
+	Multi-model SVP bundles
+	See LICENSE for copyright and license details.
+
+	Usage: python -m svplib.bundle BUNDLE [--pack MODEL ...] [--extract FOLDER] [--only N ...]
+
+	A bundle holds any number of models behind a table of their offsets and sizes, so any model
+	can be decoded straight from a memory-mapped file without reading the ones before it.
+
+	Layout, big endian like the models themselves:
+	  magic "SVPB", version (u16), reserved (u16), model count (u32)
+	  offset and size of every model (u32 each), from the start of the file
+	  name of every model (u8 length and ASCII text)
+	  models, one after another
+'''
+
+# Imports
+import argparse, os, struct, sys;
+from .model import (SVPError, parse_svp, read_svp, encode_svp);
+from .rom import map_file;
+
+# Header and table layout
+BUNDLE_MAGIC = b"SVPB";
+BUNDLE_VERSION = 1;
+BUNDLE_HEADER = struct.Struct(">4sHHI");
+BUNDLE_ENTRY = struct.Struct(">II");
+BUNDLE_EXTENSION = ".svpb";
+
+# Check if a buffer starts with a bundle header
+def is_bundle(data):
+	return bytes(data[:len(BUNDLE_MAGIC)]) == BUNDLE_MAGIC;
+
+# Encode the header, table and names of a bundle, the models follow it in order
+#   sizes - Size of every model in bytes
+#   names - Name of every model, empty if not given
+def encode_bundle_header(sizes, names=None):
+	names = [name.encode("ascii", "replace")[:255] for name in (names or [""] * len(sizes))];
+	if len(names) != len(sizes):
+		raise ValueError("Got %d names for %d models." % (len(names), len(sizes)));
+
+	# Lay out the table and the names
+	table_end = BUNDLE_HEADER.size + (BUNDLE_ENTRY.size * len(sizes));
+	out = bytearray(table_end + sum(1 + len(name) for name in names));
+	BUNDLE_HEADER.pack_into(out, 0, BUNDLE_MAGIC, BUNDLE_VERSION, 0, len(sizes));
+	offset = len(out);
+	for i, size in enumerate(sizes):
+		BUNDLE_ENTRY.pack_into(out, BUNDLE_HEADER.size + (i * BUNDLE_ENTRY.size), offset, size);
+		offset += size;
+	pos = table_end;
+	for name in names:
+		out[pos] = len(name);
+		out[pos+1:pos+1+len(name)] = name;
+		pos += 1 + len(name);
+	return out;
+
+# Encode models into a bundle, returns the buffer
+#   names - Name of every model, empty if not given
+def encode_bundle(models, names=None):
+	header = encode_bundle_header([model.byte_size for model in models], names);
+	out = bytearray(len(header) + sum(model.byte_size for model in models));
+	out[:len(header)] = header;
+	offset = len(header);
+	for model in models:
+		encode_svp(model, out, offset);
+		offset += model.byte_size;
+	return out;
+
+# Write a bundle file
+def write_bundle(path, models, names=None):
+	with open(path, "wb") as file:
+		file.write(encode_bundle(models, names));
+
+# Read the table of a bundle, returns the (offset, size) of every model and their names
+def read_bundle_table(data):
+	end = len(data);
+	if (end < BUNDLE_HEADER.size) or not is_bundle(data):
+		raise SVPError("Not an SVP bundle.");
+	magic, version, reserved, count = BUNDLE_HEADER.unpack_from(data, 0);
+	if version != BUNDLE_VERSION:
+		raise SVPError("Unsupported SVP bundle version %d." % version);
+	pos = BUNDLE_HEADER.size + (BUNDLE_ENTRY.size * count);
+	if pos > end:
+		raise SVPError("SVP bundle table is out of bounds.");
+
+	# Offsets and sizes
+	entries = [BUNDLE_ENTRY.unpack_from(data, BUNDLE_HEADER.size + (i * BUNDLE_ENTRY.size)) for i in range(count)];
+	for i, (offset, size) in enumerate(entries):
+		if offset + size > end:
+			raise SVPError("Model %d at 0x%X is out of bounds." % (i, offset));
+
+	# Names
+	names = [];
+	for i in range(count):
+		if pos >= end:
+			raise SVPError("Name of model %d is out of bounds." % i);
+		length = data[pos];
+		names.append(bytes(data[pos+1:pos+1+length]).decode("ascii", "replace"));
+		pos += 1 + length;
+	return entries, names;
+
+# Memory-mapped bundle
+class SVPBundle:
+	def __init__(self, path):
+		self.path = path;
+		self.data = map_file(path);
+		try:
+			self.entries, self.names = read_bundle_table(self.data);
+		except SVPError:
+			self.data.close();
+			raise;
+
+	def __enter__(self):
+		return self;
+
+	def __exit__(self, *args):
+		self.close();
+
+	def __len__(self):
+		return len(self.entries);
+
+	# Unmap the bundle
+	def close(self):
+		self.data.close();
+
+	# Decode a model, straight from the mapped file
+	def model(self, index):
+		offset, size = self.entries[index];
+		model = parse_svp(self.data, offset);
+		if model.byte_size != size:
+			raise SVPError("Model %d is %d bytes, but its table entry says %d." % (index, model.byte_size, size));
+		return model;
+
+	# Decode models, every one if no indices are given, yields each index and its model
+	def models(self, indices=None):
+		for index in (range(len(self.entries)) if indices is None else indices):
+			yield index, self.model(index);
+
+# Command line entry point
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog="python -m svplib.bundle", description="List, pack and extract SVP model bundles.");
+	parser.add_argument("bundle", help="Bundle file");
+	parser.add_argument("--pack", nargs="+", metavar="MODEL", help="Write the bundle from SVP model files, named after the files");
+	parser.add_argument("--extract", metavar="FOLDER", help="Write the models of the bundle into a folder");
+	parser.add_argument("--only", nargs="+", type=int, metavar="N", help="Only list or extract these models");
+	args = parser.parse_args(argv);
+
+	# Pack
+	if args.pack:
+		models = [read_svp(path) for path in args.pack];
+		write_bundle(args.bundle, models, [os.path.splitext(os.path.basename(path))[0] for path in args.pack]);
+
+	# List and extract
+	with SVPBundle(args.bundle) as bundle:
+		indices = args.only if args.only is not None else range(len(bundle));
+		for index in indices:
+			if not (0 <= index < len(bundle)):
+				print("The bundle has no model %d, it has %d models." % (index, len(bundle)), file=sys.stderr);
+				return 1;
+		for index in indices:
+			offset, size = bundle.entries[index];
+			name = bundle.names[index] or "%d" % index;
+			print("%d: %s, 0x%X, %d bytes" % (index, name, offset, size));
+			if args.extract:
+				os.makedirs(args.extract, exist_ok=True);
+				with open(os.path.join(args.extract, name.replace("/", "_").replace("\\", "_") + ".svp"), "wb") as file:
+					file.write(bundle.data[offset:offset + size]);
+		print("%d of %d models" % (len(indices), len(bundle)));
+	return 0;
+
+if __name__ == "__main__":
+	sys.exit(main());
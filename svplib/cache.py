@@ -0,0 +1,166 @@
+'''
+	Content-addressed on-disk cache of decoded SVP models
+	See LICENSE for copyright and license details.
+
+	Models are stored under the SHA-1 of their file bytes, in a raw format that is mapped
+	straight into the arrays of the model. The least recently used entries are evicted
+	once the cache grows past its size limit.
+
+	Entry layout, little endian:
+	  magic (4 bytes), version, vertex count, loop count, face count (u32 each), padding to 32 bytes
+	  coords (int16, N x 3), face vertices (int32), face sizes, palette, dither, cull, flags (uint8),
+	  every array starting on an 8 byte boundary
+'''
+
+# Imports
+import os, struct, tempfile;
+import numpy as np;
+from .model import (SVPModel, parse_svp);
+from .rom import (map_file, hash_range);
+
+# Entry header
+CACHE_MAGIC = b"SVPC";
+CACHE_VERSION = 1;
+CACHE_HEADER = struct.Struct("<4sIIII");
+CACHE_HEADER_SIZE = 32;
+CACHE_EXTENSION = ".svpc";
+
+# Default size limit
+DEFAULT_MAX_BYTES = 256 << 20;
+
+# Arrays of an entry, their type, and which count their length is based on
+CACHE_ARRAYS = (
+	("coords", "<i2", "vertex"),
+	("face_vertices", "<i4", "loop"),
+	("face_sizes", "u1", "face"),
+	("palette", "u1", "face"),
+	("dither", "u1", "face"),
+	("cull", "u1", "face"),
+	("flags", "u1", "face"),
+);
+
+# Get the default cache folder
+def default_cache_folder():
+	base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache");
+	return os.path.join(base, "svplib");
+
+# Get the byte offset and shape of every array in an entry
+def entry_layout(vertex_count, loop_count, face_count):
+	counts = {"vertex": vertex_count, "loop": loop_count, "face": face_count};
+	layout = [];
+	offset = CACHE_HEADER_SIZE;
+	for name, dtype, count in CACHE_ARRAYS:
+		shape = (counts[count], 3) if name == "coords" else (counts[count],);
+		layout.append((name, np.dtype(dtype), shape, offset));
+		offset += (int(np.prod(shape)) * np.dtype(dtype).itemsize + 7) & ~7;
+	return layout, offset;
+
+# Cache of decoded models in a folder, limited to a number of bytes
+class ModelCache:
+	def __init__(self, folder=None, max_bytes=DEFAULT_MAX_BYTES):
+		self.folder = folder or default_cache_folder();
+		self.max_bytes = max_bytes;
+		os.makedirs(self.folder, exist_ok=True);
+
+	# Get the path of an entry
+	def entry_path(self, key):
+		return os.path.join(self.folder, key + CACHE_EXTENSION);
+
+	# Get a cached model, mapped read only from disk, or None if it is not cached
+	def get(self, key):
+		path = self.entry_path(key);
+		try:
+			data = map_file(path);
+		except (OSError, ValueError):
+			return None;
+		try:
+			os.utime(path);
+		except OSError:
+			data.close();
+			return None;
+
+		# Check header, rejected entries are unmapped right away
+		if len(data) < CACHE_HEADER_SIZE:
+			data.close();
+			return None;
+		magic, version, vertex_count, loop_count, face_count = CACHE_HEADER.unpack_from(data, 0);
+		layout, size = entry_layout(vertex_count, loop_count, face_count);
+		if (magic != CACHE_MAGIC) or (version != CACHE_VERSION) or (len(data) < size):
+			data.close();
+			return None;
+
+		# The arrays keep the mapping open for as long as the model lives
+		arrays = {name: np.frombuffer(data, dtype, int(np.prod(shape)), offset).reshape(shape)
+			for name, dtype, shape, offset in layout};
+		return SVPModel(**arrays);
+
+	# Store a model
+	def put(self, key, model):
+		arrays = {
+			"coords": model.coords,
+			"face_vertices": model.face_vertices,
+			"face_sizes": model.face_sizes,
+			"palette": model.palette,
+			"dither": model.dither,
+			"cull": model.cull,
+			"flags": model.flags,
+		};
+		layout, size = entry_layout(len(model.coords), model.loop_count, model.face_count);
+		out = bytearray(size);
+		CACHE_HEADER.pack_into(out, 0, CACHE_MAGIC, CACHE_VERSION, len(model.coords), model.loop_count, model.face_count);
+		for name, dtype, shape, offset in layout:
+			np.frombuffer(out, dtype, int(np.prod(shape)), offset).reshape(shape)[...] = arrays[name];
+
+		# Write to a temporary file first, so other processes never see half an entry
+		handle, temp_path = tempfile.mkstemp(CACHE_EXTENSION + ".tmp", dir=self.folder);
+		try:
+			with os.fdopen(handle, "wb") as file:
+				file.write(out);
+			os.replace(temp_path, self.entry_path(key));
+		except OSError:
+			if os.path.exists(temp_path):
+				os.remove(temp_path);
+			raise;
+		self.evict();
+
+	# Remove the least recently used entries until the cache fits its size limit
+	def evict(self):
+		entries = [];
+		for entry in os.scandir(self.folder):
+			if entry.name.endswith(CACHE_EXTENSION):
+				try:
+					stat = entry.stat();
+				except OSError:
+					continue;
+				entries.append((stat.st_mtime, stat.st_size, entry.path));
+		total = sum(size for mtime, size, path in entries);
+		for mtime, size, path in sorted(entries):
+			if total <= self.max_bytes:
+				break;
+			try:
+				os.remove(path);
+			except OSError:
+				pass;
+			total -= size;
+
+	# Remove every entry
+	def clear(self):
+		for entry in os.scandir(self.folder):
+			if entry.name.endswith(CACHE_EXTENSION):
+				try:
+					os.remove(entry.path);
+				except OSError:
+					pass;
+
+	# Read a model file through the cache, decoding and storing it if it is not cached yet
+	def read_svp(self, path):
+		with map_file(path) as data:
+			key = hash_range(data, 0, len(data));
+			model = self.get(key);
+			if model is None:
+				model = parse_svp(data);
+				try:
+					self.put(key, model);
+				except OSError:
+					pass;
+		return model;
@@ -0,0 +1,120 @@
+'''
+	Headless batch converter for SVP models
+	See LICENSE for copyright and license details.
+
+	Usage: python -m svplib.convert SOURCE DEST [--to FORMAT] [--jobs N] [--cache [FOLDER]]
+
+	SOURCE can be a model file or a directory, which is converted recursively into DEST with
+	the same layout. Models can be converted from and to SVP, OBJ, PLY and glTF.
+'''
+
+# Imports
+import argparse, os, struct, sys, time;
+from concurrent.futures import (ProcessPoolExecutor, as_completed);
+from .model import SVPError;
+from .formats import (FORMATS, read_model, write_model);
+from .cache import (ModelCache, DEFAULT_MAX_BYTES);
+
+# Default target format of each source format
+DEFAULT_TARGETS = {
+	".svp": ".obj",
+	".obj": ".svp",
+	".ply": ".svp",
+	".gltf": ".svp",
+	".glb": ".svp",
+};
+
+# Find the files to convert, returns (source, destination) pairs
+def find_jobs(source, dest, target=None):
+	# Single file
+	if not os.path.isdir(source):
+		extension = os.path.splitext(source)[1].lower();
+		target = target or DEFAULT_TARGETS.get(extension, ".svp");
+		if os.path.isdir(dest) or dest.endswith(os.sep):
+			dest = os.path.join(dest, os.path.splitext(os.path.basename(source))[0] + target);
+		return [(source, dest)];
+
+	# Directory tree, mirrored into the destination
+	jobs = [];
+	for root, dirs, files in os.walk(source):
+		dirs.sort();
+		for name in sorted(files):
+			base, extension = os.path.splitext(name);
+			extension = extension.lower();
+			if extension not in FORMATS:
+				continue;
+			file_target = target or DEFAULT_TARGETS[extension];
+			if extension == file_target:
+				continue;
+			jobs.append((os.path.join(root, name), os.path.join(dest, os.path.relpath(root, source), base + file_target)));
+	return jobs;
+
+# Convert a single file, returns (source, destination, faces, bytes, seconds, error)
+#   cache - (folder, size limit) of the model cache SVP files are read through, if any
+def convert_file(job, cache=None):
+	source, dest = job;
+	start = time.perf_counter();
+	try:
+		if (cache is not None) and source.lower().endswith(".svp"):
+			model = ModelCache(*cache).read_svp(source);
+		else:
+			model = read_model(source);
+		dest_dir = os.path.dirname(dest);
+		if dest_dir:
+			os.makedirs(dest_dir, exist_ok=True);
+		write_model(dest, model);
+		return source, dest, model.face_count, os.path.getsize(dest), time.perf_counter() - start, None;
+	except (SVPError, OSError, ValueError, KeyError, IndexError, struct.error) as e:
+		return source, dest, 0, 0, time.perf_counter() - start, str(e);
+
+# Convert files, across worker processes if jobs is more than 1, yields the result of each file as it finishes
+def convert_files(jobs, workers=1, cache=None):
+	if (workers <= 1) or (len(jobs) <= 1):
+		for job in jobs:
+			yield convert_file(job, cache);
+		return;
+	with ProcessPoolExecutor(min(workers, len(jobs))) as pool:
+		for future in as_completed([pool.submit(convert_file, job, cache) for job in jobs]):
+			yield future.result();
+
+# Command line entry point
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog="python -m svplib.convert", description="Convert SVP models from and to OBJ, PLY and glTF.");
+	parser.add_argument("source", help="Model file or directory to convert");
+	parser.add_argument("dest", help="Destination file or directory");
+	parser.add_argument("--to", choices=sorted(extension[1:] for extension in FORMATS), help="Target format (default: obj for SVP files, svp for anything else)");
+	parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="Number of worker processes (default: CPU count)");
+	parser.add_argument("--cache", nargs="?", const="", metavar="FOLDER", help="Read SVP files through the decoded model cache (default folder: the user cache folder)");
+	parser.add_argument("--cache-size", type=int, default=DEFAULT_MAX_BYTES >> 20, help="Size limit of the model cache in MB (default: %d)" % (DEFAULT_MAX_BYTES >> 20));
+	parser.add_argument("-q", "--quiet", action="store_true", help="Only report failures and totals");
+	args = parser.parse_args(argv);
+
+	jobs = find_jobs(args.source, args.dest, ("." + args.to) if args.to else None);
+	if len(jobs) == 0:
+		print("No models found in %s" % args.source, file=sys.stderr);
+		return 1;
+
+	# Convert and report every file
+	start = time.perf_counter();
+	total_faces = 0;
+	total_bytes = 0;
+	failures = 0;
+	cache = None if args.cache is None else (args.cache or None, args.cache_size << 20);
+	for source, dest, faces, size, seconds, error in convert_files(jobs, args.jobs, cache):
+		if error is not None:
+			failures += 1;
+			print("%s: %s" % (source, error), file=sys.stderr);
+			continue;
+		total_faces += faces;
+		total_bytes += size;
+		if not args.quiet:
+			print("%s -> %s: %d faces, %d bytes, %.1f ms (%.0f faces/s)" % (source, dest, faces, size, seconds * 1000.0, faces / max(seconds, 1e-9)));
+
+	# Totals
+	seconds = time.perf_counter() - start;
+	print("Converted %d of %d files: %d faces, %d bytes in %.2f s (%.1f files/s, %.0f faces/s)" % (
+		len(jobs) - failures, len(jobs), total_faces, total_bytes, seconds, len(jobs) / max(seconds, 1e-9), total_faces / max(seconds, 1e-9)));
+	return 1 if failures else 0;
+
+if __name__ == "__main__":
+	sys.exit(main());
@@ -0,0 +1,55 @@
+'''
+	Sega Virtua Processor backface culling
+	See LICENSE for copyright and license details.
+
+	Faces with the culling bit are dropped when they face away from the viewer, before they are
+	uploaded or rasterized. Triangle planes are computed once, so a view only costs a dot product
+	per culled triangle.
+'''
+
+# Imports
+import numpy as np;
+
+# Get the plane of every triangle, front faces are counter-clockwise
+#   positions - (T, 3, 3) corner positions
+#   Returns the (T, 3) normals and the plane offset of every triangle
+def triangle_planes(positions):
+	positions = np.asarray(positions, np.float64).reshape(-1, 3, 3);
+	normals = np.cross(positions[:, 1] - positions[:, 0], positions[:, 2] - positions[:, 0]);
+	return normals, np.einsum("ij,ij->i", normals, positions[:, 0]);
+
+# Get the eye of a view in the space of an object
+#   view_matrix  - World to view matrix, or a stack of them
+#   world_matrix - Object to world matrix, or a stack of them
+#   Returns the homogeneous eye position, or the direction towards the viewer with w = 0 for orthographic views.
+#   Mirroring matrices flip the winding on screen, so their eye is negated to flip the test.
+def view_eye(view_matrix, world_matrix, perspective=True):
+	matrix = np.asarray(view_matrix, np.float64) @ np.asarray(world_matrix, np.float64);
+	inverse = np.linalg.inv(matrix);
+	eye = inverse[..., :, 3] if perspective else inverse[..., :, 2];
+	return eye * np.sign(np.linalg.det(matrix[..., :3, :3]))[..., None];
+
+# Find the triangles that face the eye
+def facing_front(normals, offsets, eye):
+	eye = np.asarray(eye, np.float64);
+	return ((normals @ eye[:3]) - (offsets * eye[3])) > 0.0;
+
+# Backface culling of a set of triangles, the planes of the culled triangles are computed once
+#   positions - (T, 3, 3) corner positions
+#   cull      - Culling bit of every triangle
+class FaceCuller:
+	def __init__(self, positions, cull):
+		self.cull = np.asarray(cull) != 0;
+		self.culled = np.nonzero(self.cull)[0];
+		self.normals, self.offsets = triangle_planes(np.asarray(positions).reshape(-1, 3, 3)[self.culled]);
+
+	# Whether any triangle can be culled
+	@property
+	def active(self):
+		return len(self.culled) > 0;
+
+	# Get which triangles to draw for an eye from view_eye()
+	def keep(self, eye):
+		keep = ~self.cull;
+		keep[self.culled] = facing_front(self.normals, self.offsets, eye);
+		return keep;
@@ -0,0 +1,404 @@
+'''
+	Face budget decimation for SVP models
+	See LICENSE for copyright and license details.
+
+	Usage: python -m svplib.decimate MODEL BUNDLE --target N [--levels N]
+
+	Models are brought down to a face count with a priority queue of half-edge collapses,
+	ordered by quadric error. Vertices only ever move onto other vertices, so coordinates stay
+	exactly on the 8.8 fixed point grid. Faces with different palette, dither, cull or flag IDs
+	are never merged, vertices on the borders between them can only slide along the border, and
+	vertices where borders meet never move. Flat pairs of triangles with the same IDs are merged
+	into quads, before collapsing and after it.
+'''
+
+# Imports
+import argparse, heapq, operator, os, sys;
+import numpy as np;
+from .model import (SVPModel, read_svp, weld_vertices);
+from .validate import (PLANAR_TOLERANCE, quad_distances);
+from .bundle import write_bundle;
+
+# Weight of the planes along borders against the planes of faces, sliding border vertices costs more than moving others
+BORDER_WEIGHT = 100.0;
+
+# Most neighbours a collapse can leave a vertex with, unless it had more already
+MAX_VALENCE = 12;
+
+# Get the attribute key of every face, faces with the same key can be merged
+def face_keys(model):
+	return model.palette.astype(np.int64) | (model.dither.astype(np.int64) << 8) | \
+		(model.cull.astype(np.int64) << 16) | (model.flags.astype(np.int64) << 24);
+
+# Split every face of a model into triangles, quads along their 0-2 diagonal
+#   Returns the (T, 3) vertex indices, attribute key and source face of every triangle
+def model_triangles(model):
+	face_sizes = model.face_sizes.astype(np.int64);
+	starts = model.face_starts();
+	counts = np.where(face_sizes == 4, 2, 1);
+	sources = np.repeat(np.arange(model.face_count), counts);
+	halves = np.arange(len(sources)) - np.repeat(np.cumsum(counts) - counts, counts);
+	corners = starts[sources][:, None] + np.array([[0, 1, 2], [2, 3, 0]])[halves];
+	return model.face_vertices[corners].astype(np.int64), face_keys(model)[sources], sources;
+
+# Build a model from welded coordinates and faces
+#   faces - List of vertex index lists, keys and order are per face
+def build_model(coords, faces, keys, order):
+	order = np.argsort(order, kind="stable");
+	faces = [faces[i] for i in order];
+	keys = np.asarray(keys, np.int64)[order];
+	face_sizes = np.array([len(face) for face in faces], np.uint8);
+	face_vertices = np.array([vertex for face in faces for vertex in face], np.int64).reshape(-1);
+
+	# Drop vertices that are no longer used
+	used, face_vertices = np.unique(face_vertices, return_inverse=True);
+	return SVPModel(coords[used].astype(np.int16), face_vertices.astype(np.int32).reshape(-1), face_sizes,
+		(keys & 0xFF).astype(np.uint8), ((keys >> 8) & 0xFF).astype(np.uint8), ((keys >> 16) & 0xFF).astype(np.uint8),
+		((keys >> 24) & 0xFF).astype(np.uint8));
+
+# Find the pairs of triangles sharing an edge, in both directions
+#   Returns the two triangles, the shared edge (a, b) as it runs in the first one, and the
+#   corner of each triangle off the edge. Edges with more than two triangles are left out.
+def triangle_pairs(tris):
+	vertex_count = int(tris.max()) + 1 if len(tris) else 1;
+	slots = np.arange(3);
+	a = tris[:, slots].reshape(-1);
+	b = tris[:, (slots + 1) % 3].reshape(-1);
+	c = tris[:, (slots + 2) % 3].reshape(-1);
+	owners = np.repeat(np.arange(len(tris)), 3);
+
+	# Match every directed edge with the one running the other way
+	forward = (a * vertex_count) + b;
+	backward = (b * vertex_count) + a;
+	order = np.argsort(forward, kind="stable");
+	found = np.searchsorted(forward[order], backward);
+	found = np.minimum(found, len(order) - 1);
+	matched = forward[order][found] == backward;
+	unique = np.ones(len(forward), bool);
+	if len(forward) > 1:
+		sorted_keys = forward[order];
+		repeated = np.zeros(len(forward), bool);
+		repeated[1:] |= sorted_keys[1:] == sorted_keys[:-1];
+		repeated[:-1] |= sorted_keys[1:] == sorted_keys[:-1];
+		unique[order] = ~repeated;
+	other = order[found];
+	keep = matched & unique & unique[other] & (owners != owners[other]);
+	first = np.nonzero(keep)[0];
+	second = other[first];
+	return owners[first], owners[second], a[first], b[first], c[first], c[second];
+
+# Merge pairs of flat triangles with the same attributes into convex quads, flattest pairs first
+#   Returns the faces as vertex index lists, their keys and sources
+def merge_quads(coords, tris, keys, sources, planar_tolerance=PLANAR_TOLERANCE):
+	first, second, a, b, c, d = triangle_pairs(tris);
+	pick = (first < second) & (keys[first] == keys[second]);
+	first, second, a, b, c, d = first[pick], second[pick], a[pick], b[pick], c[pick], d[pick];
+
+	# The quad runs c, a, d, b, it has to be flat and convex
+	quads = np.stack([c, a, d, b], 1);
+	corners = coords[quads];
+	distances = quad_distances(corners.reshape(-1, 3), np.full(len(quads), 4));
+	normals = np.cross(corners[:, 2] - corners[:, 0], corners[:, 3] - corners[:, 1]);
+	edges = np.roll(corners, -1, 1) - corners;
+	turns = np.einsum("ijk,ik->ij", np.cross(edges, np.roll(edges, -1, 1)), normals);
+	good = np.nonzero((distances <= planar_tolerance) & np.all(turns > 0.0, 1))[0];
+	good = good[np.argsort(distances[good], kind="stable")];
+
+	# Take the flattest pairs whose triangles are both still free
+	used = [False] * len(tris);
+	faces = [];
+	picked = [];
+	for t1, t2, quad in zip(first[good].tolist(), second[good].tolist(), quads[good].tolist()):
+		if used[t1] or used[t2]:
+			continue;
+		used[t1] = used[t2] = True;
+		faces.append(quad);
+		picked.append(t1 if sources[t1] <= sources[t2] else t2);
+	single = np.nonzero(~np.array(used, bool))[0];
+	faces += tris[single].tolist();
+	picked = np.array(picked + single.tolist(), np.int64);
+	face_keys_out = keys[picked];
+	face_sources = sources[picked];
+	return faces, face_keys_out, face_sources;
+
+# Find the border edges of a triangle mesh, on open borders, between faces with different attributes, or with more than two faces
+#   Returns the (E, 2) vertex indices, triangle count, lowest and highest key of the faces, and a triangle of every border edge
+def border_edges(tris, keys, vertex_count):
+	edges = np.sort(np.stack([tris, np.roll(tris, -1, 1)], 2).reshape(-1, 2), 1);
+	edge_keys = np.repeat(keys, 3);
+	ids, first, inverse, counts = np.unique((edges[:, 0] * vertex_count) + edges[:, 1], return_index=True, return_inverse=True, return_counts=True);
+	inverse = inverse.reshape(-1);
+	low = np.full(len(ids), np.iinfo(np.int64).max);
+	high = np.full(len(ids), np.iinfo(np.int64).min);
+	np.minimum.at(low, inverse, edge_keys);
+	np.maximum.at(high, inverse, edge_keys);
+	border = (counts != 2) | (low != high);
+	return edges[first[border]], counts[border], low[border], high[border], first[border] // 3;
+
+# Get the quadric of every vertex of a triangle mesh, from the planes of its triangles weighted
+# by area, and planes standing on its border edges weighted by border_weight
+#   Returns the (V, 10) upper triangle of every 4x4 quadric
+def vertex_quadrics(coords, tris, edges, edge_tris, border_weight=BORDER_WEIGHT):
+	corners = coords[tris];
+	normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0]);
+	areas = np.sqrt(np.einsum("ij,ij->i", normals, normals));
+	unit = normals / np.where(areas > 0.0, areas, 1.0)[:, None];
+	planes = np.concatenate([unit, -np.einsum("ij,ij->i", unit, corners[:, 0])[:, None]], 1);
+	rows, columns = np.triu_indices(4);
+	quadrics = np.zeros((len(coords), 10));
+	weighted = areas[:, None] * planes[:, rows] * planes[:, columns];
+	for i in range(3):
+		np.add.at(quadrics, tris[:, i], weighted);
+
+	# Planes along the border edges, square to their triangle
+	directions = coords[edges[:, 1]] - coords[edges[:, 0]];
+	lengths = np.einsum("ij,ij->i", directions, directions);
+	sides = np.cross(directions, unit[edge_tris]);
+	side_lengths = np.sqrt(np.einsum("ij,ij->i", sides, sides));
+	sides /= np.where(side_lengths > 0.0, side_lengths, 1.0)[:, None];
+	planes = np.concatenate([sides, -np.einsum("ij,ij->i", sides, coords[edges[:, 0]])[:, None]], 1);
+	weighted = (border_weight * lengths)[:, None] * planes[:, rows] * planes[:, columns];
+	for i in range(2):
+		np.add.at(quadrics, edges[:, i], weighted);
+	return quadrics;
+
+# Edge collapses of a triangle mesh, cheapest quadric error first
+#   Every collapse moves a vertex onto a neighbour. Vertices on a border can only slide along it
+#   onto the next border vertex, and vertices where borders meet never move. Collapses that would
+#   flip a triangle over or pinch the mesh are skipped. Collapsing can stop at a triangle count
+#   and pick up again from there.
+class EdgeCollapse:
+	def __init__(self, coords, tris, keys):
+		vertex_count = len(coords);
+		self.points = coords.tolist();
+		self.tris = tris.tolist();
+		self.alive = [True] * len(self.tris);
+		self.count = len(self.tris);
+		self.versions = [0] * vertex_count;
+
+		# Triangles around every vertex
+		self.vertex_tris = [set() for i in range(vertex_count)];
+		for t, tri in enumerate(self.tris):
+			for vertex in tri:
+				self.vertex_tris[vertex].add(t);
+
+		# Border neighbours of every border vertex, vertices on more than one border cannot move
+		self.locked = [False] * vertex_count;
+		self.links = {};
+		edges, counts, low, high, edge_tris = border_edges(tris, keys, vertex_count);
+		for (a, b), count, low_key, high_key in zip(edges.tolist(), counts.tolist(), low.tolist(), high.tolist()):
+			border = (low_key, high_key, min(count, 3));
+			self.links.setdefault(a, {})[b] = border;
+			self.links.setdefault(b, {})[a] = border;
+			if count > 2:
+				self.locked[a] = self.locked[b] = True;
+		for vertex, linked in self.links.items():
+			if (len(linked) != 2) or (len(set(linked.values())) != 1):
+				self.locked[vertex] = True;
+
+		# Quadrics, and the terms they are multiplied with at every vertex
+		x, y, z = coords[:, 0], coords[:, 1], coords[:, 2];
+		terms = np.stack([x * x, 2.0 * x * y, 2.0 * x * z, 2.0 * x, y * y, 2.0 * y * z, 2.0 * y, z * z, 2.0 * z, np.ones_like(x)], 1);
+		self.quadrics = vertex_quadrics(coords, tris, edges, edge_tris).tolist();
+		self.terms = terms.tolist();
+
+		self.heap = [];
+		self.requeue();
+
+	# Queue every collapse of every vertex that can move again, from scratch
+	def requeue(self):
+		vertex_count = len(self.points);
+		tris = np.array([tri for tri, alive in zip(self.tris, self.alive) if alive], np.int64).reshape(-1, 3);
+		ends = np.roll(tris, -1, 1);
+		directed = np.concatenate([tris.reshape(-1), ends.reshape(-1)]), np.concatenate([ends.reshape(-1), tris.reshape(-1)]);
+		directed = np.unique((directed[0] * vertex_count) + directed[1]);
+		u, v = directed // vertex_count, directed % vertex_count;
+		movable = ~np.array(self.locked, bool)[u];
+		u, v = u[movable], v[movable];
+		quadrics = np.array(self.quadrics).reshape(-1, 10);
+		costs = np.einsum("ij,ij->i", quadrics[u] + quadrics[v], np.array(self.terms).reshape(-1, 10)[v]);
+		versions = np.array(self.versions, np.int64);
+		self.heap = list(zip(costs.tolist(), u.tolist(), v.tolist(), versions[u].tolist(), versions[v].tolist()));
+		heapq.heapify(self.heap);
+
+	# Error of moving u onto v
+	def cost(self, u, v):
+		terms = self.terms[v];
+		return sum(map(operator.mul, self.quadrics[u], terms)) + sum(map(operator.mul, self.quadrics[v], terms));
+
+	# Vertices sharing a triangle with a vertex
+	def neighbours(self, u):
+		found = set();
+		for t in self.vertex_tris[u]:
+			found.update(self.tris[t]);
+		found.discard(u);
+		return found;
+
+	# Normal of a triangle
+	def normal(self, tri):
+		a, b, c = self.points[tri[0]], self.points[tri[1]], self.points[tri[2]];
+		e1 = (b[0] - a[0], b[1] - a[1], b[2] - a[2]);
+		e2 = (c[0] - a[0], c[1] - a[1], c[2] - a[2]);
+		return ((e1[1] * e2[2]) - (e1[2] * e2[1]), (e1[2] * e2[0]) - (e1[0] * e2[2]), (e1[0] * e2[1]) - (e1[1] * e2[0]));
+
+	# Check if a collapse can be done, returns the triangles it removes and moves, and the
+	# vertices that become neighbours of v, or None
+	def check(self, u, v):
+		vertex_tris = self.vertex_tris;
+		shared = vertex_tris[u] & vertex_tris[v];
+		if len(shared) == 0:
+			return None;
+
+		# The vertices around both ends can only be the corners of the shared triangles
+		around_u = self.neighbours(u);
+		around_v = self.neighbours(v);
+		if len(around_u & around_v) != len(shared):
+			return None;
+
+		# Flat areas collapse for free, so keep them from piling up into fans of thin triangles
+		added = around_u - around_v;
+		added.discard(v);
+		if (len(added) > 0) and (len(around_v) + len(added) - 1 > MAX_VALENCE):
+			return None;
+
+		# Border vertices slide onto a border neighbour, without closing up the border
+		linked = self.links.get(u);
+		if linked is not None:
+			if v not in linked:
+				return None;
+			for w in linked:
+				if (w != v) and (w in around_v):
+					return None;
+
+		# No moved triangle can flip over or collapse
+		moved = vertex_tris[u] - shared;
+		for t in moved:
+			before = self.normal(self.tris[t]);
+			after = self.normal([v if vertex == u else vertex for vertex in self.tris[t]]);
+			if sum(map(operator.mul, before, after)) <= 0.0:
+				return None;
+		return shared, moved, added;
+
+	# Collapse until at most target triangles are left, or nothing more can be collapsed
+	def collapse(self, target):
+		heap = self.heap;
+		versions = self.versions;
+		vertex_tris = self.vertex_tris;
+		while heap and (self.count > target):
+			cost, u, v, version_u, version_v = heapq.heappop(heap);
+			if versions[u] != version_u:
+				continue;
+
+			# Costs only grow as vertices take on quadrics, so an old cost is a lower bound,
+			# and the collapse is queued again at its cost now that v changed
+			if versions[v] != version_v:
+				if versions[v] >= 0:
+					heapq.heappush(heap, (self.cost(u, v), u, v, version_u, versions[v]));
+				continue;
+			found = self.check(u, v);
+			if found is None:
+				continue;
+			shared, moved, added = found;
+
+			# Collapse
+			for t in shared:
+				self.alive[t] = False;
+				for vertex in self.tris[t]:
+					vertex_tris[vertex].discard(t);
+			self.count -= len(shared);
+			for t in moved:
+				self.tris[t] = [v if vertex == u else vertex for vertex in self.tris[t]];
+				vertex_tris[v].add(t);
+			vertex_tris[u] = set();
+			self.quadrics[v] = list(map(operator.add, self.quadrics[u], self.quadrics[v]));
+			versions[u] = -1;
+			versions[v] += 1;
+
+			# Border neighbours of a slid vertex move over to the vertex it slid onto
+			linked = self.links.pop(u, None);
+			if linked is not None:
+				w = [vertex for vertex in linked if vertex != v][0];
+				del self.links[v][u];
+				del self.links[w][u];
+				self.links[v][w] = self.links[w][v] = linked[v];
+
+			# Queue the collapses of the moved vertex again, and of the vertices that just became
+			# its neighbours onto it. Collapses of the others onto it are costed again when popped.
+			locked = self.locked;
+			if not locked[v]:
+				for w in self.neighbours(v):
+					heapq.heappush(heap, (self.cost(v, w), v, w, versions[v], versions[w]));
+			for w in added:
+				if not locked[w]:
+					heapq.heappush(heap, (self.cost(w, v), w, v, versions[w], versions[v]));
+
+	# Get the triangles that are left, and the index each one had
+	def triangles(self):
+		left = np.nonzero(self.alive)[0];
+		return np.array([self.tris[t] for t in left], np.int64).reshape(-1, 3), left;
+
+# Decimate a model down to at most target faces, returns a new model
+#   Models already within budget only get their flat triangle pairs merged into quads
+def decimate(model, target, planar_tolerance=PLANAR_TOLERANCE):
+	target = max(int(target), 1);
+	welded = weld_vertices(model);
+	coords = welded.coords.astype(np.float64) / 256.0;
+	tris, keys, sources = model_triangles(welded);
+
+	# Merge triangles into quads first, that might be enough
+	faces, quad_keys, quad_sources = merge_quads(coords, tris, keys, sources, planar_tolerance);
+	if len(faces) <= min(target, model.face_count):
+		return build_model(welded.coords, faces, quad_keys, quad_sources);
+	if model.face_count <= target:
+		return model;
+
+	# Collapse triangles, aiming for the count that merges down to the target, at least
+	# one triangle for every face too many each round
+	collapser = EdgeCollapse(coords, tris, keys);
+	while len(faces) > target:
+		count = collapser.count;
+		ratio = len(faces) / max(count, 1);
+		collapser.collapse(min(int(target / ratio), count - (len(faces) - target)));
+
+		# Collapses turned down earlier might work now that their neighbours changed
+		if collapser.count == count:
+			collapser.requeue();
+			collapser.collapse(min(int(target / ratio), count - (len(faces) - target)));
+			if collapser.count == count:
+				break;
+		left_tris, left = collapser.triangles();
+		faces, quad_keys, quad_sources = merge_quads(coords, left_tris, keys[left], sources[left], planar_tolerance);
+	return build_model(welded.coords, faces, quad_keys, quad_sources);
+
+# Build a set of detail levels, each one decimated from the one before it
+#   targets - Face budget of every level after the model itself
+#   Returns the model followed by every level
+def build_lods(model, targets):
+	lods = [model];
+	for target in targets:
+		lods.append(decimate(lods[-1], target));
+	return lods;
+
+# Get the face budgets of a number of levels, spaced geometrically down to the smallest one
+def lod_targets(face_count, smallest, levels):
+	return [int(round(target)) for target in np.geomspace(face_count, smallest, levels + 1)[1:]];
+
+# Command line entry point
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog="python -m svplib.decimate", description="Write detail levels of an SVP model into a bundle.");
+	parser.add_argument("model", help="SVP model to decimate");
+	parser.add_argument("bundle", help="Bundle to write the model and its levels into");
+	parser.add_argument("--target", type=int, required=True, help="Face budget of the smallest level");
+	parser.add_argument("--levels", type=int, default=1, help="Number of levels after the model itself (default: 1)");
+	args = parser.parse_args(argv);
+
+	model = read_svp(args.model);
+	lods = build_lods(model, lod_targets(model.face_count, args.target, args.levels));
+	name = os.path.splitext(os.path.basename(args.model))[0];
+	write_bundle(args.bundle, lods, ["%s_lod%d" % (name, i) for i in range(len(lods))]);
+	for i, lod in enumerate(lods):
+		print("LOD %d: %d faces" % (i, lod.face_count));
+	return 0;
+
+if __name__ == "__main__":
+	sys.exit(main());
@@ -0,0 +1,126 @@
+'''
+	Concurrent and incremental writing of SVP model files
+	See LICENSE for copyright and license details.
+
+	Encoding is NumPy work and writing is file I/O, both of which let go of the GIL, so files
+	are written on a pool of threads while the caller keeps building the next models.
+	Repeated exports of the same file can keep the encoded models, and only encode and
+	write the ones that changed.
+'''
+
+# Imports
+import os, time;
+from concurrent.futures import ThreadPoolExecutor;
+from .model import encode_svp;
+
+# Encode models one after another into one buffer
+def encode_models(models):
+	out = bytearray(sum(model.byte_size for model in models));
+	offset = 0;
+	for model in models:
+		encode_svp(model, out, offset);
+		offset += model.byte_size;
+	return out;
+
+# Encode models into a file, returns (path, faces, bytes, seconds, error)
+def write_models(path, models):
+	start = time.perf_counter();
+	try:
+		data = encode_models(models);
+		folder = os.path.dirname(path);
+		if folder:
+			os.makedirs(folder, exist_ok=True);
+		with open(path, "wb") as file:
+			file.write(data);
+		return path, sum(model.face_count for model in models), len(data), time.perf_counter() - start, None;
+	except OSError as e:
+		return path, 0, 0, time.perf_counter() - start, str(e);
+
+# Pool of threads writing model files
+#   Results are returned in the order the files were submitted
+class ModelWriter:
+	def __init__(self, workers=None):
+		self.pool = ThreadPoolExecutor(max(1, workers or os.cpu_count() or 1));
+		self.futures = [];
+
+	# Queue a file
+	def submit(self, path, models):
+		self.futures.append(self.pool.submit(write_models, path, list(models)));
+
+	# Wait for every queued file, returns the result of each one
+	def results(self):
+		results = [future.result() for future in self.futures];
+		self.futures = [];
+		return results;
+
+	# Stop the threads, after the queued files are written
+	def close(self):
+		self.pool.shutdown(wait=True);
+
+	def __enter__(self):
+		return self;
+
+	def __exit__(self, *args):
+		self.close();
+
+# Encoded chunks of an output file, kept between exports so that only changed ones are encoded and written
+#   Chunks are kept by key, and a key can have more than one. When the file on disk is still the
+#   one last written, and no chunk moved or changed size, only the changed chunks are written over it.
+class IncrementalFile:
+	def __init__(self):
+		self.chunks = {};
+		self.written = None;
+
+	# Get the cached chunks of a key, or None
+	def get(self, key):
+		return self.chunks.get(key);
+
+	# Encode and keep the chunks of a key, one for each model
+	def encode(self, key, models):
+		chunks = self.chunks[key] = tuple(bytes(encode_svp(model)) for model in models);
+		return chunks;
+
+	# Forget every chunk not in a set of keys
+	def keep(self, keys):
+		for key in set(self.chunks) - set(keys):
+			del self.chunks[key];
+
+	# Forget everything
+	def clear(self):
+		self.chunks.clear();
+		self.written = None;
+
+	# Get what identifies a written file, so that changes made by others are noticed
+	def file_state(self, path, layout):
+		stat = os.stat(path);
+		return (os.path.abspath(path), layout, stat.st_size, stat.st_mtime_ns);
+
+	# Write chunks into a file, returns the number of bytes written
+	#   chunks  - (key, data) of every chunk in order
+	#   changed - Keys of the chunks that changed since the last write
+	def write(self, path, chunks, changed):
+		layout = tuple((key, len(data)) for key, data in chunks);
+		written = 0;
+		try:
+			in_place = (self.written == self.file_state(path, layout));
+		except OSError:
+			in_place = False;
+
+		# Write the changed chunks over the old ones, or the whole file
+		if in_place:
+			with open(path, "r+b") as file:
+				offset = 0;
+				for key, data in chunks:
+					if key in changed:
+						file.seek(offset);
+						file.write(data);
+						written += len(data);
+					offset += len(data);
+		else:
+			with open(path, "wb") as file:
+				for key, data in chunks:
+					file.write(data);
+					written += len(data);
+
+		self.written = self.file_state(path, layout);
+		return written;
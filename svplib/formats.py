@@ -0,0 +1,375 @@
+'''
+	Conversion between SVP models and common interchange formats
+	See LICENSE for copyright and license details.
+
+	Positions are written in SVP axis order (y up). Face colors and flags are kept:
+	  OBJ  - as "svp_<palette>_<flags>" material names
+	  PLY  - as svp_palette and svp_flags face properties
+	  glTF - as a _SVP_FACE vertex attribute holding the palette and flag bytes, the
+	         vertices of every face are stored together so triangles and quads survive
+'''
+
+# Imports
+import base64, json, os, re, struct;
+import numpy as np;
+from .model import (SVPError, SVPModel, FLAG_CULL, FLAG_DITHER, FLAG_SORT, FLAG_TRIANGLE, to_fixed_point, read_svp, write_svp);
+from .geometry import fan_triangles;
+from .validate import (FIXED_MIN, FIXED_MAX);
+
+# Default face header of faces without SVP data
+DEFAULT_PALETTE = 0x11;
+DEFAULT_FLAGS = 0;
+
+# Build a model from float positions in SVP axis order and face header bytes
+def model_from_faces(positions, face_vertices, face_sizes, palette, flag_bytes):
+	positions = np.asarray(positions, np.float64).reshape(-1, 3);
+	flag_bytes = np.asarray(flag_bytes, np.uint8);
+	face_sizes = np.asarray(face_sizes, np.uint8);
+	if np.any((face_sizes != 3) & (face_sizes != 4)):
+		raise SVPError("SVP models can only have faces with 3 or 4 vertices.");
+	fixed = np.trunc(positions * 256.0);
+	if np.any((fixed < FIXED_MIN) | (fixed > FIXED_MAX)):
+		raise SVPError("Coordinates outside of -128 to 127.996 would wrap around.");
+	return SVPModel(
+		to_fixed_point(positions),
+		np.asarray(face_vertices, np.int32),
+		face_sizes,
+		np.asarray(palette, np.uint8),
+		(flag_bytes & FLAG_DITHER) >> 5,
+		(flag_bytes & FLAG_CULL) >> 6,
+		flag_bytes & FLAG_SORT);
+
+# Float positions of a model in SVP axis order
+def model_positions(model):
+	return model.coords.astype(np.float64) / 256.0;
+
+# Write an OBJ file
+def write_obj(path, model):
+	lines = ["# SEGA Virtua Processor model, in SVP axis order"];
+	lines.extend("v %r %r %r" % tuple(v) for v in model_positions(model).tolist());
+
+	# Faces, grouped into materials by their header
+	headers = ((model.palette.astype(np.int32) << 8) | (model.flag_bytes() & (0xFF ^ FLAG_TRIANGLE))).tolist();
+	face_vertices = (model.face_vertices + 1).tolist();
+	cur_header = None;
+	cur_vert = 0;
+	for header, size in zip(headers, model.face_sizes.tolist()):
+		if header != cur_header:
+			lines.append("usemtl svp_%02X_%02X" % (header >> 8, header & 0xFF));
+			cur_header = header;
+		lines.append("f " + " ".join(map(str, face_vertices[cur_vert:cur_vert+size])));
+		cur_vert += size;
+
+	with open(path, "w") as file:
+		file.write("\n".join(lines) + "\n");
+
+# Read an OBJ file
+def read_obj(path):
+	positions = [];
+	face_vertices = [];
+	face_sizes = [];
+	palette = [];
+	flags = [];
+	cur_palette = DEFAULT_PALETTE;
+	cur_flags = DEFAULT_FLAGS;
+	material = re.compile(r"svp_([0-9A-Fa-f]{2})_([0-9A-Fa-f]{2})$");
+
+	with open(path, "r") as file:
+		for line in file:
+			parts = line.split();
+			if len(parts) == 0:
+				continue;
+			if parts[0] == "v":
+				positions.append(parts[1:4]);
+			elif parts[0] == "f":
+				verts = [int(part.split("/")[0]) for part in parts[1:]];
+				face_vertices.extend((vert - 1) if vert > 0 else (len(positions) + vert) for vert in verts);
+				face_sizes.append(len(verts));
+				palette.append(cur_palette);
+				flags.append(cur_flags);
+			elif parts[0] == "usemtl":
+				match = material.match(parts[1]) if len(parts) > 1 else None;
+				if match:
+					cur_palette = int(match.group(1), 16);
+					cur_flags = int(match.group(2), 16);
+				else:
+					cur_palette = DEFAULT_PALETTE;
+					cur_flags = DEFAULT_FLAGS;
+
+	return model_from_faces(np.array(positions, np.float64), face_vertices, face_sizes, palette, flags);
+
+# Write a PLY file
+def write_ply(path, model):
+	positions = model_positions(model).astype("<f4");
+	header = "\n".join([
+		"ply",
+		"format binary_little_endian 1.0",
+		"comment SEGA Virtua Processor model, in SVP axis order",
+		"element vertex %d" % len(positions),
+		"property float x",
+		"property float y",
+		"property float z",
+		"element face %d" % model.face_count,
+		"property list uchar int vertex_indices",
+		"property uchar svp_palette",
+		"property uchar svp_flags",
+		"end_header"]) + "\n";
+
+	# Face records, a corner count, the corners, then the palette and flags
+	sizes = model.face_sizes.astype(np.int64);
+	record_sizes = 3 + (sizes * 4);
+	starts = np.cumsum(record_sizes) - record_sizes;
+	faces = np.zeros(int(record_sizes.sum()), np.uint8);
+	faces[starts] = sizes;
+	face_starts = np.cumsum(sizes) - sizes;
+	corners = np.arange(model.loop_count) - np.repeat(face_starts, sizes);
+	loop_offsets = np.repeat(starts + 1, sizes) + (corners * 4);
+	faces[loop_offsets[:, None] + np.arange(4)] = model.face_vertices.astype("<i4").view(np.uint8).reshape(-1, 4);
+	faces[starts + record_sizes - 2] = model.palette;
+	faces[starts + record_sizes - 1] = model.flag_bytes() & (0xFF ^ FLAG_TRIANGLE);
+
+	with open(path, "wb") as file:
+		file.write(header.encode("ascii"));
+		file.write(positions.tobytes());
+		file.write(faces.tobytes());
+
+# PLY property types
+PLY_TYPES = {
+	"char": "b", "int8": "b", "uchar": "B", "uint8": "B",
+	"short": "h", "int16": "h", "ushort": "H", "uint16": "H",
+	"int": "i", "int32": "i", "uint": "I", "uint32": "I",
+	"float": "f", "float32": "f", "double": "d", "float64": "d",
+};
+
+# Read a PLY file
+def read_ply(path):
+	with open(path, "rb") as file:
+		data = file.read();
+
+	# Parse header
+	end = data.find(b"end_header");
+	if not data.startswith(b"ply") or (end < 0):
+		raise SVPError("%s is not a PLY file." % path);
+	offset = data.index(b"\n", end) + 1;
+	elements = [];
+	encoding = "ascii";
+	for line in data[:end].decode("ascii").splitlines():
+		parts = line.split();
+		if len(parts) == 0:
+			continue;
+		if parts[0] == "format":
+			encoding = parts[1];
+		elif parts[0] == "element":
+			elements.append((parts[1], int(parts[2]), []));
+		elif parts[0] == "property":
+			if parts[1] == "list":
+				elements[-1][2].append((parts[4], PLY_TYPES[parts[2]], PLY_TYPES[parts[3]]));
+			else:
+				elements[-1][2].append((parts[2], PLY_TYPES[parts[1]], None));
+	endian = ">" if encoding == "binary_big_endian" else "<";
+	tokens = data[offset:].split() if encoding == "ascii" else None;
+	token = 0;
+
+	# Read elements
+	values = {};
+	for name, count, props in elements:
+		rows = {prop[0]: [] for prop in props};
+		if tokens is not None:
+			for i in range(count):
+				for prop, prop_type, item_type in props:
+					if item_type is None:
+						rows[prop].append(float(tokens[token]));
+						token += 1;
+					else:
+						size = int(tokens[token]);
+						rows[prop].append([int(item) for item in tokens[token+1:token+1+size]]);
+						token += size + 1;
+		elif all(prop[2] is None for prop in props):
+			dtype = np.dtype([(prop, endian + prop_type) for prop, prop_type, item_type in props]);
+			array = np.frombuffer(data, dtype, count, offset);
+			offset += dtype.itemsize * count;
+			rows = {prop: array[prop] for prop in rows};
+		else:
+			formats = [(prop, struct.Struct(endian + prop_type), item_type) for prop, prop_type, item_type in props];
+			for i in range(count):
+				for prop, fmt, item_type in formats:
+					value = fmt.unpack_from(data, offset)[0];
+					offset += fmt.size;
+					if item_type is not None:
+						items = struct.Struct(endian + (item_type * value));
+						value = items.unpack_from(data, offset);
+						offset += items.size;
+					rows[prop].append(value);
+		values[name] = rows;
+
+	# Build model
+	vertices = values.get("vertex", {});
+	faces = values.get("face", {});
+	positions = np.stack([np.asarray(vertices.get(axis, []), np.float64) for axis in "xyz"], 1);
+	face_lists = faces.get("vertex_indices", faces.get("vertex_index", []));
+	face_count = len(face_lists);
+	return model_from_faces(positions,
+		[vert for face in face_lists for vert in face],
+		[len(face) for face in face_lists],
+		np.asarray(faces.get("svp_palette", [DEFAULT_PALETTE] * face_count), np.int64),
+		np.asarray(faces.get("svp_flags", [DEFAULT_FLAGS] * face_count), np.int64));
+
+# glTF constants
+GLTF_TYPES = {5120: "i1", 5121: "u1", 5122: "<i2", 5123: "<u2", 5125: "<u4", 5126: "<f4"};
+GLTF_SIZES = {"SCALAR": 1, "VEC2": 2, "VEC3": 3, "VEC4": 4};
+GLB_MAGIC = 0x46546C67;
+GLB_JSON = 0x4E4F534A;
+GLB_BIN = 0x004E4942;
+
+# Build the glTF document and binary buffer of a model
+def build_gltf(model):
+	# Every face gets its own vertices, so the face header can be a vertex attribute
+	positions = model_positions(model)[model.face_vertices].astype("<f4");
+	face_data = np.stack([
+		np.repeat(model.palette, model.face_sizes),
+		np.repeat(model.flag_bytes(), model.face_sizes)], 1).astype("<u2");
+	corners, tri_faces = fan_triangles(np.cumsum(model.face_sizes, dtype=np.int64) - model.face_sizes, model.face_sizes);
+	indices = corners.reshape(-1).astype("<u4");
+	blobs = [positions.tobytes(), face_data.tobytes(), indices.tobytes()];
+	offsets = np.cumsum([0] + [len(blob) for blob in blobs]).tolist();
+
+	document = {
+		"asset": {"version": "2.0", "generator": "svplib"},
+		"scene": 0,
+		"scenes": [{"nodes": [0]}],
+		"nodes": [{"mesh": 0, "name": "SVP Model"}],
+		"meshes": [{"name": "SVP Model", "primitives": [{"attributes": {"POSITION": 0, "_SVP_FACE": 1}, "indices": 2, "mode": 4}]}],
+		"accessors": [
+			{"bufferView": 0, "componentType": 5126, "count": len(positions), "type": "VEC3",
+				"min": positions.min(0).tolist(), "max": positions.max(0).tolist()},
+			{"bufferView": 1, "componentType": 5123, "count": len(face_data), "type": "VEC2"},
+			{"bufferView": 2, "componentType": 5125, "count": len(indices), "type": "SCALAR"},
+		],
+		"bufferViews": [
+			{"buffer": 0, "byteOffset": offsets[0], "byteLength": len(blobs[0]), "target": 34962},
+			{"buffer": 0, "byteOffset": offsets[1], "byteLength": len(blobs[1]), "target": 34962},
+			{"buffer": 0, "byteOffset": offsets[2], "byteLength": len(blobs[2]), "target": 34963},
+		],
+		"buffers": [{"byteLength": offsets[3]}],
+	};
+	return document, b"".join(blobs);
+
+# Write a glTF file, binary if the extension is .glb
+def write_gltf(path, model):
+	document, blob = build_gltf(model);
+	if path.lower().endswith(".glb"):
+		json_data = json.dumps(document, separators=(",", ":")).encode("utf-8");
+		json_data += b" " * (-len(json_data) % 4);
+		blob += b"\0" * (-len(blob) % 4);
+		with open(path, "wb") as file:
+			file.write(struct.pack("<III", GLB_MAGIC, 2, 12 + 8 + len(json_data) + 8 + len(blob)));
+			file.write(struct.pack("<II", len(json_data), GLB_JSON) + json_data);
+			file.write(struct.pack("<II", len(blob), GLB_BIN) + blob);
+	else:
+		document["buffers"][0]["uri"] = "data:application/octet-stream;base64," + base64.b64encode(blob).decode("ascii");
+		with open(path, "w") as file:
+			json.dump(document, file);
+
+# Read an accessor of a glTF document
+def read_gltf_accessor(document, buffers, index):
+	accessor = document["accessors"][index];
+	view = document["bufferViews"][accessor["bufferView"]];
+	dtype = np.dtype(GLTF_TYPES[accessor["componentType"]]);
+	size = GLTF_SIZES[accessor["type"]];
+	offset = view.get("byteOffset", 0) + accessor.get("byteOffset", 0);
+	stride = view.get("byteStride", dtype.itemsize * size);
+	data = np.frombuffer(buffers[view["buffer"]], np.uint8);
+	rows = np.lib.stride_tricks.as_strided(data[offset:], (accessor["count"], dtype.itemsize * size), (stride, 1));
+	return rows.copy().view(dtype).reshape(accessor["count"], size);
+
+# Read a glTF file
+def read_gltf(path):
+	with open(path, "rb") as file:
+		data = file.read();
+
+	# Get document and buffers
+	blob = None;
+	if data[:4] == b"glTF":
+		json_size = struct.unpack_from("<I", data, 12)[0];
+		document = json.loads(data[20:20+json_size].decode("utf-8"));
+		if len(data) > 20 + json_size:
+			bin_size = struct.unpack_from("<I", data, 20 + json_size)[0];
+			blob = data[28+json_size:28+json_size+bin_size];
+	else:
+		document = json.loads(data.decode("utf-8"));
+	buffers = [];
+	for buffer in document.get("buffers", []):
+		uri = buffer.get("uri");
+		if uri is None:
+			buffers.append(blob);
+		elif uri.startswith("data:"):
+			buffers.append(base64.b64decode(uri.split(",", 1)[1]));
+		else:
+			with open(os.path.join(os.path.dirname(path), uri), "rb") as file:
+				buffers.append(file.read());
+
+	# Go through each triangle primitive
+	positions = [];
+	face_vertices = [];
+	face_sizes = [];
+	palette = [];
+	flags = [];
+	vert_count = 0;
+	for mesh in document.get("meshes", []):
+		for primitive in mesh.get("primitives", []):
+			if primitive.get("mode", 4) != 4:
+				continue;
+			attributes = primitive["attributes"];
+			prim_positions = read_gltf_accessor(document, buffers, attributes["POSITION"]);
+			positions.append(prim_positions);
+
+			# Faces written by svplib, stored vertex by vertex
+			if "_SVP_FACE" in attributes:
+				face_data = read_gltf_accessor(document, buffers, attributes["_SVP_FACE"]).tolist();
+				vert = 0;
+				while vert < len(face_data):
+					size = 3 if (face_data[vert][1] & FLAG_TRIANGLE) else 4;
+					face_vertices.extend(range(vert_count + vert, vert_count + vert + size));
+					face_sizes.append(size);
+					palette.append(face_data[vert][0]);
+					flags.append(face_data[vert][1]);
+					vert += size;
+
+			# Other triangles
+			else:
+				if "indices" in primitive:
+					indices = read_gltf_accessor(document, buffers, primitive["indices"]).reshape(-1);
+				else:
+					indices = np.arange(len(prim_positions));
+				face_vertices.extend((indices.astype(np.int64) + vert_count).tolist());
+				face_sizes.extend([3] * (len(indices) // 3));
+				palette.extend([DEFAULT_PALETTE] * (len(indices) // 3));
+				flags.extend([DEFAULT_FLAGS] * (len(indices) // 3));
+			vert_count += len(prim_positions);
+
+	if len(positions) == 0:
+		raise SVPError("%s has no triangle meshes." % path);
+	return model_from_faces(np.concatenate(positions), face_vertices, face_sizes, palette, flags);
+
+# Readers and writers of each file extension
+FORMATS = {
+	".svp": (read_svp, write_svp),
+	".obj": (read_obj, write_obj),
+	".ply": (read_ply, write_ply),
+	".gltf": (read_gltf, write_gltf),
+	".glb": (read_gltf, write_gltf),
+};
+
+# Read a model in any supported format
+def read_model(path):
+	extension = os.path.splitext(path)[1].lower();
+	if extension not in FORMATS:
+		raise SVPError("Unsupported file type: %s" % path);
+	return FORMATS[extension][0](path);
+
+# Write a model in any supported format
+def write_model(path, model):
+	extension = os.path.splitext(path)[1].lower();
+	if extension not in FORMATS:
+		raise SVPError("Unsupported file type: %s" % path);
+	FORMATS[extension][1](path, model);
@@ -0,0 +1,65 @@
+'''
+	Sega Virtua Processor geometry helpers
+	See LICENSE for copyright and license details.
+'''
+
+# Imports
+import numpy as np;
+from .model import to_fixed_point;
+
+# Corners of the triangles a face is split into, quads are split along their 0-2 diagonal
+FAN_CORNERS = np.array([[0, 1, 2], [2, 3, 0]], np.int64);
+
+# Split triangles and quads into triangles, faces with more than 4 corners are skipped
+#   Returns the loop index of every triangle corner (T, 3) and the face of every triangle
+def fan_triangles(face_starts, face_sizes):
+	face_sizes = np.asarray(face_sizes);
+	counts = np.where(face_sizes == 3, 1, np.where(face_sizes == 4, 2, 0));
+	tri_faces = np.repeat(np.arange(len(face_sizes)), counts);
+	first_tris = np.cumsum(counts) - counts;
+	halves = np.arange(len(tri_faces)) - np.repeat(first_tris, counts);
+	corners = np.asarray(face_starts, np.int64)[tri_faces][:, None] + FAN_CORNERS[halves];
+	return corners, tri_faces;
+
+# Get the loop indices of every face corner, in face order
+def face_loops(loop_starts, face_sizes):
+	face_sizes = np.asarray(face_sizes, np.int64);
+	face_starts = np.cumsum(face_sizes) - face_sizes;
+	corners = np.arange(face_sizes.sum()) - np.repeat(face_starts, face_sizes);
+	return np.repeat(np.asarray(loop_starts, np.int64), face_sizes) + corners;
+
+# Get the center of every face of a mesh
+def face_centers(coords, loop_verts, loop_starts, face_sizes):
+	face_sizes = np.asarray(face_sizes, np.int64);
+	centers = np.zeros((len(face_sizes), 3), np.float64);
+	if len(face_sizes) > 0:
+		face_coords = np.asarray(coords).reshape(-1, 3)[np.asarray(loop_verts)[face_loops(loop_starts, face_sizes)]];
+		face_starts = np.cumsum(face_sizes) - face_sizes;
+		centers = np.add.reduceat(face_coords, face_starts, 0) / face_sizes[:, None];
+	return centers;
+
+# Get the face of every loop of a mesh
+def loop_faces(loop_starts, face_sizes, loop_count):
+	faces = np.zeros(loop_count, np.int64);
+	faces[face_loops(loop_starts, face_sizes)] = np.repeat(np.arange(len(face_sizes)), face_sizes);
+	return faces;
+
+# Split the faces of a mesh into triangles
+#   Returns the (T, 3, 3) corner positions, the (T, 3) center of the face of every triangle
+#   and the face of every triangle
+def triangulate(coords, loop_verts, loop_starts, face_sizes):
+	coords = np.asarray(coords).reshape(-1, 3);
+	loop_verts = np.asarray(loop_verts);
+	corners, tri_faces = fan_triangles(loop_starts, face_sizes);
+	centers = face_centers(coords, loop_verts, loop_starts, face_sizes);
+	return coords[loop_verts[corners]], centers[tri_faces], tri_faces;
+
+# Pack draw vertices into 8 bytes each, the way the hardware sees them
+#   positions - (L, 3) float positions, quantized to 8.8 fixed point like the exporter does
+#   face_data - (L, 2) palette byte and flag byte of every vertex
+#   Returns (L, 4) int16 rows of x, y, z and the two face bytes
+def pack_draw_vertices(positions, face_data):
+	vertices = np.empty((len(positions), 4), np.int16);
+	vertices[:, :3] = to_fixed_point(np.asarray(positions).reshape(-1, 3));
+	vertices[:, 3] = np.ascontiguousarray(face_data, np.uint8).view(np.int16).reshape(-1);
+	return vertices;
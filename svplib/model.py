@@ -0,0 +1,235 @@
+'''
+	Sega Virtua Processor model format
+	See LICENSE for copyright and license details.
+'''
+
+# Imports
+import numpy as np;
+
+# Face record layout
+HEADER_SIZE = 2;
+TRIANGLE_SIZE = 20;
+QUAD_SIZE = 26;
+VERTEX_SIZE = 6;
+
+# Face flags
+FLAG_SORT = 0x0F;
+FLAG_TRIANGLE = 0x10;
+FLAG_DITHER = 0x20;
+FLAG_CULL = 0x40;
+
+# The header stores the face count minus one
+MAX_FACES = 0x10000;
+
+# Byte offsets of a vertex inside a face record
+VERTEX_BYTES = np.arange(VERTEX_SIZE);
+
+# Format error
+class SVPError(Exception):
+	pass;
+
+# Decoded SVP model
+#   coords        - (N, 3) int16 8.8 fixed point positions, in file axis order (x, y, z)
+#   face_vertices - Index into coords for every face corner
+#   face_sizes    - Corner count of every face (3 or 4)
+#   palette       - Color byte of every face (color 1 in the high nibble, color 2 in the low one)
+#   dither        - Checkerboard dithering bit of every face
+#   cull          - Culling bit of every face
+#   flags         - Sorting flag nibble of every face
+class SVPModel:
+	def __init__(self, coords, face_vertices, face_sizes, palette, dither, cull, flags):
+		self.coords = coords;
+		self.face_vertices = face_vertices;
+		self.face_sizes = face_sizes;
+		self.palette = palette;
+		self.dither = dither;
+		self.cull = cull;
+		self.flags = flags;
+
+	# Number of faces
+	@property
+	def face_count(self):
+		return len(self.face_sizes);
+
+	# Number of face corners
+	@property
+	def loop_count(self):
+		return len(self.face_vertices);
+
+	# Size of the encoded model in bytes
+	@property
+	def byte_size(self):
+		return HEADER_SIZE + (self.face_count * 2) + (self.loop_count * VERTEX_SIZE);
+
+	# Index of the first corner of every face
+	def face_starts(self):
+		starts = np.zeros(self.face_count, np.int64);
+		np.cumsum(self.face_sizes[:-1], out=starts[1:]);
+		return starts;
+
+	# Raw flag byte of every face
+	def flag_bytes(self):
+		flags = (self.flags & FLAG_SORT) | (self.dither.astype(np.uint8) << 5) | (self.cull.astype(np.uint8) << 6);
+		flags[self.face_sizes == 3] |= FLAG_TRIANGLE;
+		return flags.astype(np.uint8);
+
+	# Flat float positions in Blender axis order (x, z, y)
+	def positions(self):
+		return (self.coords[:, (0, 2, 1)] / np.float32(256.0)).astype(np.float32).reshape(-1);
+
+# Find the face records of a model, returns the record offsets and the end offset
+#   The buffer is released before returning or raising, so memory-mapped files can be closed
+def scan_svp(data, offset=0):
+	with memoryview(data).cast("B") as view:
+		return scan_view(view, offset);
+
+# Find the face records of a model in a byte memoryview
+def scan_view(view, offset):
+	end = len(view);
+
+	# Get face count
+	if (offset + HEADER_SIZE > end):
+		raise SVPError("Model header at 0x%X is out of bounds." % offset);
+	face_count = ((view[offset] << 8) | view[offset+1]) + 1;
+
+	# Follow the square flag from record to record
+	starts = [];
+	pos = offset + HEADER_SIZE;
+	for i in range(face_count):
+		if (pos + TRIANGLE_SIZE > end):
+			raise SVPError("Face %d at 0x%X is out of bounds." % (i, pos));
+		starts.append(pos);
+		if (view[pos+1] & FLAG_TRIANGLE):
+			pos += TRIANGLE_SIZE;
+		else:
+			pos += QUAD_SIZE;
+	if (pos > end):
+		raise SVPError("Face %d at 0x%X is out of bounds." % (face_count - 1, starts[-1]));
+
+	return np.array(starts, np.int64), pos;
+
+# Decode a model from a buffer
+def parse_svp(data, offset=0):
+	starts, end = scan_svp(data, offset);
+	buf = np.frombuffer(data, np.uint8);
+
+	# Face headers
+	palette = buf[starts];
+	flag_bytes = buf[starts + 1];
+	face_sizes = np.where(flag_bytes & FLAG_TRIANGLE, 3, 4).astype(np.uint8);
+
+	# Byte offset of every face corner
+	face_starts = np.cumsum(face_sizes, dtype=np.int64) - face_sizes;
+	loop_count = int(face_sizes.sum(dtype=np.int64));
+	corners = np.arange(loop_count, dtype=np.int64) - np.repeat(face_starts, face_sizes);
+	loop_offsets = np.repeat(starts + 2, face_sizes) + (corners * VERTEX_SIZE);
+
+	# Decode every vertex at once
+	coords = buf[loop_offsets[:, None] + VERTEX_BYTES].view(">i2").astype(np.int16);
+
+	return SVPModel(
+		coords,
+		np.arange(loop_count, dtype=np.int32),
+		face_sizes,
+		palette,
+		(flag_bytes & FLAG_DITHER) >> 5,
+		(flag_bytes & FLAG_CULL) >> 6,
+		flag_bytes & FLAG_SORT);
+
+# Read a model file
+def read_svp(path):
+	with open(path, "rb") as file:
+		data = file.read();
+	return parse_svp(data);
+
+# Quantize float positions to 8.8 fixed point, truncating and wrapping like the exporter always has
+def to_fixed_point(positions):
+	positions = np.asarray(positions, np.float64);
+	return (np.trunc(positions * 256.0).astype(np.int64) & 0xFFFF).astype(np.uint16).view(np.int16);
+
+# Build a model from per-corner float positions in Blender axis order (x, y, z)
+def build_svp_model(positions, face_sizes, palette, dither, cull, flags):
+	positions = np.asarray(positions, np.float64).reshape(-1, 3);
+	fixed = to_fixed_point(positions[:, (0, 2, 1)]);
+	return SVPModel(
+		fixed,
+		np.arange(len(fixed), dtype=np.int32),
+		np.asarray(face_sizes).astype(np.uint8),
+		np.asarray(palette).astype(np.uint8),
+		np.asarray(dither).astype(np.uint8) & 1,
+		np.asarray(cull).astype(np.uint8) & 1,
+		np.asarray(flags).astype(np.uint8) & FLAG_SORT);
+
+# Weld the vertices of a model that have identical coordinates, returns a new model
+#   Faces that would end up with a repeated vertex, or with the same vertices as an earlier face,
+#   keep vertices of their own. Corner positions, and so the encoded model, do not change.
+def weld_vertices(model):
+	coords = model.coords[model.face_vertices];
+
+	# Index the coordinates by packing them into one key
+	keys = coords.astype(np.uint16).astype(np.int64);
+	keys = (keys[:, 0] << 32) | (keys[:, 1] << 16) | keys[:, 2];
+	unique_keys, first, inverse = np.unique(keys, return_index=True, return_inverse=True);
+
+	# Number the welded vertices in order of first use
+	order = np.argsort(first, kind="stable");
+	rank = np.empty(len(order), np.int64);
+	rank[order] = np.arange(len(order));
+	face_vertices = rank[inverse.reshape(-1)];
+	welded = coords[first[order]];
+
+	# Find faces with repeated vertices, or the same vertices as an earlier face
+	face_starts = model.face_starts();
+	face_sizes = model.face_sizes.astype(np.int64);
+	corners = np.full((model.face_count, 4), -1, np.int64);
+	corner_index = np.arange(model.loop_count) - np.repeat(face_starts, face_sizes);
+	corners[np.repeat(np.arange(model.face_count), face_sizes), corner_index] = face_vertices;
+	corners.sort(1);
+	repeated = np.any((corners[:, 1:] == corners[:, :-1]) & (corners[:, 1:] >= 0), 1);
+	unique_faces = np.zeros(model.face_count, bool);
+	if model.face_count > 0:
+		unique_faces[np.unique(corners, axis=0, return_index=True)[1]] = True;
+	split = np.repeat(repeated | ~unique_faces, face_sizes);
+
+	# Give those faces their own vertices back
+	split_loops = np.nonzero(split)[0];
+	face_vertices[split_loops] = len(welded) + np.arange(len(split_loops));
+	welded = np.concatenate([welded, coords[split_loops]]);
+
+	return SVPModel(welded.astype(np.int16), face_vertices.astype(np.int32), model.face_sizes,
+		model.palette, model.dither, model.cull, model.flags);
+
+# Encode a model into a buffer, allocating one if none is given, and return the buffer
+def encode_svp(model, out=None, offset=0):
+	if not (1 <= model.face_count <= MAX_FACES):
+		raise SVPError("SVP models need 1 to %d faces, got %d." % (MAX_FACES, model.face_count));
+	if out is None:
+		out = bytearray(offset + model.byte_size);
+	buf = np.frombuffer(out, np.uint8);
+
+	# Set face count
+	face_count = model.face_count - 1;
+	buf[offset] = (face_count >> 8) & 0xFF;
+	buf[offset+1] = face_count & 0xFF;
+
+	# Face headers
+	face_sizes = model.face_sizes.astype(np.int64);
+	record_sizes = 2 + (face_sizes * VERTEX_SIZE);
+	starts = offset + HEADER_SIZE + np.cumsum(record_sizes) - record_sizes;
+	buf[starts] = model.palette;
+	buf[starts + 1] = model.flag_bytes();
+
+	# Vertices
+	face_starts = np.cumsum(face_sizes) - face_sizes;
+	corners = np.arange(model.loop_count, dtype=np.int64) - np.repeat(face_starts, face_sizes);
+	loop_offsets = np.repeat(starts + 2, face_sizes) + (corners * VERTEX_SIZE);
+	vertex_data = model.coords[model.face_vertices].astype(">i2").view(np.uint8).reshape(-1, VERTEX_SIZE);
+	buf[loop_offsets[:, None] + VERTEX_BYTES] = vertex_data;
+
+	return out;
+
+# Write a model file
+def write_svp(path, model):
+	data = encode_svp(model);
+	with open(path, "wb") as file:
+		file.write(data);
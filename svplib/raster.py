@@ -0,0 +1,256 @@
+'''
+	Sega Virtua Processor software rasterizer
+	See LICENSE for copyright and license details.
+
+	Reproduces the look of the viewport shader without a GPU, for final and headless renders.
+'''
+
+# Imports
+import multiprocessing;
+import numpy as np;
+from concurrent.futures import (ProcessPoolExecutor, as_completed);
+try:
+	from multiprocessing import shared_memory;
+except ImportError:
+	shared_memory = None;
+
+# Size of a checkerboard dithering cell in pixels
+DITHER_SIZE = 3;
+
+# Default size of a render tile in pixels
+TILE_SIZE = 64;
+
+# Screen space triangles, ready to be rasterized
+#   xy      - (T, 3, 2) pixel positions of every corner, y pointing up
+#   z       - (T, 3) normalized device depth of every corner
+#   color1  - Palette index of color 1 of every triangle
+#   color2  - Palette index of color 2 of every triangle
+#   dither  - Checkerboard dithering bit of every triangle
+class ScreenTriangles:
+	def __init__(self, xy, z, color1, color2, dither):
+		self.xy = xy;
+		self.z = z;
+		self.color1 = color1;
+		self.color2 = color2;
+		self.dither = dither;
+
+	# Number of triangles
+	def __len__(self):
+		return len(self.z);
+
+# Clip triangles against the near plane, returns the clipped triangles and the source of each one, in order
+def clip_near(clip):
+	dist = clip[..., 2] + clip[..., 3];
+	inside = dist > 0.0;
+	count = inside.sum(1);
+	tris = [clip[count == 3]];
+	sources = [np.nonzero(count == 3)[0]];
+
+	# Triangles with one or two corners in front of the near plane
+	for case in (1, 2):
+		sel = np.nonzero(count == case)[0];
+		if len(sel) == 0:
+			continue;
+
+		# Rotate the odd corner to the front, which keeps the winding
+		odd = inside[sel] if case == 1 else ~inside[sel];
+		order = (np.argmax(odd, 1)[:, None] + np.arange(3)) % 3;
+		tri = np.take_along_axis(clip[sel], order[:, :, None], 1);
+		d = np.take_along_axis(dist[sel], order, 1);
+		a, b, c = tri[:, 0], tri[:, 1], tri[:, 2];
+		ab = a + ((b - a) * (d[:, 0] / (d[:, 0] - d[:, 1]))[:, None]);
+		ca = c + ((a - c) * (d[:, 2] / (d[:, 2] - d[:, 0]))[:, None]);
+
+		# One corner inside gives a smaller triangle, two corners inside give a quad
+		if case == 1:
+			tris.append(np.stack([a, ab, ca], 1));
+			sources.append(sel);
+		else:
+			tris.append(np.stack([ab, b, c], 1));
+			tris.append(np.stack([ab, c, ca], 1));
+			sources.append(sel);
+			sources.append(sel);
+
+	# Keep the drawing order
+	sources = np.concatenate(sources);
+	order = np.argsort(sources, kind="stable");
+	return np.concatenate(tris)[order], sources[order];
+
+# Set up triangles for rasterization
+#   clip     - (T, 3, 4) clip space positions of every corner
+#   palette  - Color byte of every triangle
+#   dither   - Dithering bit of every triangle
+#   cull     - Culling bit of every triangle, culled triangles are rejected when facing away
+def setup_triangles(clip, palette, dither, cull, width, height):
+	clip, sources = clip_near(np.asarray(clip, np.float64).reshape(-1, 3, 4));
+	palette = np.asarray(palette, np.int64)[sources];
+	dither = np.asarray(dither, np.int64)[sources];
+	cull = np.asarray(cull, np.int64)[sources];
+
+	# Project
+	ndc = clip[..., :3] / clip[..., 3:4];
+	xy = ((ndc[..., :2] * 0.5) + 0.5) * (width, height);
+	e1 = xy[:, 1] - xy[:, 0];
+	e2 = xy[:, 2] - xy[:, 0];
+	area = (e1[:, 0] * e2[:, 1]) - (e1[:, 1] * e2[:, 0]);
+
+	# Drop degenerate and culled triangles, front faces are counter-clockwise
+	keep = (area != 0.0) & ~((cull != 0) & (area < 0.0));
+	return ScreenTriangles(
+		xy[keep],
+		ndc[keep, :, 2],
+		((palette[keep] >> 4) & 0xF).astype(np.uint8),
+		(palette[keep] & 0xF).astype(np.uint8),
+		(dither[keep] != 0).astype(np.uint8));
+
+# Rasterize triangles into a region of the frame, in order, returns (height, width, 4) RGBA rows from the bottom up
+#   palette     - (16, 4) RGBA colors
+#   background  - RGBA color of empty pixels
+#   depth_test  - Whether to depth test, otherwise triangles are painted in order
+def rasterize(tris, palette, x, y, width, height, background=(0.0, 0.0, 0.0, 0.0), depth_test=True):
+	color = np.empty((height, width, 4), np.float32);
+	color[:] = background;
+	depth = np.full((height, width), np.inf);
+	palette = np.asarray(palette, np.float32);
+	if len(tris) == 0:
+		return color;
+
+	# Pixel bounds of every triangle, pixels are covered if their center is
+	xy = tris.xy;
+	mins = np.ceil(xy.min(1) - 0.5).astype(np.int64);
+	maxs = np.floor(xy.max(1) - 0.5).astype(np.int64);
+	np.maximum(mins, (x, y), out=mins);
+	np.minimum(maxs, (x + width - 1, y + height - 1), out=maxs);
+	visible = np.nonzero(np.all(maxs >= mins, 1))[0];
+
+	# Edge functions, scaled so that they are barycentric coordinates
+	v0, v1, v2 = xy[:, 0], xy[:, 1], xy[:, 2];
+	area = ((v1[:, 0] - v0[:, 0]) * (v2[:, 1] - v0[:, 1])) - ((v1[:, 1] - v0[:, 1]) * (v2[:, 0] - v0[:, 0]));
+	edge_a = np.stack([v1[:, 1] - v2[:, 1], v2[:, 1] - v0[:, 1], v0[:, 1] - v1[:, 1]], 1) / area[:, None];
+	edge_b = np.stack([v2[:, 0] - v1[:, 0], v0[:, 0] - v2[:, 0], v1[:, 0] - v0[:, 0]], 1) / area[:, None];
+	edge_c = np.stack([
+		(v1[:, 0] * v2[:, 1]) - (v2[:, 0] * v1[:, 1]),
+		(v2[:, 0] * v0[:, 1]) - (v0[:, 0] * v2[:, 1]),
+		(v0[:, 0] * v1[:, 1]) - (v1[:, 0] * v0[:, 1])], 1) / area[:, None];
+
+	# Go through each triangle
+	for t in visible:
+		x0, y0 = mins[t];
+		x1, y1 = maxs[t] + 1;
+		px = np.arange(x0, x1);
+		py = np.arange(y0, y1)[:, None];
+
+		# Coverage
+		w0 = (edge_a[t, 0] * (px + 0.5)) + (edge_b[t, 0] * (py + 0.5)) + edge_c[t, 0];
+		w1 = (edge_a[t, 1] * (px + 0.5)) + (edge_b[t, 1] * (py + 0.5)) + edge_c[t, 1];
+		w2 = 1.0 - w0 - w1;
+		z = (w0 * tris.z[t, 0]) + (w1 * tris.z[t, 1]) + (w2 * tris.z[t, 2]);
+		covered = (w0 >= 0.0) & (w1 >= 0.0) & (w2 >= 0.0) & (z <= 1.0);
+
+		# Depth test
+		depth_sub = depth[y0-y:y1-y, x0-x:x1-x];
+		if depth_test:
+			covered &= z < depth_sub;
+		if not covered.any():
+			continue;
+		depth_sub[covered] = z[covered];
+
+		# Checkerboard dithering, same as the viewport shader
+		parity = ((px // DITHER_SIZE) + ((py // DITHER_SIZE) * tris.dither[t])) & 1;
+		src = np.where((parity == 0)[:, :, None], palette[tris.color1[t]], palette[tris.color2[t]]);
+		src = np.broadcast_to(src, covered.shape + (4,))[covered];
+
+		# Blend like glBlendFunc(GL_ONE, GL_ONE_MINUS_SRC_ALPHA)
+		color_sub = color[y0-y:y1-y, x0-x:x1-x];
+		color_sub[covered] = src + (color_sub[covered] * (1.0 - src[:, 3:4]));
+
+	return color;
+
+# Split a frame into tiles, returns (x, y, width, height) of each tile
+def frame_tiles(width, height, tile_size=TILE_SIZE):
+	tiles = [];
+	for y in range(0, height, tile_size):
+		for x in range(0, width, tile_size):
+			tiles.append((x, y, min(tile_size, width - x), min(tile_size, height - y)));
+	return tiles;
+
+# Copy arrays into one shared memory block, returns the block and the layout workers attach with
+def share_arrays(arrays):
+	layout = [];
+	size = 0;
+	for key, array in arrays.items():
+		layout.append((key, array.dtype.str, array.shape, size));
+		size += (array.nbytes + 15) & ~15;
+	block = shared_memory.SharedMemory(create=True, size=max(size, 1));
+	views = attach_arrays(block, layout);
+	for key, array in arrays.items():
+		views[key][...] = array;
+	del views;
+	return block, layout;
+
+# Get views of arrays in a shared memory block
+def attach_arrays(block, layout):
+	return {key: np.ndarray(shape, dtype, block.buf, offset) for key, dtype, shape, offset in layout};
+
+# Triangles and frame shared with a worker process
+worker_state = None;
+
+# Attach a worker process to the shared triangles and frame
+def init_worker(name, layout, background, depth_test):
+	global worker_state;
+	block = shared_memory.SharedMemory(name=name);
+	arrays = attach_arrays(block, layout);
+	tris = ScreenTriangles(arrays["xy"], arrays["z"], arrays["color1"], arrays["color2"], arrays["dither"]);
+	worker_state = (block, tris, arrays["palette"], arrays["frame"], background, depth_test);
+
+# Rasterize a tile into the shared frame
+def render_worker_tile(tile):
+	block, tris, palette, frame, background, depth_test = worker_state;
+	x, y, width, height = tile;
+	frame[y:y+height, x:x+width] = rasterize(tris, palette, x, y, width, height, background, depth_test);
+	return tile;
+
+# Rasterize a frame tile by tile, yields each tile and its pixels as soon as it is finished
+#   workers     - Number of worker processes, tiles are rendered in this process if 1
+#   executable  - Python executable for the worker processes, if not sys.executable
+def render_tiles(tris, palette, width, height, background=(0.0, 0.0, 0.0, 0.0), depth_test=True,
+	tile_size=TILE_SIZE, workers=1, executable=None):
+	tiles = frame_tiles(width, height, tile_size);
+
+	# Render in this process
+	if (workers <= 1) or (len(tiles) <= 1) or (shared_memory is None):
+		for x, y, tile_width, tile_height in tiles:
+			yield (x, y, tile_width, tile_height), rasterize(tris, palette, x, y, tile_width, tile_height, background, depth_test);
+		return;
+
+	# Share the triangles and the frame with the workers
+	block, layout = share_arrays({
+		"xy": np.ascontiguousarray(tris.xy),
+		"z": np.ascontiguousarray(tris.z),
+		"color1": np.ascontiguousarray(tris.color1),
+		"color2": np.ascontiguousarray(tris.color2),
+		"dither": np.ascontiguousarray(tris.dither),
+		"palette": np.asarray(palette, np.float32),
+		"frame": np.zeros((height, width, 4), np.float32)});
+	context = multiprocessing.get_context("spawn");
+	if executable is not None:
+		context.set_executable(executable);
+
+	# Render tiles across the workers
+	try:
+		with ProcessPoolExecutor(min(workers, len(tiles)), context, init_worker,
+			(block.name, layout, tuple(background), depth_test)) as pool:
+			futures = [pool.submit(render_worker_tile, tile) for tile in tiles];
+			try:
+				for future in as_completed(futures):
+					x, y, tile_width, tile_height = future.result();
+					frame = attach_arrays(block, layout)["frame"];
+					pixels = frame[y:y+tile_height, x:x+tile_width].copy();
+					del frame;
+					yield (x, y, tile_width, tile_height), pixels;
+			finally:
+				for future in futures:
+					future.cancel();
+	finally:
+		block.close();
+		block.unlink();
@@ -0,0 +1,247 @@
+'''
+	Sega Virtua Processor ROM scanner
+	See LICENSE for copyright and license details.
+
+	Finds models in memory-mapped ROM dumps and bank files, both through tables of big endian
+	32-bit pointers and by checking every word aligned offset for a plausible model. The found
+	models are kept in a JSON index next to the ROM, and are only decoded when asked for.
+'''
+
+# Imports
+import argparse, hashlib, json, mmap, os, struct, sys;
+import numpy as np;
+from .model import (SVPError, HEADER_SIZE, TRIANGLE_SIZE, FLAG_TRIANGLE, parse_svp);
+
+# Index format version, and the extension added to the ROM path
+INDEX_VERSION = 1;
+INDEX_EXTENSION = ".svpindex.json";
+
+# Default scan settings
+#   min_faces  - Fewest faces a model can have
+#   max_faces  - Most faces a model can have
+#   max_coord  - Largest absolute 8.8 fixed point coordinate a model can have
+#   min_table  - Fewest models a pointer table has to point at
+#   base       - Address of the first byte of the ROM, subtracted from pointers
+DEFAULT_SETTINGS = {
+	"min_faces": 4,
+	"max_faces": 4096,
+	"max_coord": 0x4000,
+	"min_table": 2,
+	"base": 0,
+};
+
+# Flag bits that are never set in a model
+UNUSED_FLAGS = 0x80;
+
+# Memory-map a file read only
+def map_file(path):
+	with open(path, "rb") as file:
+		if os.fstat(file.fileno()).st_size == 0:
+			raise SVPError("%s is empty." % path);
+		return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ);
+
+# Quickly check every word aligned offset for a model header, returns a mask over offset / 2
+#   Only the header and the first vertex are looked at, candidates still need check_model()
+def header_candidates(data, settings):
+	buf = np.frombuffer(data, np.uint8);
+	count = (len(buf) - HEADER_SIZE - TRIANGLE_SIZE) // 2 + 1;
+	if count <= 0:
+		return np.zeros(0, bool);
+	words = np.lib.stride_tricks.as_strided(buf, (count, HEADER_SIZE + TRIANGLE_SIZE), (2, 1));
+
+	# Face count, flags and first vertex
+	face_counts = ((words[:, 0].astype(np.int64) << 8) | words[:, 1]) + 1;
+	mask = (face_counts >= settings["min_faces"]) & (face_counts <= settings["max_faces"]);
+	mask &= (words[:, 3] & UNUSED_FLAGS) == 0;
+	coords = np.ascontiguousarray(words[:, 4:10]).view(">i2");
+	mask &= np.all(np.abs(coords.astype(np.int64)) <= settings["max_coord"], 1);
+	return mask;
+
+# Vertex coordinates of a triangle and a quad record
+TRIANGLE_COORDS = struct.Struct(">9h");
+QUAD_COORDS = struct.Struct(">12h");
+
+# Check whether a model is plausible, returns its face count and size, or None
+def check_model(data, offset, settings):
+	end = len(data);
+	if offset + HEADER_SIZE > end:
+		return None;
+	face_count = ((data[offset] << 8) | data[offset+1]) + 1;
+	if not (settings["min_faces"] <= face_count <= settings["max_faces"]):
+		return None;
+
+	# Walk the records, giving up at the first bad one
+	max_coord = settings["max_coord"];
+	pos = offset + HEADER_SIZE;
+	for i in range(face_count):
+		if pos + TRIANGLE_SIZE > end:
+			return None;
+		flags = data[pos+1];
+		if flags & UNUSED_FLAGS:
+			return None;
+		coords = TRIANGLE_COORDS if (flags & FLAG_TRIANGLE) else QUAD_COORDS;
+		if pos + 2 + coords.size > end:
+			return None;
+		if max(map(abs, coords.unpack_from(data, pos + 2))) > max_coord:
+			return None;
+		pos += 2 + coords.size;
+
+	# Every face needs 3 different corners
+	model = parse_svp(data, offset);
+	corners = model.coords[model.face_vertices].astype(np.int64);
+	first = model.face_starts();
+	a, b, c = corners[first], corners[first + 1], corners[first + 2];
+	if np.any(np.all(a == b, 1) | np.all(b == c, 1) | np.all(a == c, 1)):
+		return None;
+
+	return face_count, pos - offset;
+
+# Find pointer tables, returns the offset every table entry points at, in ROM order
+def find_pointer_targets(data, candidates, settings):
+	buf = np.frombuffer(data, np.uint8);
+	targets = [];
+	for align in (0, 2):
+		count = (len(buf) - align) // 4;
+		if count <= 0:
+			continue;
+		pointers = buf[align:align + (count * 4)].view(">u4").astype(np.int64) - settings["base"];
+
+		# Entries pointing at a header candidate
+		valid = (pointers >= 0) & (pointers < len(candidates) * 2) & ((pointers & 1) == 0);
+		valid[valid] = candidates[pointers[valid] >> 1];
+
+		# Runs of valid entries, long enough to be a table
+		edges = np.diff(np.concatenate([[0], valid.astype(np.int8), [0]]));
+		run_starts = np.nonzero(edges == 1)[0];
+		run_ends = np.nonzero(edges == -1)[0];
+		for start, end in zip(run_starts, run_ends):
+			if end - start >= settings["min_table"]:
+				targets.append(pointers[start:end]);
+	if len(targets) == 0:
+		return np.zeros(0, np.int64);
+	return np.unique(np.concatenate(targets));
+
+# Hash a range of a buffer without copying it
+def hash_range(data, offset, size):
+	with memoryview(data) as view:
+		return hashlib.sha1(view[offset:offset+size]).hexdigest();
+
+# Scan a ROM for models, returns the index
+def build_index(data, name="", **settings):
+	settings = dict(DEFAULT_SETTINGS, **settings);
+	candidates = header_candidates(data, settings);
+	models = {};
+
+	# Models in pointer tables
+	for offset in find_pointer_targets(data, candidates, settings).tolist():
+		found = check_model(data, offset, settings);
+		if found is not None:
+			models[offset] = found + ("pointer",);
+
+	# Other models, skipping anything inside a model that was already found
+	covered = np.zeros(len(candidates), bool);
+	for offset, (faces, size, source) in models.items():
+		covered[offset >> 1:(offset + size + 1) >> 1] = True;
+	pos = 0;
+	for index in np.nonzero(candidates & ~covered)[0].tolist():
+		offset = index * 2;
+		if offset < pos:
+			continue;
+		found = check_model(data, offset, settings);
+		if found is not None:
+			models[offset] = found + ("scan",);
+			pos = offset + found[1];
+
+	return {
+		"version": INDEX_VERSION,
+		"rom": {"name": name, "size": len(data), "sha1": hash_range(data, 0, len(data))},
+		"settings": settings,
+		"models": [{"offset": offset, "faces": faces, "size": size, "sha1": hash_range(data, offset, size), "source": source}
+			for offset, (faces, size, source) in sorted(models.items())],
+	};
+
+# Get the path of the index of a ROM
+def index_path(path):
+	return path + INDEX_EXTENSION;
+
+# Write an index
+def write_index(path, index):
+	with open(path, "w") as file:
+		json.dump(index, file, indent=1);
+
+# Read an index
+def read_index(path):
+	with open(path, "r") as file:
+		return json.load(file);
+
+# Memory-mapped ROM with an index of its models
+class SVPRom:
+	def __init__(self, path):
+		self.path = path;
+		self.data = map_file(path);
+		self.index = None;
+
+	def __enter__(self):
+		return self;
+
+	def __exit__(self, *args):
+		self.close();
+
+	# Unmap the ROM
+	def close(self):
+		self.data.close();
+
+	# Load the saved index if it matches the ROM and the settings, otherwise scan and save it
+	def load_index(self, rebuild=False, **settings):
+		settings = dict(DEFAULT_SETTINGS, **settings);
+		path = index_path(self.path);
+		if (not rebuild) and os.path.exists(path):
+			try:
+				index = read_index(path);
+				if (index.get("version") == INDEX_VERSION) and (index.get("settings") == settings) and \
+					(index["rom"]["size"] == len(self.data)) and (index["rom"]["sha1"] == hash_range(self.data, 0, len(self.data))):
+					self.index = index;
+					return index;
+			except (OSError, ValueError, KeyError):
+				pass;
+
+		self.index = build_index(self.data, os.path.basename(self.path), **settings);
+		try:
+			write_index(path, self.index);
+		except OSError:
+			pass;
+		return self.index;
+
+	# Decode the model at an offset, straight from the mapped ROM
+	def model(self, offset):
+		return parse_svp(self.data, offset);
+
+	# Decode every indexed model, yields each index entry and its model
+	def models(self):
+		for entry in self.index["models"]:
+			yield entry, self.model(entry["offset"]);
+
+# Command line entry point
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog="python -m svplib.rom", description="Find SVP models in a ROM dump or bank file.");
+	parser.add_argument("rom", help="ROM file to scan");
+	parser.add_argument("--rebuild", action="store_true", help="Scan again even if the index is up to date");
+	parser.add_argument("--extract", metavar="FOLDER", help="Write every model found into a folder");
+	for key, value in DEFAULT_SETTINGS.items():
+		parser.add_argument("--" + key.replace("_", "-"), type=lambda text: int(text, 0), default=value);
+	args = parser.parse_args(argv);
+
+	settings = {key: getattr(args, key) for key in DEFAULT_SETTINGS};
+	with SVPRom(args.rom) as rom:
+		index = rom.load_index(args.rebuild, **settings);
+		for entry in index["models"]:
+			print("0x%06X: %d faces, %d bytes, %s (%s)" % (entry["offset"], entry["faces"], entry["size"], entry["sha1"], entry["source"]));
+			if args.extract:
+				os.makedirs(args.extract, exist_ok=True);
+				with open(os.path.join(args.extract, "%06X.svp" % entry["offset"]), "wb") as file:
+					file.write(rom.data[entry["offset"]:entry["offset"] + entry["size"]]);
+	print("%d models found" % len(index["models"]));
+	return 0;
+
+if __name__ == "__main__":
+	sys.exit(main());
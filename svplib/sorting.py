@@ -0,0 +1,60 @@
+'''
+	Sega Virtua Processor face sorting
+	See LICENSE for copyright and license details.
+
+	Orders faces back to front the way the hardware does, instead of using a depth buffer.
+	Keys are 16-bit, so NumPy sorts them with a linear time radix sort.
+'''
+
+# Imports
+import numpy as np;
+
+# Sort modes
+SORT_DEPTH = "DEPTH";
+SORT_PAINTER = "PAINTER";
+SORT_FLAGS = "FLAGS";
+
+# Bits of the sort key used for the quantized depth, the rest is the bucket
+DEPTH_BITS = 12;
+DEPTH_MAX = (1 << DEPTH_BITS) - 1;
+
+# Painter's order, every face is in the same bucket
+def painter_buckets(flags):
+	return np.zeros(len(flags), np.uint16);
+
+# SVP order, faces are bucketed by their sorting flag nibble first
+def flag_buckets(flags):
+	return (np.asarray(flags).astype(np.uint16) & 0xF) << DEPTH_BITS;
+
+# Bucket functions of each sort mode, other modes do not sort
+SORT_BUCKETS = {
+	SORT_PAINTER: painter_buckets,
+	SORT_FLAGS: flag_buckets,
+};
+
+# Quantize view depths so that the farthest face gets the lowest key
+def quantize_depth(depth):
+	if len(depth) == 0:
+		return np.zeros(0, np.uint16);
+	near = depth.min();
+	far = depth.max();
+	scale = DEPTH_MAX / (far - near) if far > near else 0.0;
+	return (DEPTH_MAX - np.round((depth - near) * scale)).astype(np.uint16);
+
+# Sort keys of a set of faces, the bucket part is computed once and only the depth per view
+#   centers  - (F, 3) face centers
+#   flags    - Sorting flag nibble of every face
+class FaceSorter:
+	def __init__(self, centers, flags, mode):
+		self.centers = np.asarray(centers, np.float64).reshape(-1, 3);
+		self.mode = mode;
+		self.buckets = SORT_BUCKETS[mode](flags);
+
+	# Get the drawing order for a view
+	#   depth_row - Row of the object to view matrix that gives the view depth, so that
+	#               depth = dot(depth_row[:3], center) + depth_row[3] increases away from the viewer
+	def order(self, depth_row):
+		depth_row = np.asarray(depth_row, np.float64);
+		depth = (self.centers @ depth_row[:3]) + depth_row[3];
+		keys = self.buckets | quantize_depth(depth);
+		return np.argsort(keys, kind="stable");
@@ -0,0 +1,100 @@
+'''
+	Opt-in timing instrumentation
+	See LICENSE for copyright and license details.
+
+	Phases are timed with "with stats.timed(name):" blocks, which cost next to nothing while
+	the stats are disabled. Every phase keeps a call count, total, minimum, maximum and a
+	histogram of its times.
+'''
+
+# Imports
+import bisect, json, time;
+from contextlib import contextmanager;
+
+# Upper edges of the histogram buckets in milliseconds, the last bucket holds everything slower
+HISTOGRAM_EDGES = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 50.0, 100.0, 250.0, 1000.0);
+
+# Timing of a phase
+class PhaseTimer:
+	def __init__(self):
+		self.count = 0;
+		self.total = 0.0;
+		self.min = None;
+		self.max = 0.0;
+		self.last = 0.0;
+		self.histogram = [0] * (len(HISTOGRAM_EDGES) + 1);
+
+	# Add the time of a run, in milliseconds
+	def add(self, ms):
+		self.count += 1;
+		self.total += ms;
+		self.last = ms;
+		self.min = ms if self.min is None else min(self.min, ms);
+		self.max = max(self.max, ms);
+		self.histogram[bisect.bisect_left(HISTOGRAM_EDGES, ms)] += 1;
+
+	# Mean time in milliseconds
+	@property
+	def mean(self):
+		return self.total / self.count if self.count else 0.0;
+
+	# Get everything as a dictionary
+	def to_dict(self):
+		return {"count": self.count, "total_ms": self.total, "mean_ms": self.mean,
+			"min_ms": self.min or 0.0, "max_ms": self.max, "last_ms": self.last, "histogram": list(self.histogram)};
+
+# Per-phase timings and counters
+#   Counters keep a running total and the value since the last new_frame() call
+class PhaseStats:
+	def __init__(self, enabled=False):
+		self.enabled = enabled;
+		self.reset();
+
+	# Clear everything
+	def reset(self):
+		self.phases = {};
+		self.counters = {};
+		self.frame = {};
+
+	# Time a phase
+	@contextmanager
+	def timed(self, name):
+		if not self.enabled:
+			yield;
+			return;
+		start = time.perf_counter();
+		try:
+			yield;
+		finally:
+			self.add_time(name, (time.perf_counter() - start) * 1000.0);
+
+	# Add the time of a phase, in milliseconds
+	def add_time(self, name, ms):
+		timer = self.phases.get(name);
+		if timer is None:
+			timer = self.phases[name] = PhaseTimer();
+		timer.add(ms);
+
+	# Add to a counter
+	def count(self, name, value=1):
+		if self.enabled:
+			self.counters[name] = self.counters.get(name, 0) + value;
+			self.frame[name] = self.frame.get(name, 0) + value;
+
+	# Start counting a new frame
+	def new_frame(self):
+		self.frame = {};
+
+	# Get everything as a dictionary
+	def to_dict(self):
+		return {
+			"histogram_edges_ms": list(HISTOGRAM_EDGES),
+			"phases": {name: timer.to_dict() for name, timer in sorted(self.phases.items())},
+			"counters": dict(sorted(self.counters.items())),
+			"last_frame": dict(sorted(self.frame.items())),
+		};
+
+	# Write everything as JSON
+	def write_json(self, path):
+		with open(path, "w") as file:
+			json.dump(self.to_dict(), file, indent=1);
@@ -0,0 +1,46 @@
+'''
+	Synthetic SVP model generator
+	See LICENSE for copyright and license details.
+
+	Generates deterministic models for benchmarks and stress tests. The same arguments
+	always give the same model, on every platform.
+'''
+
+# Imports
+import numpy as np;
+from .model import (SVPModel, MAX_FACES, encode_svp, write_svp);
+
+# Spread of the face centers and of the corners around them, in 8.8 fixed point
+CENTER_RANGE = 0x3000;
+CORNER_RANGE = 0x400;
+
+# Generate a model
+#   face_count  - Number of faces, up to the 65536 faces the header can hold
+#   quad_ratio  - Share of faces that are quads, the others are triangles
+#   seed        - Random seed
+def generate_model(face_count, quad_ratio=0.5, seed=0):
+	if not (1 <= face_count <= MAX_FACES):
+		raise ValueError("Face count must be between 1 and %d." % MAX_FACES);
+	rng = np.random.RandomState(seed);
+
+	# Faces
+	face_sizes = np.where(rng.random_sample(face_count) < quad_ratio, 4, 3).astype(np.uint8);
+	loop_count = int(face_sizes.sum(dtype=np.int64));
+	palette = rng.randint(0, 0x100, face_count).astype(np.uint8);
+	dither = (rng.random_sample(face_count) < 0.25).astype(np.uint8);
+	cull = (rng.random_sample(face_count) < 0.5).astype(np.uint8);
+	flags = rng.randint(0, 0x10, face_count).astype(np.uint8);
+
+	# Corners scattered around the center of their face
+	centers = rng.randint(-CENTER_RANGE, CENTER_RANGE, (face_count, 3));
+	coords = np.repeat(centers, face_sizes, 0) + rng.randint(-CORNER_RANGE, CORNER_RANGE, (loop_count, 3));
+
+	return SVPModel(coords.astype(np.int16), np.arange(loop_count, dtype=np.int32), face_sizes, palette, dither, cull, flags);
+
+# Generate an encoded model
+def generate_svp(face_count, quad_ratio=0.5, seed=0):
+	return bytes(encode_svp(generate_model(face_count, quad_ratio, seed)));
+
+# Generate a model file
+def write_synthetic(path, face_count, quad_ratio=0.5, seed=0):
+	write_svp(path, generate_model(face_count, quad_ratio, seed));
@@ -0,0 +1,208 @@
+'''
+	Export validation and fixes for SVP models
+	See LICENSE for copyright and license details.
+
+	Checks every face of a model at once before it is encoded, and reports every problem
+	with the indices of the faces that have it, instead of stopping at the first one.
+	Fixes are optional and work on the whole model at once as well.
+'''
+
+# Imports
+import numpy as np;
+from .model import (MAX_FACES, build_svp_model);
+
+# Problems
+ISSUE_NGON = "NGON";
+ISSUE_OVERFLOW = "OVERFLOW";
+ISSUE_NON_PLANAR = "NON_PLANAR";
+ISSUE_MISSING_LAYER = "MISSING_LAYER";
+ISSUE_FACE_COUNT = "FACE_COUNT";
+
+# Fixes, in the order they are applied
+FIX_NGONS = "NGONS";
+FIX_NON_PLANAR = "NON_PLANAR";
+FIX_RANGE = "RANGE";
+FIX_FACE_COUNT = "FACE_COUNT";
+
+# Problems each fix takes care of
+FIXED_ISSUES = {
+	FIX_NGONS: ISSUE_NGON,
+	FIX_NON_PLANAR: ISSUE_NON_PLANAR,
+	FIX_RANGE: ISSUE_OVERFLOW,
+	FIX_FACE_COUNT: ISSUE_FACE_COUNT,
+};
+
+# Range of 8.8 fixed point coordinates
+FIXED_MIN = -0x8000;
+FIXED_MAX = 0x7FFF;
+
+# Distance in Blender units a quad corner can be off the plane of the quad, one fixed point step
+PLANAR_TOLERANCE = 1.0 / 256.0;
+
+# Most face indices listed in a message
+MAX_LISTED_FACES = 10;
+
+# A problem found in a model
+#   kind  - One of the ISSUE_ constants
+#   faces - Indices of the faces with the problem, empty if it is not about faces
+#   error - Whether the model cannot be exported like this, otherwise it is a warning
+#   fixed - Whether a fix took care of it
+class ValidationIssue:
+	def __init__(self, kind, message, faces=(), error=True):
+		self.kind = kind;
+		self.message = message;
+		self.faces = np.asarray(faces, np.int64);
+		self.error = error;
+		self.fixed = False;
+
+	def __str__(self):
+		text = self.message;
+		if len(self.faces) > 0:
+			listed = ", ".join("%d" % face for face in self.faces[:MAX_LISTED_FACES]);
+			more = ", ..." if len(self.faces) > MAX_LISTED_FACES else "";
+			text += " (%d faces: %s%s)" % (len(self.faces), listed, more);
+		if self.fixed:
+			text += ", fixed";
+		return text;
+
+# Index of the first corner of every face
+def corner_starts(face_sizes):
+	face_sizes = np.asarray(face_sizes, np.int64);
+	return np.cumsum(face_sizes) - face_sizes;
+
+# Get how far the corners of every quad are off its plane, 0 for any other face
+#   positions - (L, 3) position of every face corner, in face order
+def quad_distances(positions, face_sizes):
+	positions = np.asarray(positions, np.float64).reshape(-1, 3);
+	face_sizes = np.asarray(face_sizes, np.int64);
+	distances = np.zeros(len(face_sizes), np.float64);
+	quads = np.nonzero(face_sizes == 4)[0];
+	if len(quads) == 0:
+		return distances;
+
+	# The diagonals of a quad give its normal, the plane goes through the center
+	corners = positions[corner_starts(face_sizes)[quads][:, None] + np.arange(4)];
+	normals = np.cross(corners[:, 2] - corners[:, 0], corners[:, 3] - corners[:, 1]);
+	lengths = np.sqrt(np.einsum("ij,ij->i", normals, normals));
+	offsets = corners - corners.mean(1)[:, None];
+	heights = np.abs(np.einsum("ij,ikj->ik", normals, offsets)).max(1);
+	distances[quads] = np.where(lengths > 0.0, heights / np.where(lengths > 0.0, lengths, 1.0), 0.0);
+	return distances;
+
+# Check a model before building it, returns every problem found
+#   positions      - (L, 3) float position of every face corner, in face order
+#   face_sizes     - Corner count of every face
+#   missing_layers - Names of the face layers the mesh does not have
+def validate_faces(positions, face_sizes, missing_layers=(), planar_tolerance=PLANAR_TOLERANCE, max_faces=MAX_FACES):
+	positions = np.asarray(positions, np.float64).reshape(-1, 3);
+	face_sizes = np.asarray(face_sizes, np.int64);
+	faces = np.repeat(np.arange(len(face_sizes)), face_sizes);
+	issues = [];
+
+	# Faces the format cannot hold
+	ngons = np.nonzero(face_sizes > 4)[0];
+	if len(ngons) > 0:
+		issues.append(ValidationIssue(ISSUE_NGON, "Faces with more than 4 vertices", ngons));
+
+	# Coordinates that wrap around in 8.8 fixed point
+	fixed = np.trunc(positions * 256.0);
+	overflow = np.unique(faces[np.any((fixed < FIXED_MIN) | (fixed > FIXED_MAX), 1)]);
+	if len(overflow) > 0:
+		issues.append(ValidationIssue(ISSUE_OVERFLOW, "Coordinates outside of -128 to 127.996", overflow));
+
+	# Quads that are not flat
+	non_planar = np.nonzero(quad_distances(positions, face_sizes) > planar_tolerance)[0];
+	if len(non_planar) > 0:
+		issues.append(ValidationIssue(ISSUE_NON_PLANAR, "Quads that are not flat", non_planar, False));
+
+	# Face layers that get their default value
+	for name in missing_layers:
+		issues.append(ValidationIssue(ISSUE_MISSING_LAYER, "No %s layer, every face gets the default" % name, (), False));
+
+	# Face count, the header holds the count minus one
+	if len(face_sizes) == 0:
+		issues.append(ValidationIssue(ISSUE_FACE_COUNT, "No faces"));
+	elif len(face_sizes) > max_faces:
+		issues.append(ValidationIssue(ISSUE_FACE_COUNT, "More than %d faces" % max_faces, np.arange(max_faces, len(face_sizes))));
+
+	return issues;
+
+# Split faces into quads and a triangle, fanning from their first corner
+#   split - Mask of the faces to split, every face if None. Quads that are split become two triangles.
+#   Returns the new positions, face sizes and the source face of every new face
+def split_faces(positions, face_sizes, split=None):
+	positions = np.asarray(positions).reshape(-1, 3);
+	face_sizes = np.asarray(face_sizes, np.int64);
+	split = np.ones(len(face_sizes), bool) if split is None else np.asarray(split, bool);
+
+	# Pieces of every face, corners 0, 2k+1, 2k+2 and 2k+3 of a face make piece k
+	step = np.where(split & (face_sizes == 4), 1, 2);
+	pieces = np.where(split, np.maximum((face_sizes - 2 + step - 1) // step, 1), 1);
+	sources = np.repeat(np.arange(len(face_sizes)), pieces);
+	piece = np.arange(len(sources)) - np.repeat(np.cumsum(pieces) - pieces, pieces);
+	piece_step = step[sources];
+	first = (piece * piece_step) + 1;
+	sizes = np.where(split[sources], np.where(piece_step == 1, 3, np.where(first + 2 < face_sizes[sources], 4, 3)), face_sizes[sources]);
+	local = np.stack([np.zeros_like(first), first, first + 1, first + 2], 1);
+
+	# Gather the corners of every piece
+	corners = corner_starts(face_sizes)[sources][:, None] + local;
+	keep = np.arange(4) < sizes[:, None];
+	return positions[corners[keep]], sizes, sources;
+
+# Clamp positions into the 8.8 fixed point range, positions in range are left alone so they encode like before
+def clamp_positions(positions):
+	return np.clip(np.asarray(positions, np.float64), FIXED_MIN / 256.0, FIXED_MAX / 256.0);
+
+# Split faces into groups of at most max_faces, returns the (start, end) face range of every group
+def face_groups(face_count, max_faces=MAX_FACES):
+	return [(start, min(start + max_faces, face_count)) for start in range(0, face_count, max_faces)];
+
+# Validate, fix and build the models of a mesh for export
+#   positions  - (L, 3) float position of every face corner, in face order, Blender axis order
+#   face_sizes - Corner count of every face
+#   values     - Palette, dither, cull and flags of every face
+#   fixes      - Fixes to apply, from the FIX_ constants
+#   Returns the models (empty if errors are left) and every problem found, with the face indices of the mesh
+def prepare_models(positions, face_sizes, values, missing_layers=(), fixes=(), planar_tolerance=PLANAR_TOLERANCE, max_faces=MAX_FACES):
+	positions = np.asarray(positions, np.float64).reshape(-1, 3);
+	face_sizes = np.asarray(face_sizes, np.int64);
+	values = [np.asarray(value) for value in values];
+	issues = validate_faces(positions, face_sizes, missing_layers, planar_tolerance, max_faces);
+
+	# Apply the fixes, keeping track of the face every new face comes from
+	sources = np.arange(len(face_sizes));
+	split = np.zeros(len(face_sizes), bool);
+	if FIX_NGONS in fixes:
+		split |= face_sizes > 4;
+	if FIX_NON_PLANAR in fixes:
+		split |= quad_distances(positions, face_sizes) > planar_tolerance;
+	if np.any(split):
+		positions, face_sizes, sources = split_faces(positions, face_sizes, split);
+	if FIX_RANGE in fixes:
+		positions = clamp_positions(positions);
+
+	# Check again, anything still wrong that was not found before is reported with the faces it came from
+	if len(fixes) > 0:
+		fixed_kinds = {FIXED_ISSUES[fix] for fix in fixes};
+		left = validate_faces(positions, face_sizes, (), planar_tolerance, max_faces if (FIX_FACE_COUNT not in fixes) else len(face_sizes) + 1);
+		left_kinds = {issue.kind for issue in left};
+		for issue in issues:
+			issue.fixed = (issue.kind in fixed_kinds) and (issue.kind not in left_kinds);
+		reported = {issue.kind for issue in issues if not issue.fixed};
+		for issue in left:
+			if issue.kind not in reported:
+				issue.faces = np.unique(sources[issue.faces]);
+				issues.append(issue);
+	if any(issue.error and not issue.fixed for issue in issues):
+		return [], issues;
+
+	# Build the models, split into groups the header can hold
+	starts = corner_starts(face_sizes);
+	models = [];
+	for start, end in face_groups(len(face_sizes), max_faces):
+		corner_start = starts[start];
+		corner_end = starts[end - 1] + face_sizes[end - 1];
+		models.append(build_svp_model(positions[corner_start:corner_end], face_sizes[start:end],
+			*[value[sources[start:end]] for value in values]));
+	return models, issues;